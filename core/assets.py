@@ -0,0 +1,91 @@
+import logging
+import posixpath
+import re
+from pathlib import Path
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template import engines
+
+logger = logging.getLogger(__name__)
+
+# Apps whose static files are pruned to what the templates reference; other apps (e.g. admin) ship whole
+STATIC_PRUNE_APPS = getattr(settings, 'STATIC_PRUNE_APPS', ['core'])
+
+_STATIC_TAG_RE = re.compile(r"""{%\s*static\s+(['"])(?P<path>[^'"]+)\1\s*%}""")
+_TEMPLATE_TAG_RE = re.compile(r"""{%\s*(?:extends|include)\s+(['"])(?P<name>[^'"]+)\1""")
+_CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)(?P<url>[^'")]+)\1\s*\)|@import\s+(['"])(?P<import>[^'"]+)\3""")
+
+
+def template_files():
+    """Every template source file of the configured engines (DIRS and app template dirs)."""
+    for engine in engines.all():
+        for directory in getattr(engine, 'template_dirs', ()):
+            directory = Path(directory)
+            if directory.is_dir():
+                yield from directory.rglob('*.html')
+
+
+def template_static_refs(source: str) -> set:
+    """Static paths used with literal `{% static '...' %}` tags in a template source."""
+    return {match.group('path').strip() for match in _STATIC_TAG_RE.finditer(source)}
+
+
+def css_refs(css_path: str, source: str) -> set:
+    """Static paths a stylesheet loads through url(...) or @import, resolved relative to it."""
+    refs = set()
+    base = posixpath.dirname(css_path)
+    for match in _CSS_URL_RE.finditer(source):
+        url = (match.group('url') or match.group('import')).strip()
+        if url.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+            continue
+        url = url.split('#', 1)[0].split('?', 1)[0]
+        if url:
+            refs.add(posixpath.normpath(posixpath.join(base, url)))
+    return refs
+
+
+def expand_refs(paths) -> tuple:
+    """
+    Follows stylesheet references from `paths` (fonts, images, imports).
+    Returns (found {static path: absolute file}, missing static paths).
+    """
+    found, missing = {}, set()
+    pending = list(paths)
+    while pending:
+        path = pending.pop()
+        if path in found or path in missing:
+            continue
+        absolute = finders.find(path)
+        if absolute is None:
+            missing.add(path)
+            continue
+        found[path] = absolute
+        if path.endswith('.css'):
+            source = Path(absolute).read_text(encoding='utf-8', errors='replace')
+            pending.extend(css_refs(path, source))
+    return found, missing
+
+
+def referenced_assets() -> tuple:
+    """Assets reachable from any template. Returns (found {static path: absolute file}, missing)."""
+    refs = set()
+    for template in template_files():
+        refs |= template_static_refs(template.read_text(encoding='utf-8', errors='replace'))
+    return expand_refs(refs)
+
+
+def page_static_refs(template_name: str) -> set:
+    """Static paths a page loads directly: its template plus everything it extends or includes."""
+    engine = engines['django'].engine
+    refs, seen = set(), set()
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        template, _ = engine.find_template(name)
+        source = template.source
+        refs |= template_static_refs(source)
+        pending.extend(match.group('name') for match in _TEMPLATE_TAG_RE.finditer(source))
+    return refs
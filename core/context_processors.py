@@ -1,11 +1,18 @@
 # core/context_processors.py
 
-from core.models import OpenAISettings
+from core.navigation import AGENT_NAV_CACHE_TTL, agent_nav_version, get_agent_nav
 
 def global_agents(request):
-    """Adds all available agents to the template context globally."""
+    """
+    Adds all available agents to the template context globally.
+    `all_agents` is a callable, so the (cached) list is only fetched when a template
+    actually iterates it, i.e. when the layout's nav fragment is not cached either.
+    """
+    version = agent_nav_version()
     return {
-        'all_agents': OpenAISettings.objects.all().order_by('agent_name'),
+        'all_agents': lambda: get_agent_nav(version),
+        'agent_nav_version': version,
+        'agent_nav_ttl': AGENT_NAV_CACHE_TTL,
     }
 
 # ولا تنسى إضافته إلى settings.py
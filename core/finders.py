@@ -0,0 +1,23 @@
+import logging
+from django.contrib.staticfiles.finders import AppDirectoriesFinder
+from .assets import STATIC_PRUNE_APPS, referenced_assets
+
+logger = logging.getLogger(__name__)
+
+
+class ReferencedAppDirectoriesFinder(AppDirectoriesFinder):
+    """
+    AppDirectoriesFinder that only lists (so `collectstatic` only emits) the files of
+    STATIC_PRUNE_APPS that templates reference, directly or through their stylesheets.
+    The rest of the bundled admin theme stays in the repo but is not deployed.
+    Lookups (`find`) are unchanged, so runserver still serves any file.
+    """
+
+    def list(self, ignore_patterns):
+        referenced, missing = referenced_assets()
+        for path in sorted(missing):
+            logger.warning(f"⚠️ STATIC: Template references missing asset '{path}'.")
+        for path, storage in super().list(ignore_patterns):
+            app = next((app for app, app_storage in self.storages.items() if app_storage is storage), None)
+            if app not in STATIC_PRUNE_APPS or path.replace('\\', '/') in referenced:
+                yield path, storage
@@ -44,6 +44,51 @@ class OpenAISettingsForm(forms.ModelForm):
         widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.1', 'min': '0', 'max': '2'})
     )
 
+    context_similarity_floor = forms.FloatField(
+        required=True,
+        label="Context Similarity Floor",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.05', 'min': '0', 'max': '1'})
+    )
+
+    context_token_budget = forms.IntegerField(
+        required=True,
+        label="Context Token Budget",
+        min_value=100,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '100', 'min': '100'})
+    )
+
+    fast_model_name = forms.ChoiceField(
+        choices=[('', '---')] + OpenAISettings.MODEL_CHOICES,
+        required=False,
+        label="Fast Model",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    fallback_model_name = forms.ChoiceField(
+        choices=[('', '---')] + OpenAISettings.MODEL_CHOICES,
+        required=False,
+        label="Fallback Model",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    direct_answers = forms.BooleanField(
+        required=False,
+        label="Direct Answers",
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+
+    direct_answer_similarity = forms.FloatField(
+        required=True,
+        label="Direct Answer Similarity",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0', 'max': '1'})
+    )
+
+    direct_answer_margin = forms.FloatField(
+        required=True,
+        label="Direct Answer Margin",
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0', 'max': '1'})
+    )
+
     class Meta:
         model = OpenAISettings
         fields = [
@@ -54,4 +99,11 @@ class OpenAISettingsForm(forms.ModelForm):
             'top_p',
             'frequency_penalty',
             'presence_penalty',
+            'context_similarity_floor',
+            'context_token_budget',
+            'fast_model_name',
+            'fallback_model_name',
+            'direct_answers',
+            'direct_answer_similarity',
+            'direct_answer_margin',
         ]
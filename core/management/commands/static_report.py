@@ -0,0 +1,66 @@
+import gzip
+from pathlib import Path
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from core.assets import STATIC_PRUNE_APPS, expand_refs, page_static_refs, referenced_assets
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _sizes(files) -> tuple:
+    """(raw, gzip, brotli) bytes for the given absolute paths, compressed as collectstatic does."""
+    raw = gz = br = 0
+    for path in files:
+        data = Path(path).read_bytes()
+        raw += len(data)
+        gz += len(gzip.compress(data, compresslevel=9))
+        br += len(brotli.compress(data)) if brotli else len(data)
+    return raw, gz, br
+
+
+def _mb(size: int) -> str:
+    return f"{size / 2**20:.2f} MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports what the static build ships: the pruned bundle against the full theme, "
+        "and the asset bytes each page loads (raw, gzip and brotli)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', action='append', dest='pages',
+                            help="Template of a page to report. Defaults to the login and agent pages.")
+
+    def handle(self, *args, **options):
+        pages = options['pages'] or ['users/login.html', 'core/view_agent.html']
+
+        theme_files = [
+            path
+            for app in STATIC_PRUNE_APPS
+            for path in (Path(apps.get_app_config(app).path) / 'static').rglob('*')
+            if path.is_file()
+        ]
+        referenced, missing = referenced_assets()
+        theme_bytes = sum(path.stat().st_size for path in theme_files)
+        shipped_bytes = sum(Path(path).stat().st_size for path in referenced.values())
+        self.stdout.write(
+            f"bundle: {len(referenced)}/{len(theme_files)} files, {_mb(shipped_bytes)} of {_mb(theme_bytes)} "
+            f"({100 - 100 * shipped_bytes / max(1, theme_bytes):.1f}% smaller)"
+        )
+        for path in sorted(missing):
+            self.stdout.write(f"missing: {path}")
+
+        if brotli is None:
+            self.stdout.write("Brotli is not installed; brotli sizes show the raw size.")
+        self.stdout.write(f"{'page':<24} {'assets':>6} {'raw':>10} {'gzip':>10} {'brotli':>10}")
+        for page in pages:
+            # Files the page requests on load; fonts and images inside stylesheets load on demand
+            refs = page_static_refs(page)
+            found, _ = expand_refs(refs)
+            loaded = [path for name, path in found.items() if name in refs]
+            raw, gz, br = _sizes(loaded)
+            self.stdout.write(f"{page:<24} {len(loaded):>6} {_mb(raw):>10} {_mb(gz):>10} {_mb(br):>10}")
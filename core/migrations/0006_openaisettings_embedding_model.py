@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_openaisettings_delete_guest_delete_property_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaisettings',
+            name='embedding_dimensions',
+            field=models.PositiveIntegerField(blank=True, help_text='Shortened embedding size; empty uses the model default.', null=True),
+        ),
+        migrations.AddField(
+            model_name='openaisettings',
+            name='embedding_model',
+            field=models.CharField(choices=[('text-embedding-3-small', 'text-embedding-3-small'), ('text-embedding-3-large', 'text-embedding-3-large')], default='text-embedding-3-small', max_length=50),
+        ),
+    ]
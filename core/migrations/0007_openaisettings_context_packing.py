@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_openaisettings_embedding_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaisettings',
+            name='context_similarity_floor',
+            field=models.FloatField(default=0.25),
+        ),
+        migrations.AddField(
+            model_name='openaisettings',
+            name='context_token_budget',
+            field=models.PositiveIntegerField(default=1500),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_openaisettings_context_packing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaisettings',
+            name='fallback_model_name',
+            field=models.CharField(blank=True, choices=[('gpt-5', 'GPT-5'), ('gpt-5-mini', 'GPT-5 Mini'), ('gpt-4o', 'GPT-4o'), ('gpt-4o-mini', 'GPT-4o Mini'), ('gpt-4.1', 'GPT-4.1'), ('gpt-4.1-mini', 'GPT-4.1 Mini')], help_text='Used when the routed model is slow or failing; empty disables fallback.', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='openaisettings',
+            name='fast_model_name',
+            field=models.CharField(blank=True, choices=[('gpt-5', 'GPT-5'), ('gpt-5-mini', 'GPT-5 Mini'), ('gpt-4o', 'GPT-4o'), ('gpt-4o-mini', 'GPT-4o Mini'), ('gpt-4.1', 'GPT-4.1'), ('gpt-4.1-mini', 'GPT-4.1 Mini')], help_text='Faster model for short or well-covered questions; empty always uses the main model.', max_length=50),
+        ),
+    ]
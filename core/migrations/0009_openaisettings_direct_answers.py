@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_openaisettings_model_routing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaisettings',
+            name='direct_answer_margin',
+            field=models.FloatField(default=0.05),
+        ),
+        migrations.AddField(
+            model_name='openaisettings',
+            name='direct_answer_similarity',
+            field=models.FloatField(default=0.9),
+        ),
+        migrations.AddField(
+            model_name='openaisettings',
+            name='direct_answers',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -2,6 +2,10 @@ from django.db import models
 
 # Create your models here.
 
+def embedding_key(model: str, dimensions: int = None) -> str:
+    return f"{model}@{dimensions}" if dimensions else model
+
+
 class OpenAISettings(models.Model):
     MODEL_CHOICES = [
         ('gpt-5', 'GPT-5'),
@@ -33,11 +37,60 @@ class OpenAISettings(models.Model):
     presence_penalty = models.FloatField(default=0.0)
     updated_at = models.DateTimeField(auto_now=True)
 
+    EMBEDDING_MODEL_CHOICES = [
+        ('text-embedding-3-small', 'text-embedding-3-small'),
+        ('text-embedding-3-large', 'text-embedding-3-large'),
+    ]
+    # Changed only through a re-embedding job (manage.py reembed_knowledge), which
+    # switches it together with the stored knowledge vectors.
+    embedding_model = models.CharField(
+        max_length=50,
+        choices=EMBEDDING_MODEL_CHOICES,
+        default='text-embedding-3-small',
+    )
+    embedding_dimensions = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Shortened embedding size; empty uses the model default.'
+    )
+
+    # Retrieved knowledge below this cosine similarity is not sent to the model
+    context_similarity_floor = models.FloatField(default=0.25)
+    # Upper bound on knowledge tokens packed into the prompt
+    context_token_budget = models.PositiveIntegerField(default=1500)
+
+    # Model routing (webhook.routing): simple turns may go to a faster model, and
+    # the fallback model takes over while the routed model is slow or failing
+    fast_model_name = models.CharField(
+        max_length=50,
+        choices=MODEL_CHOICES,
+        blank=True,
+        help_text='Faster model for short or well-covered questions; empty always uses the main model.'
+    )
+    fallback_model_name = models.CharField(
+        max_length=50,
+        choices=MODEL_CHOICES,
+        blank=True,
+        help_text='Used when the routed model is slow or failing; empty disables fallback.'
+    )
+
+    # Direct answers (knowledge.canonical): a confident, unambiguous FAQ hit is answered with the
+    # entry's pre-generated canonical answer instead of a completion
+    direct_answers = models.BooleanField(default=False)
+    direct_answer_similarity = models.FloatField(default=0.9)
+    # Required lead of the best match over the runner-up
+    direct_answer_margin = models.FloatField(default=0.05)
+
 
     # optional metadata
     def __str__(self):
         return f"{self.agent_name} ({self.model_name})"
 
+    @property
+    def embedding_key(self):
+        """Identifies the vector space of this agent's embeddings (model plus dimensions)."""
+        return embedding_key(self.embedding_model, self.embedding_dimensions)
+
     class Meta:
         verbose_name = "OpenAI Setting"
         verbose_name_plural = "OpenAI Settings"
@@ -0,0 +1,40 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import OpenAISettings
+
+# Seconds a cached agent list (and the nav fragment rendered from it) is reused. With a shared
+# cache (REDIS_URL) a save invalidates it in every worker at once; with the per-process default
+# cache the other workers pick the change up within this window.
+AGENT_NAV_CACHE_TTL = getattr(settings, 'AGENT_NAV_CACHE_TTL', 300)
+
+_VERSION_KEY = 'core:agent_nav:version'
+
+
+def agent_nav_version() -> int:
+    """Current version of the agent list, bumped by invalidate_agent_nav(). Never queries the database."""
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        # A time-based start, so lists cached under a version that was evicted are never reused
+        cache.add(_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def get_agent_nav(version: int = None) -> list:
+    """Agents for the navigation menus, as [{'id', 'agent_name'}] sorted by name, from the cache."""
+    key = f'core:agent_nav:{version or agent_nav_version()}'
+    agents = cache.get(key)
+    if agents is None:
+        agents = list(OpenAISettings.objects.order_by('agent_name').values('id', 'agent_name'))
+        cache.set(key, agents, AGENT_NAV_CACHE_TTL)
+    return agents
+
+
+def invalidate_agent_nav():
+    """Called when an agent is created, renamed or deleted."""
+    try:
+        cache.incr(_VERSION_KEY)
+    except ValueError:
+        # No version cached yet; the next read starts a new one
+        pass
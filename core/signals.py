@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import OpenAISettings
+from .navigation import invalidate_agent_nav
+
+
+@receiver([post_save, post_delete], sender=OpenAISettings)
+def invalidate_nav_on_agent_change(sender, instance, **kwargs):
+    """The navigation menus list every agent by name."""
+    invalidate_agent_nav()
@@ -0,0 +1,35 @@
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+def _without_source_maps(patterns):
+    return tuple(
+        (extension, tuple(
+            pattern for pattern in extension_patterns
+            if 'sourceMappingURL' not in (pattern[0] if isinstance(pattern, tuple) else pattern)
+        ))
+        for extension, extension_patterns in patterns
+    )
+
+
+class StaticBuildStorage(CompressedManifestStaticFilesStorage):
+    """
+    Content-hashed names plus .gz/.br variants (whitenoise), for the pruned bundle.
+
+    The vendored theme files point at source maps that aren't shipped, which would
+    make the manifest step fail; those comments are left as they are instead of being
+    rewritten to hashed names.
+
+    manifest_strict is off and a reference to a file that wasn't collected renders
+    its unhashed URL (a 404 for that asset) instead of failing the whole page; the
+    finder already warns about such references at collectstatic time.
+    """
+
+    manifest_strict = False
+    patterns = _without_source_maps(CompressedManifestStaticFilesStorage.patterns)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not in the manifest and not on disk either, so it can't be hashed
+            return name
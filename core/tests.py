@@ -1,3 +1,75 @@
-from django.test import TestCase
+import tempfile
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from .assets import css_refs, referenced_assets, template_static_refs
+from .context_processors import global_agents
+from .finders import ReferencedAppDirectoriesFinder
+from .models import OpenAISettings
+from .navigation import agent_nav_version, get_agent_nav
+from .storage import StaticBuildStorage
 
-# Create your tests here.
+
+class StaticAssetTests(SimpleTestCase):
+    def test_static_tags_and_stylesheet_urls_are_parsed(self):
+        source = """{% load static %}<link href="{% static 'core/css/app.css' %}"><img src="{% static "core/images/logo.svg" %}">"""
+        self.assertEqual(template_static_refs(source), {'core/css/app.css', 'core/images/logo.svg'})
+
+        css = """@import "base.css"; .a { background: url('../images/bg.png?v=2'); }
+                 .b { src: url(../fonts/icons.woff2#iefix); } .c { background: url(data:image/png;base64,AA); }
+                 .d { background: url(https://cdn.example.com/x.png); }"""
+        self.assertEqual(
+            css_refs('core/css/app.css', css),
+            {'core/css/base.css', 'core/images/bg.png', 'core/fonts/icons.woff2'},
+        )
+
+    def test_every_template_reference_resolves(self):
+        found, missing = referenced_assets()
+        self.assertEqual(missing, set())
+        self.assertIn('core/images/logo.svg', found)
+
+    def test_finder_lists_only_referenced_files_of_pruned_apps(self):
+        found, _ = referenced_assets()
+        listed = {path.replace('\\', '/') for path, _ in ReferencedAppDirectoriesFinder().list([])}
+        self.assertIn('core/images/logo.svg', listed)
+        self.assertIn('admin/css/base.css', listed)
+        self.assertFalse({path for path in listed if path.startswith('core/')} - set(found))
+        self.assertNotIn('core/libs/jquery-bar-rating/themes/bars-pill.css', listed)
+
+    def test_uncollected_asset_renders_its_plain_name(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = StaticBuildStorage(location=location)
+            self.assertEqual(storage.stored_name('core/images/missing.png'), 'core/images/missing.png')
+            self.assertEqual(storage.url('core/images/missing.png'), '/static/core/images/missing.png')
+
+
+class AgentNavTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        OpenAISettings.objects.create(agent_name='Support')
+        OpenAISettings.objects.create(agent_name='Billing')
+
+    def test_agent_list_is_sorted_and_cached(self):
+        self.assertEqual([agent['agent_name'] for agent in get_agent_nav()], ['Billing', 'Support'])
+        with self.assertNumQueries(0):
+            get_agent_nav()
+
+    def test_agent_changes_bump_the_version(self):
+        version = agent_nav_version()
+        get_agent_nav(version)
+        agent = OpenAISettings.objects.create(agent_name='Sales')
+        self.assertGreater(agent_nav_version(), version)
+        self.assertEqual([agent['agent_name'] for agent in get_agent_nav()], ['Billing', 'Sales', 'Support'])
+
+        renamed = agent_nav_version()
+        agent.agent_name = 'Accounts'
+        agent.save()
+        self.assertGreater(agent_nav_version(), renamed)
+        agent.delete()
+        self.assertEqual([agent['agent_name'] for agent in get_agent_nav()], ['Billing', 'Support'])
+
+    def test_context_processor_defers_the_query(self):
+        with self.assertNumQueries(0):
+            context = global_agents(RequestFactory().get('/'))
+        self.assertEqual(context['agent_nav_version'], agent_nav_version())
+        with self.assertNumQueries(1):
+            self.assertEqual(len(context['all_agents']()), 2)
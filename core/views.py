@@ -1,17 +1,62 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponse, HttpResponseRedirect
 from django.urls import reverse
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.utils import timezone
 from .models import *
 from .forms import OpenAISettingsForm
+from webhook.models import DailyConversationStats
 
 # Create your views here.
+DASHBOARD_DAYS = 30
+
+
+def _average(seconds, count):
+    return round(seconds / count, 1) if count else None
+
+
 @login_required
 def index(request):
-    agents = OpenAISettings.objects.all().order_by('agent_name')
-    return render(request, 'core/index.html')
+    # Reads only the daily rollups (at most DASHBOARD_DAYS rows per agent), never Message/Response,
+    # so the page cost doesn't grow with message volume. Kept fresh by the rollup_conversations command.
+    today = timezone.localdate()
+    since = today - timedelta(days=DASHBOARD_DAYS - 1)
+    rows = DailyConversationStats.objects.filter(date__gte=since).select_related('agent')
+
+    totals = {'messages': 0, 'text_messages': 0, 'image_messages': 0, 'voice_messages': 0,
+              'responses': 0, 'response_seconds': 0.0, 'active_today': 0}
+    days = {}
+    agents = {}
+    for row in rows:
+        for field in ('messages', 'text_messages', 'image_messages', 'voice_messages', 'responses', 'response_seconds'):
+            totals[field] += getattr(row, field)
+        if row.date == today:
+            totals['active_today'] += row.active_clients
+
+        day = days.setdefault(row.date, {'date': row.date, 'messages': 0, 'active_clients': 0, 'responses': 0, 'response_seconds': 0.0})
+        day['messages'] += row.messages
+        day['active_clients'] += row.active_clients
+        day['responses'] += row.responses
+        day['response_seconds'] += row.response_seconds
+
+        name = row.agent.agent_name if row.agent else 'غير محدد'
+        agent = agents.setdefault(row.agent_id, {'name': name, 'messages': 0, 'text_messages': 0, 'image_messages': 0,
+                                                 'voice_messages': 0, 'responses': 0, 'response_seconds': 0.0})
+        for field in ('messages', 'text_messages', 'image_messages', 'voice_messages', 'responses', 'response_seconds'):
+            agent[field] += getattr(row, field)
+
+    for entry in list(days.values()) + list(agents.values()):
+        entry['avg_response_seconds'] = _average(entry['response_seconds'], entry['responses'])
+
+    return render(request, 'core/index.html', {
+        'dashboard_days': DASHBOARD_DAYS,
+        'totals': totals,
+        'avg_response_seconds': _average(totals['response_seconds'], totals['responses']),
+        'daily_stats': sorted(days.values(), key=lambda day: day['date'], reverse=True),
+        'agent_stats': sorted(agents.values(), key=lambda agent: agent['messages'], reverse=True),
+    })
 
 @login_required
 def view_agent(request, agent_id):
@@ -0,0 +1,8 @@
+# Picked up automatically by gunicorn when started from the project directory.
+# Add --preload (or preload_app = True) to import the heavy dependencies once in the master.
+
+
+def post_worker_init(worker):
+    # Connection pools and retrieval indexes are per process, so they are warmed after the fork
+    from webhook.warmup import start_warm_up
+    start_warm_up()
@@ -33,6 +33,119 @@ EVOLUTION_KEY = os.getenv('EVOLUTION_KEY')
 SERVER_URL = os.getenv('SERVER_URL')
 INSTANCE_ID = os.getenv('EVLUATION_INSTANCE_ID')
 
+# Seconds a cached agent is trusted before its updated_at is re-checked
+AGENT_CACHE_TTL = int(os.getenv('AGENT_CACHE_TTL', 30))
+
+# Webhook media larger than this many bytes is spooled to a temp file instead of memory
+WEBHOOK_MEDIA_SPOOL_MAX_MEMORY = int(os.getenv('WEBHOOK_MEDIA_SPOOL_MAX_MEMORY', 1024 * 1024))
+# Webhook bodies are streamed (DATA_UPLOAD_MAX_MEMORY_SIZE doesn't apply); larger ones get a 413.
+# WhatsApp voice notes go up to 16 MB, about 21.5 MB once base64-encoded.
+WEBHOOK_MAX_BODY_SIZE = int(os.getenv('WEBHOOK_MAX_BODY_SIZE', 32 * 1024 * 1024))
+
+# Write-behind persistence of Message/Response rows
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', 0.5))
+PERSISTENCE_BATCH_SIZE = int(os.getenv('PERSISTENCE_BATCH_SIZE', 100))
+CLIENT_CACHE_SIZE = int(os.getenv('CLIENT_CACHE_SIZE', 10000))
+
+# Messages older than this are moved to ArchivedMessage by `manage.py archive_messages`;
+# archived rows older than MESSAGE_RETENTION_DAYS are deleted (0 keeps them forever)
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_DAYS', 90))
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', 0))
+
+# Background message processing threads (each holds at most one DB connection)
+BACKGROUND_MAX_WORKERS = int(os.getenv('BACKGROUND_MAX_WORKERS', 8))
+# Threads for long jobs (document ingestion, canonical answers), kept apart so they can't starve messages
+BACKGROUND_JOB_WORKERS = int(os.getenv('BACKGROUND_JOB_WORKERS', 2))
+# Threads for network-bound stages (e.g. the embedding call) that overlap a message's DB work
+PIPELINE_MAX_WORKERS = int(os.getenv('PIPELINE_MAX_WORKERS', 16))
+
+# Outbox relay: rescan interval (seconds), entries per claim, delivery attempts before giving up
+OUTBOX_RELAY_INTERVAL = float(os.getenv('OUTBOX_RELAY_INTERVAL', 5))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+
+# Webhook idempotency: seconds a message key is remembered, and keys cached per process
+WEBHOOK_IDEMPOTENCY_TTL = int(os.getenv('WEBHOOK_IDEMPOTENCY_TTL', 24 * 3600))
+WEBHOOK_IDEMPOTENCY_CACHE_SIZE = int(os.getenv('WEBHOOK_IDEMPOTENCY_CACHE_SIZE', 50000))
+
+# Dashboard rollups: messages younger than ROLLUP_LAG_SECONDS wait for the next run, rows read per transaction
+ROLLUP_LAG_SECONDS = int(os.getenv('ROLLUP_LAG_SECONDS', 120))
+ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', 5000))
+
+# Conversation export: messages read per keyset range
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# Worker warm-up (gunicorn.conf.py): on/off, pre-connecting to OpenAI/Evolution, and which agents' indexes to preload
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'True') == 'True'
+WARMUP_CONNECT = os.getenv('WARMUP_CONNECT', 'True') == 'True'
+WARMUP_ACTIVE_DAYS = int(os.getenv('WARMUP_ACTIVE_DAYS', 7))
+WARMUP_MAX_AGENTS = int(os.getenv('WARMUP_MAX_AGENTS', 20))
+
+# Voice notes longer than TRANSCRIBE_CHUNK_THRESHOLD seconds are split at pauses into ~TRANSCRIBE_SEGMENT_SECONDS
+# segments, TRANSCRIBE_CONCURRENCY of them transcribed at once
+TRANSCRIBE_CHUNK_THRESHOLD = float(os.getenv('TRANSCRIBE_CHUNK_THRESHOLD', 45))
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv('TRANSCRIBE_SEGMENT_SECONDS', 30))
+TRANSCRIBE_CONCURRENCY = int(os.getenv('TRANSCRIBE_CONCURRENCY', 4))
+
+# OpenAI call deadlines: default request timeout (s), and the end-to-end budget of one message (webhook arrival
+# to queued reply, debounce included) that per-call timeouts are carved from, never below OPENAI_MIN_TIMEOUT.
+# With hedging, a call slower than its model's observed p95 gets a duplicate and the first answer wins.
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))
+MESSAGE_SLA_SECONDS = float(os.getenv('MESSAGE_SLA_SECONDS', 60))
+OPENAI_MIN_TIMEOUT = float(os.getenv('OPENAI_MIN_TIMEOUT', 3))
+OPENAI_HEDGE_ENABLED = os.getenv('OPENAI_HEDGE_ENABLED', 'False') == 'True'
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv('OPENAI_HEDGE_MIN_SAMPLES', 20))
+OPENAI_HEDGE_MAX_WORKERS = int(os.getenv('OPENAI_HEDGE_MAX_WORKERS', 16))
+
+# Model routing: turns up to ROUTING_SIMPLE_MAX_WORDS words, or whose best knowledge match scores at least
+# ROUTING_CONFIDENT_SIMILARITY, go to the agent's fast model. A model whose p90 latency (seconds) or error rate
+# over its last ROUTING_WINDOW calls crosses the thresholds is replaced by the fallback for ROUTING_COOLDOWN seconds.
+ROUTING_SIMPLE_MAX_WORDS = int(os.getenv('ROUTING_SIMPLE_MAX_WORDS', 6))
+ROUTING_CONFIDENT_SIMILARITY = float(os.getenv('ROUTING_CONFIDENT_SIMILARITY', 0.8))
+ROUTING_LATENCY_THRESHOLD = float(os.getenv('ROUTING_LATENCY_THRESHOLD', 12))
+ROUTING_ERROR_RATE_THRESHOLD = float(os.getenv('ROUTING_ERROR_RATE_THRESHOLD', 0.3))
+ROUTING_WINDOW = int(os.getenv('ROUTING_WINDOW', 50))
+ROUTING_MIN_SAMPLES = int(os.getenv('ROUTING_MIN_SAMPLES', 10))
+ROUTING_COOLDOWN = int(os.getenv('ROUTING_COOLDOWN', 60))
+
+# Profiling (webhook.profiling): fraction of messages profiled with sampled stacks without the staff toggle
+# (webhook/profiling/), sampling period, how long the toggle stays on, and profiles kept
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.0))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_TOGGLE_TTL = int(os.getenv('PROFILE_TOGGLE_TTL', 3600))
+PROFILE_MAX_STORED = int(os.getenv('PROFILE_MAX_STORED', 200))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 10))
+
+# Document ingestion: chunk size/overlap in tokens, and embedding batching
+INGEST_CHUNK_TOKENS = int(os.getenv('INGEST_CHUNK_TOKENS', 400))
+INGEST_CHUNK_OVERLAP = int(os.getenv('INGEST_CHUNK_OVERLAP', 60))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv('INGEST_EMBED_BATCH_SIZE', 64))
+INGEST_EMBED_CONCURRENCY = int(os.getenv('INGEST_EMBED_CONCURRENCY', 4))
+
+# Re-embedding jobs (manage.py reembed_knowledge): batch size and pause between batches
+REEMBED_BATCH_SIZE = int(os.getenv('REEMBED_BATCH_SIZE', 100))
+REEMBED_SLEEP = float(os.getenv('REEMBED_SLEEP', 0.5))
+
+# Direct answers: knowledge entries read per query when looking for missing or stale canonical answers
+CANONICAL_BATCH_SIZE = int(os.getenv('CANONICAL_BATCH_SIZE', 200))
+
+# Retrieval: 'two_stage' scans 256-dim Matryoshka prefixes, then reranks the best candidates on full vectors
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'two_stage')
+RETRIEVAL_PREFIX_DIMS = int(os.getenv('RETRIEVAL_PREFIX_DIMS', 256))
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', 200))
+RETRIEVAL_INDEX_TTL = int(os.getenv('RETRIEVAL_INDEX_TTL', 30))
+# Per-process memory budget (MB) for agent indexes; cold agents are evicted least recently used first
+RETRIEVAL_INDEX_MEMORY_BUDGET = int(os.getenv('RETRIEVAL_INDEX_MEMORY_BUDGET_MB', 512)) * 1024 * 1024
+
+# Context packing: candidates retrieved per message, score-gap cutoff and near-duplicate threshold
+# (the similarity floor and token budget are per agent)
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', 8))
+CONTEXT_MAX_SCORE_GAP = float(os.getenv('CONTEXT_MAX_SCORE_GAP', 0.15))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', 0.8))
+# Index compression: 'none', 'int8' or 'binary' (quantized indexes rerank candidates on exact vectors)
+RETRIEVAL_QUANTIZATION = os.getenv('RETRIEVAL_QUANTIZATION', 'none')
+RETRIEVAL_RERANK_CANDIDATES = int(os.getenv('RETRIEVAL_RERANK_CANDIDATES', 50))
+
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -111,9 +224,30 @@ DATABASES = {
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST"),
         'PORT': os.getenv("DB_PORT", 5432),
+        # Keep connections open between requests/background jobs, and verify them before reuse
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Cache (agent navigation and template fragments). With REDIS_URL (e.g. redis://redis:6379/1,
+# the docker-compose service) all workers share it, so agent changes show up everywhere at once;
+# otherwise each process keeps its own copy for AGENT_NAV_CACHE_TTL seconds.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+AGENT_NAV_CACHE_TTL = int(os.getenv('AGENT_NAV_CACHE_TTL', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,7 +289,21 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# STATICFILES_STORAGE is ignored since Django 5.1; the static storage is configured through STORAGES.
+# collectstatic emits content-hashed names (served by whitenoise with immutable cache headers)
+# plus .gz and .br variants (brotli needs the Brotli package); see core.storage.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'core.storage.StaticBuildStorage'},
+}
+# Only the assets the templates reference are collected from these apps (see core.finders)
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'core.finders.ReferencedAppDirectoriesFinder',
+]
+STATIC_PRUNE_APPS = ['core']
+# Templates only link hashed names, so the unhashed copies aren't written
+WHITENOISE_KEEP_ONLY_HASHED_FILES = True
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iGPT.settings')
 
 application = get_wsgi_application()
+
+# Import the heavy dependencies the request path loads lazily. With `gunicorn --preload`
+# this runs once in the master and the workers share the pages; the per-worker part of
+# the warm-up (connections, indexes) starts from post_worker_init in gunicorn.conf.py.
+from webhook.warmup import WARMUP_ENABLED, warm_imports  # noqa: E402
+
+if WARMUP_ENABLED:
+    warm_imports()
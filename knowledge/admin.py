@@ -3,3 +3,5 @@ from .models import *
 
 # Register your models here.
 admin.site.register(KnowledgeBase)
+admin.site.register(DocumentIngestion)
+admin.site.register(ReembeddingJob)
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from django.db import transaction
+from core.models import OpenAISettings
+from .models import KnowledgeBase
+
+logger = logging.getLogger(__name__)
+
+# Entries read per query while looking for missing or stale canonical answers
+CANONICAL_BATCH_SIZE = getattr(settings, 'CANONICAL_BATCH_SIZE', 200)
+
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def canonical_key(agent: OpenAISettings, entry: KnowledgeBase) -> str:
+    """Identifies what a canonical answer was generated from: the entry's brief and text and the agent's prompt and model."""
+    source = '\0'.join((agent.model_name, agent.system_context or '', entry.brief or '', entry.question))
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _generate(agent: OpenAISettings, entry: KnowledgeBase) -> str:
+    from webhook.rag_utilities import complete_answer
+    # Answered like a user asking the entry's topic, with the entry as the only context
+    return complete_answer(entry.brief or entry.question, [entry.question], None, agent, agent.model_name)
+
+
+def generate_canonical_answers(agent_id: int, batch_size: int = CANONICAL_BATCH_SIZE) -> int:
+    """
+    Generates canonical answers for the agent's curated entries (document chunks are
+    skipped) that have none or whose key no longer matches. Rows edited meanwhile are
+    left for the next run. Saved with a queryset update, so `updated_at` and the
+    retrieval index are untouched. Returns the number of answers written.
+    """
+    agent = OpenAISettings.objects.get(pk=agent_id)
+    written, last_id = 0, 0
+    while True:
+        entries = list(
+            KnowledgeBase.objects.filter(agent_id=agent_id, source__isnull=True, id__gt=last_id)
+            .only('id', 'brief', 'question', 'canonical_answer_key')
+            .order_by('id')[:batch_size]
+        )
+        if not entries:
+            break
+        last_id = entries[-1].id
+        for entry in entries:
+            key = canonical_key(agent, entry)
+            if entry.canonical_answer_key == key:
+                continue
+            try:
+                answer = _generate(agent, entry)
+            except Exception as e:
+                logger.warning(f"⚠️ CANONICAL: Entry {entry.id} of agent {agent_id} failed: {e}")
+                continue
+            written += KnowledgeBase.objects.filter(pk=entry.pk, brief=entry.brief, question=entry.question).update(
+                canonical_answer=answer, canonical_answer_key=key
+            )
+    logger.info(f"📌 CANONICAL: {written} canonical answers written for agent {agent_id}.")
+    return written
+
+
+def _run_scheduled(agent_id: int):
+    # Unmarked before the run, so changes made while it runs schedule another one
+    with _scheduled_lock:
+        _scheduled.discard(agent_id)
+    generate_canonical_answers(agent_id)
+
+
+def _submit(agent_id: int):
+    from webhook.background import job_executor
+    with _scheduled_lock:
+        if agent_id in _scheduled:
+            return
+        _scheduled.add(agent_id)
+    job_executor.submit(_run_scheduled, agent_id)
+
+
+def schedule_canonical_answers(agent_id: int):
+    """
+    Queues a generation run for the agent on the job executor once the current
+    transaction commits; changes made before the run starts share it.
+    """
+    transaction.on_commit(lambda: _submit(agent_id))
+
+
+def find_direct_answer(agent: OpenAISettings, matches) -> str:
+    """
+    Returns the canonical answer of the best match when the agent has direct answers on,
+    the match is at least `direct_answer_similarity` similar and leads the runner-up by
+    `direct_answer_margin`, and its answer is current. Otherwise None (use a completion).
+    `matches` are (similarity, KnowledgeBase item) best first, as from find_most_similar_question.
+    """
+    if not agent.direct_answers or not matches:
+        return None
+    similarity, entry = matches[0]
+    if similarity < agent.direct_answer_similarity:
+        return None
+    if len(matches) > 1 and similarity - matches[1][0] < agent.direct_answer_margin:
+        return None
+    if not entry.canonical_answer or entry.canonical_answer_key != canonical_key(agent, entry):
+        return None
+    return entry.canonical_answer
@@ -1,5 +1,6 @@
 from django import forms
-from .models import KnowledgeBase
+from .models import KnowledgeBase, DocumentIngestion
+from .ingestion import document_type, SUPPORTED_EXTENSIONS
 from webhook.rag_utilities import get_embeddings  
 
 class KnowledgeBaseForm(forms.ModelForm):
@@ -19,12 +20,49 @@ class KnowledgeBaseForm(forms.ModelForm):
         model = KnowledgeBase
         fields = ['brief', 'question']
 
+    def __init__(self, *args, agent=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agent = agent
+
     def save(self, commit=True):
         kb = super().save(commit=False)
+        agent = self.agent or kb.agent
 
-        # Generate embedding for the question
-        kb.embedding = get_embeddings(kb.question)
+        # Generate embedding for the question with the agent's current embedding model
+        kb.embedding = get_embeddings(
+            kb.question,
+            model=agent.embedding_model,
+            dimensions=agent.embedding_dimensions,
+        )
+        kb.embedding_model = agent.embedding_key
+        # Any shadow vector is stale now; a running re-embedding job picks the row up again
+        kb.embedding_next = None
 
         if commit:
             kb.save()
         return kb
+
+
+class DocumentUploadForm(forms.ModelForm):
+    file = forms.FileField(
+        required=True,
+        label="الملف (txt, md, csv, pdf)",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': ','.join(SUPPORTED_EXTENSIONS)})
+    )
+
+    class Meta:
+        model = DocumentIngestion
+        fields = ['file']
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if document_type(upload.name) is None:
+            raise forms.ValidationError("نوع الملف غير مدعوم. الأنواع المدعومة: txt, md, csv, pdf.")
+        return upload
+
+    def save(self, commit=True):
+        ingestion = super().save(commit=False)
+        ingestion.original_name = self.cleaned_data['file'].name[:255]
+        if commit:
+            ingestion.save()
+        return ingestion
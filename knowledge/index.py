@@ -0,0 +1,447 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from .models import KnowledgeBase
+
+logger = logging.getLogger(__name__)
+
+# 'two_stage': coarse scan over normalized RETRIEVAL_PREFIX_DIMS prefixes, exact rerank of
+# RETRIEVAL_CANDIDATES rows. 'exact': full scan. text-embedding-3-* vectors are Matryoshka
+# embeddings, so a renormalized prefix ranks almost like the full vector.
+RETRIEVAL_MODE = getattr(settings, 'RETRIEVAL_MODE', 'two_stage')
+RETRIEVAL_PREFIX_DIMS = getattr(settings, 'RETRIEVAL_PREFIX_DIMS', 256)
+RETRIEVAL_CANDIDATES = getattr(settings, 'RETRIEVAL_CANDIDATES', 200)
+# 'none' keeps float32 vectors in memory. 'int8' (per-dimension scaled, 4x smaller) and
+# 'binary' (1 sign bit per dimension, 32x smaller) keep only codes and rerank
+# RETRIEVAL_RERANK_CANDIDATES rows on their exact vectors fetched from the database.
+RETRIEVAL_QUANTIZATION = getattr(settings, 'RETRIEVAL_QUANTIZATION', 'none')
+RETRIEVAL_RERANK_CANDIDATES = getattr(settings, 'RETRIEVAL_RERANK_CANDIDATES', 50)
+# Seconds an index is trusted before its fingerprint is re-checked against the database
+INDEX_TTL = getattr(settings, 'RETRIEVAL_INDEX_TTL', 30)
+# Bytes of agent indexes one process keeps resident before evicting the least recently used
+INDEX_MEMORY_BUDGET = getattr(settings, 'RETRIEVAL_INDEX_MEMORY_BUDGET', 512 * 1024 * 1024)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores, k: int):
+    """Indices of the k highest scores, best first."""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    # numpy < 2.0
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(bits):
+        return _POPCOUNT_TABLE[bits]
+
+
+def _parse_embedding(embedding):
+    return json.loads(embedding) if isinstance(embedding, str) else embedding
+
+
+def fetch_vectors(ids, dims: int):
+    """
+    Loads the stored embeddings of the given knowledge ids, skipping deleted entries and
+    vectors of another size. Returns (found ids, normalized float32 matrix).
+    """
+    rows = dict(KnowledgeBase.objects.filter(id__in=[int(i) for i in ids]).values_list('id', 'embedding'))
+    found, vectors = [], []
+    for kb_id in ids:
+        embedding = rows.get(int(kb_id))
+        if embedding is None:
+            continue
+        embedding = _parse_embedding(embedding)
+        if len(embedding) == dims:
+            found.append(int(kb_id))
+            vectors.append(embedding)
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(found), dims)
+    return np.asarray(found, dtype=np.int64), _normalize(vectors)
+
+
+def _fingerprint(agent):
+    stats = KnowledgeBase.objects.filter(agent=agent, embedding_model=agent.embedding_key).aggregate(
+        count=Count('id'), latest=Max('updated_at')
+    )
+    return agent.embedding_key, stats['count'], stats['latest']
+
+
+class AgentIndex:
+    """
+    In-memory retrieval index of one agent's knowledge vectors.
+
+    Vectors are stored L2-normalized as float32, so cosine similarity is a single
+    matrix-vector product. A normalized prefix matrix backs the two-stage mode.
+    """
+
+    quantization = 'none'
+
+    def __init__(self, agent_id: int, ids, vectors, fingerprint=None):
+        self.agent_id = agent_id
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(self.ids), -1))
+        self.dims = self.vectors.shape[1]
+        self.fingerprint = fingerprint
+        self.checked_at = time.monotonic()
+        dims = self.dims
+        self.prefix = None
+        if 0 < RETRIEVAL_PREFIX_DIMS < dims:
+            self.prefix = _normalize(self.vectors[:, :RETRIEVAL_PREFIX_DIMS].copy())
+
+    @classmethod
+    def build(cls, agent):
+        """Loads the agent's vectors (only id and embedding columns) for its current embedding model."""
+        fingerprint = _fingerprint(agent)
+        ids, vectors = [], []
+        dims = None
+        rows = KnowledgeBase.objects.filter(
+            agent=agent, embedding_model=agent.embedding_key, embedding__isnull=False
+        ).values_list('id', 'embedding').iterator(chunk_size=2000)
+        for row_id, embedding in rows:
+            try:
+                embedding = _parse_embedding(embedding)
+                if dims is None:
+                    dims = len(embedding)
+                if len(embedding) != dims:
+                    raise ValueError(f"expected {dims} dimensions, got {len(embedding)}")
+            except (json.JSONDecodeError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping embedding of chunk {row_id}: {e}")
+                continue
+            ids.append(row_id)
+            vectors.append(embedding)
+        return cls(agent.id, ids, vectors if vectors else np.zeros((0, 0), dtype=np.float32), fingerprint)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.vectors.nbytes + (self.prefix.nbytes if self.prefix is not None else 0)
+
+    def _prepare_query(self, query):
+        if query is None:
+            # The embedding call failed (get_embeddings returns None)
+            return None
+        query = np.asarray(query, dtype=np.float32)
+        if query.shape != (self.dims,):
+            logger.error(f"Query has shape {query.shape}, index of agent {self.agent_id} has {self.dims} dimensions.")
+            return None
+        return _normalize(query)
+
+    def search(self, query, top_n: int = 5, mode: str = None):
+        """Returns [(similarity, knowledge id)] for the top_n most similar entries, best first."""
+        if not len(self):
+            return []
+        query = self._prepare_query(query)
+        if query is None:
+            return []
+        mode = mode or RETRIEVAL_MODE
+
+        if mode == 'two_stage' and self.prefix is not None and len(self) > RETRIEVAL_CANDIDATES:
+            coarse = self.prefix @ _normalize(query[:self.prefix.shape[1]].copy())
+            candidates = _top_k(coarse, RETRIEVAL_CANDIDATES)
+            scores = self.vectors[candidates] @ query
+            order = _top_k(scores, top_n)
+            return [(float(scores[i]), int(self.ids[candidates[i]])) for i in order]
+
+        scores = self.vectors @ query
+        return [(float(scores[i]), int(self.ids[i])) for i in _top_k(scores, top_n)]
+
+
+class QuantizedAgentIndex(AgentIndex):
+    """
+    Base of the compressed indexes: a cheap approximate scan over codes picks
+    RETRIEVAL_RERANK_CANDIDATES entries, which are reranked on their exact float vectors.
+    The float vectors are not kept; `vector_loader(ids, dims)` fetches them (from the database by default).
+    """
+
+    def __init__(self, agent_id: int, ids, vectors, fingerprint=None, vector_loader=fetch_vectors):
+        super().__init__(agent_id, ids, vectors, fingerprint)
+        self.vector_loader = vector_loader
+        self._quantize(self.vectors)
+        self.vectors = None
+        self.prefix = None
+
+    def _quantize(self, vectors):
+        raise NotImplementedError
+
+    def _candidates(self, query, count: int, mode: str):
+        """Positions of the `count` entries that look most similar on the compressed codes."""
+        raise NotImplementedError
+
+    def search(self, query, top_n: int = 5, mode: str = None):
+        if not len(self):
+            return []
+        query = self._prepare_query(query)
+        if query is None:
+            return []
+        candidates = self._candidates(query, max(top_n, RETRIEVAL_RERANK_CANDIDATES), mode or RETRIEVAL_MODE)
+        ids, vectors = self.vector_loader(self.ids[candidates], self.dims)
+        if not len(ids):
+            return []
+        scores = vectors @ query
+        return [(float(scores[i]), int(ids[i])) for i in _top_k(scores, top_n)]
+
+
+class Int8AgentIndex(QuantizedAgentIndex):
+    """
+    Symmetric int8 codes with one scale per dimension (the largest magnitude maps to 127).
+    In two-stage mode the prefix dimensions of the codes are scanned first, like AgentIndex does.
+    """
+
+    quantization = 'int8'
+    # Rows dequantized per step, bounds the temporary float32 buffer
+    SCAN_BLOCK = 4096
+
+    def _quantize(self, vectors):
+        scale = np.abs(vectors).max(axis=0) if len(vectors) else np.ones(self.dims, dtype=np.float32)
+        scale[scale == 0] = 1.0
+        self.scale = (scale / 127.0).astype(np.float32)
+        codes = np.round(vectors / self.scale).astype(np.int8)
+        # Codes are stored as contiguous prefix and tail blocks so the coarse pass reads only the prefix
+        self.split = RETRIEVAL_PREFIX_DIMS if 0 < RETRIEVAL_PREFIX_DIMS < self.dims else self.dims
+        self.prefix_codes = np.ascontiguousarray(codes[:, :self.split])
+        self.tail_codes = np.ascontiguousarray(codes[:, self.split:])
+        prefix_norms = np.linalg.norm(vectors[:, :self.split], axis=1)
+        prefix_norms[prefix_norms == 0] = 1.0
+        self.prefix_norms = prefix_norms.astype(np.float32)
+
+    def _scan(self, codes, scaled_query):
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.SCAN_BLOCK):
+            block = codes[start:start + self.SCAN_BLOCK]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def _candidates(self, query, count: int, mode: str):
+        scaled_query = query * self.scale
+        head, tail = scaled_query[:self.split], scaled_query[self.split:]
+        if mode == 'two_stage' and self.split < self.dims and len(self) > max(count, RETRIEVAL_CANDIDATES):
+            coarse = self._scan(self.prefix_codes, head)
+            shortlist = _top_k(coarse / self.prefix_norms, RETRIEVAL_CANDIDATES)
+            scores = coarse[shortlist] + self.tail_codes[shortlist].astype(np.float32) @ tail
+            return shortlist[_top_k(scores, count)]
+        return _top_k(self._scan(self.prefix_codes, head) + self._scan(self.tail_codes, tail), count)
+
+    @property
+    def nbytes(self):
+        return (
+            self.ids.nbytes + self.prefix_codes.nbytes + self.tail_codes.nbytes
+            + self.scale.nbytes + self.prefix_norms.nbytes
+        )
+
+
+class BinaryAgentIndex(QuantizedAgentIndex):
+    """One sign bit per dimension, compared by Hamming distance."""
+
+    quantization = 'binary'
+
+    def _quantize(self, vectors):
+        self.bits = np.packbits(vectors > 0, axis=1)
+
+    def _candidates(self, query, count: int, mode: str):
+        query_bits = np.packbits(query > 0)
+        distances = _popcount(np.bitwise_xor(self.bits, query_bits)).sum(axis=1, dtype=np.int32)
+        return _top_k(-distances, count)
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.bits.nbytes
+
+
+INDEX_CLASSES = {
+    'none': AgentIndex,
+    'int8': Int8AgentIndex,
+    'binary': BinaryAgentIndex,
+}
+
+
+class IndexManager:
+    """
+    Process-wide cache of agent retrieval indexes under a memory budget.
+
+    Indexes are built on demand and kept in least-recently-used order. When a new index
+    would push the total over `memory_budget` bytes, the coldest agents are evicted
+    first. Concurrent requests for the same agent share one build, and an index built
+    while its agent was invalidated is returned to its caller but not cached.
+    """
+
+    def __init__(self, memory_budget: int = INDEX_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.generations = {}
+        self.last_used = {}
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'load_failures': 0,
+            'load_seconds': 0.0,
+            'revalidations': 0,
+            'invalidations': 0,
+            'evictions': 0,
+            'evicted_bytes': 0,
+            'prefetches': 0,
+        }
+
+    def _count(self, name: str, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def is_loaded(self, agent_id: int) -> bool:
+        return agent_id in self.indexes
+
+    def get(self, agent) -> AgentIndex:
+        """
+        Returns the agent's index, building it on a miss. After INDEX_TTL seconds a cached
+        index is validated with one aggregate query (row count and latest updated_at), so
+        edits made through another worker are picked up.
+        """
+        with self.lock:
+            index = self.indexes.get(agent.id)
+            if index is not None:
+                self.indexes.move_to_end(agent.id)
+                self.last_used[agent.id] = time.monotonic()
+
+        if index is not None:
+            now = time.monotonic()
+            if now - index.checked_at < INDEX_TTL:
+                self._count('hits')
+                return index
+            if index.fingerprint == _fingerprint(agent):
+                index.checked_at = now
+                self._count('revalidations')
+                self._count('hits')
+                return index
+
+        self._count('misses')
+        return self._load(agent)
+
+    def _load(self, agent) -> AgentIndex:
+        with self.lock:
+            event = self.loading.get(agent.id)
+            owner = event is None
+            if owner:
+                event = self.loading[agent.id] = threading.Event()
+            generation = self.generations.get(agent.id, 0)
+
+        if not owner:
+            # Another thread is building this agent's index; use its result
+            event.wait()
+            index = self.indexes.get(agent.id)
+            if index is not None:
+                return index
+            return self._build(agent, generation)
+
+        try:
+            return self._build(agent, generation)
+        finally:
+            with self.lock:
+                self.loading.pop(agent.id, None)
+            event.set()
+
+    def _build(self, agent, generation: int) -> AgentIndex:
+        started = time.monotonic()
+        try:
+            index = INDEX_CLASSES[RETRIEVAL_QUANTIZATION].build(agent)
+        except Exception:
+            self._count('load_failures')
+            raise
+        elapsed = time.monotonic() - started
+        logger.info(f"📚 INDEX BUILD: Agent {agent.id}, {len(index)} vectors ({index.quantization}), {index.nbytes / 2**20:.1f} MB in {elapsed:.2f}s.")
+
+        with self.lock:
+            self.counters['loads'] += 1
+            self.counters['load_seconds'] += elapsed
+            if self.generations.get(agent.id, 0) != generation:
+                # Invalidated while building: the next request rebuilds
+                return index
+            self.indexes.pop(agent.id, None)
+            self._evict_for(index.nbytes)
+            self.indexes[agent.id] = index
+            self.last_used[agent.id] = time.monotonic()
+        return index
+
+    def _evict_for(self, needed: int):
+        """Evicts least recently used indexes until `needed` more bytes fit. Caller holds the lock."""
+        used = sum(index.nbytes for index in self.indexes.values())
+        while self.indexes and used + needed > self.memory_budget:
+            agent_id, index = self.indexes.popitem(last=False)
+            self.last_used.pop(agent_id, None)
+            used -= index.nbytes
+            self.counters['evictions'] += 1
+            self.counters['evicted_bytes'] += index.nbytes
+            logger.info(f"📚 INDEX EVICT: Agent {agent_id} ({index.nbytes / 2**20:.1f} MB) to stay within the memory budget.")
+        if needed > self.memory_budget:
+            logger.warning(f"⚠️ INDEX BUDGET: One index needs {needed / 2**20:.1f} MB, more than the whole budget of {self.memory_budget / 2**20:.1f} MB.")
+
+    def invalidate(self, agent_id: int):
+        with self.lock:
+            self.generations[agent_id] = self.generations.get(agent_id, 0) + 1
+            if self.indexes.pop(agent_id, None) is not None:
+                self.counters['invalidations'] += 1
+            self.last_used.pop(agent_id, None)
+
+    def prefetch(self, agent):
+        """Loads the agent's index ahead of its first query; a no-op when it is loaded or loading."""
+        if agent.id in self.indexes or agent.id in self.loading:
+            return None
+        self._count('prefetches')
+        return self.get(agent)
+
+    def stats(self) -> dict:
+        """Occupancy, load and eviction counters of this process."""
+        now = time.monotonic()
+        with self.lock:
+            agents = [
+                {
+                    'agent_id': agent_id,
+                    'vectors': len(index),
+                    'bytes': index.nbytes,
+                    'quantization': index.quantization,
+                    'idle_seconds': round(now - self.last_used.get(agent_id, now), 1),
+                }
+                for agent_id, index in reversed(self.indexes.items())
+            ]
+            counters = dict(self.counters)
+        used = sum(agent['bytes'] for agent in agents)
+        loads = counters['loads']
+        return {
+            **counters,
+            'load_seconds': round(counters['load_seconds'], 3),
+            'avg_load_seconds': round(counters['load_seconds'] / loads, 3) if loads else 0.0,
+            'resident_agents': len(agents),
+            'used_bytes': used,
+            'budget_bytes': self.memory_budget,
+            'occupancy': round(used / self.memory_budget, 3) if self.memory_budget else 0.0,
+            'agents': agents,
+        }
+
+
+index_manager = IndexManager()
+
+
+def invalidate_agent_index(agent_id: int):
+    index_manager.invalidate(agent_id)
+
+
+def get_agent_index(agent) -> AgentIndex:
+    return index_manager.get(agent)
@@ -0,0 +1,190 @@
+import csv
+import io
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from .models import DocumentIngestion, KnowledgeBase
+from .tokens import encode, decode, token_boundary
+from webhook.rag_utilities import get_embeddings_batch
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {
+    '.txt': 'text',
+    '.md': 'markdown',
+    '.markdown': 'markdown',
+    '.csv': 'csv',
+    '.pdf': 'pdf',
+}
+
+# Chunking and embedding settings
+CHUNK_TOKENS = getattr(settings, 'INGEST_CHUNK_TOKENS', 400)
+CHUNK_OVERLAP = getattr(settings, 'INGEST_CHUNK_OVERLAP', 60)
+EMBED_BATCH_SIZE = getattr(settings, 'INGEST_EMBED_BATCH_SIZE', 64)
+EMBED_CONCURRENCY = getattr(settings, 'INGEST_EMBED_CONCURRENCY', 4)
+
+
+def document_type(filename: str):
+    """Returns the document type for a file name, or None if it is not supported."""
+    return SUPPORTED_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def _iter_text_blocks(file):
+    """Yields a text/markdown document line by line."""
+    for line in io.TextIOWrapper(file, encoding='utf-8', errors='replace'):
+        yield line
+
+
+def _iter_csv_blocks(file):
+    """Yields one 'column: value' block per CSV row so every chunk keeps its column names."""
+    reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline=''))
+    header = next(reader, None)
+    if header is None:
+        return
+    for row in reader:
+        fields = [f"{name}: {value}" for name, value in zip(header, row) if value.strip()]
+        if fields:
+            yield "; ".join(fields) + "\n"
+
+
+def _iter_pdf_blocks(file):
+    """Yields a PDF page by page."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ValueError("PDF ingestion requires the 'pypdf' package.")
+    for page in PdfReader(file).pages:
+        text = page.extract_text() or ''
+        if text.strip():
+            yield text + "\n"
+
+
+_BLOCK_READERS = {
+    'text': _iter_text_blocks,
+    'markdown': _iter_text_blocks,
+    'csv': _iter_csv_blocks,
+    'pdf': _iter_pdf_blocks,
+}
+
+
+def iter_document_blocks(file, doc_type: str):
+    """Stream-parses an open binary file into text blocks without reading it whole."""
+    return _BLOCK_READERS[doc_type](file)
+
+
+def iter_chunks(blocks, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP):
+    """
+    Packs a stream of text blocks into chunks of at most `max_tokens` tokens.
+    Consecutive chunks share about `overlap` tokens so facts cut at a boundary survive in one of them.
+    Cuts are moved back to the nearest token boundary that decodes to whole characters.
+    Only one chunk's worth of tokens is held in memory.
+    Raises TokenizerUnavailable rather than chunking with another tokenizer, since resuming
+    an ingestion relies on producing the same chunks again.
+    """
+    buffer = []
+    emitted_until = 0  # tokens of `buffer` already covered by an emitted chunk
+    for block in blocks:
+        buffer.extend(encode(block))
+        while len(buffer) >= max_tokens:
+            end = token_boundary(buffer, max_tokens)
+            text = decode(buffer[:end]).strip()
+            if text:
+                yield text
+            start = token_boundary(buffer, max(1, end - overlap))
+            buffer = buffer[start:]
+            emitted_until = end - start
+    if len(buffer) > emitted_until:
+        text = decode(buffer).strip()
+        if text:
+            yield text
+
+
+def _batches(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _save_batch(ingestion: DocumentIngestion, start: int, texts: list, embeddings: list):
+    """Writes one embedded batch and advances the resume point in the same transaction."""
+    rows = [
+        KnowledgeBase(
+            agent_id=ingestion.agent_id,
+            source=ingestion,
+            chunk_index=start + offset,
+            brief=f"{ingestion.original_name} #{start + offset + 1}"[:264],
+            question=text,
+            embedding=embedding,
+            embedding_model=ingestion.agent.embedding_key,
+        )
+        for offset, (text, embedding) in enumerate(zip(texts, embeddings))
+    ]
+    with transaction.atomic():
+        KnowledgeBase.objects.bulk_create(rows, ignore_conflicts=True)
+        ingestion.chunks_done = start + len(rows)
+        DocumentIngestion.objects.filter(pk=ingestion.pk).update(chunks_done=ingestion.chunks_done)
+    # bulk_create sends no post_save signals
+    from .index import invalidate_agent_index
+    invalidate_agent_index(ingestion.agent_id)
+
+
+def run_ingestion(ingestion_id: int):
+    """
+    Parses, chunks and embeds one uploaded document, resuming after `chunks_done`.
+
+    Chunking is deterministic, so on resume the already-saved chunks are re-read and
+    skipped without being embedded again. Up to EMBED_CONCURRENCY embedding batches are
+    in flight at once, and results are written in order as they complete.
+    """
+    ingestion = DocumentIngestion.objects.select_related('agent').get(pk=ingestion_id)
+    if ingestion.status == 'done':
+        return ingestion
+
+    doc_type = document_type(ingestion.original_name)
+    resume_from = ingestion.chunks_done
+    DocumentIngestion.objects.filter(pk=ingestion.pk).update(status='running', error='')
+    logger.info(f"📄 INGEST START: {ingestion.original_name} for agent {ingestion.agent_id}, resuming at chunk {resume_from}.")
+
+    try:
+        with ingestion.file.open('rb') as file, ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+            chunks = iter_chunks(iter_document_blocks(file, doc_type))
+            # Skip chunks that were saved before a crash
+            for _ in range(resume_from):
+                if next(chunks, None) is None:
+                    break
+
+            in_flight = deque()
+            start = resume_from
+            for texts in _batches(chunks, EMBED_BATCH_SIZE):
+                future = pool.submit(
+                    get_embeddings_batch,
+                    texts,
+                    model=ingestion.agent.embedding_model,
+                    dimensions=ingestion.agent.embedding_dimensions,
+                )
+                in_flight.append((start, texts, future))
+                start += len(texts)
+                if len(in_flight) >= EMBED_CONCURRENCY:
+                    batch_start, batch_texts, future = in_flight.popleft()
+                    _save_batch(ingestion, batch_start, batch_texts, future.result())
+            while in_flight:
+                batch_start, batch_texts, future = in_flight.popleft()
+                _save_batch(ingestion, batch_start, batch_texts, future.result())
+
+    except Exception as e:
+        logger.error(f"❌ INGEST FAIL: {ingestion.original_name} stopped at chunk {ingestion.chunks_done}: {e}", exc_info=True)
+        DocumentIngestion.objects.filter(pk=ingestion.pk).update(status='failed', error=str(e))
+        raise
+
+    DocumentIngestion.objects.filter(pk=ingestion.pk).update(status='done')
+    logger.info(f"✅ INGEST DONE: {ingestion.original_name}, {ingestion.chunks_done} chunks.")
+    ingestion.status = 'done'
+    return ingestion
@@ -0,0 +1,105 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from core.models import OpenAISettings
+from knowledge.index import (
+    AgentIndex,
+    Int8AgentIndex,
+    BinaryAgentIndex,
+    RETRIEVAL_CANDIDATES,
+    RETRIEVAL_RERANK_CANDIDATES,
+)
+
+
+def _unit(matrix):
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+def _synthetic_vectors(size: int, dims: int, cluster_size: int, rng):
+    """
+    Topic clusters of about `cluster_size` entries, with Matryoshka-like energy decay
+    across dimensions so the leading dimensions carry most of the signal, as they do
+    for text-embedding-3-* models.
+    """
+    scale = (1.0 / np.sqrt(1.0 + np.arange(dims) / 32.0)).astype(np.float32)
+    centers = _unit(rng.standard_normal((max(1, size // cluster_size), dims)).astype(np.float32) * scale)
+    spread = _unit(rng.standard_normal((size, dims)).astype(np.float32) * scale)
+    return _unit(centers[rng.integers(0, len(centers), size)] + 0.7 * spread)
+
+
+def _queries(index: AgentIndex, count: int, noise: float, rng):
+    """Perturbed copies of random indexed vectors: paraphrases of a known entry."""
+    base = index.vectors[rng.integers(0, len(index), size=count)]
+    return _unit(base + noise * _unit(rng.standard_normal(base.shape).astype(np.float32)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares retrieval variants against the exact float scan: latency, bytes scanned, "
+        "index memory and recall@k (exact, two-stage prefix, int8 and binary quantized)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agent', type=int, help="Benchmark this agent's real index instead of synthetic vectors.")
+        parser.add_argument('--size', type=int, default=50000, help="Synthetic index size.")
+        parser.add_argument('--dims', type=int, default=1536, help="Synthetic vector size.")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--cluster-size', type=int, default=5, help="Synthetic entries per topic.")
+        parser.add_argument('--noise', type=float, default=1.0, help="Query perturbation relative to the entry.")
+        parser.add_argument('--top-n', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        if options['agent']:
+            try:
+                index = AgentIndex.build(OpenAISettings.objects.get(pk=options['agent']))
+            except OpenAISettings.DoesNotExist:
+                raise CommandError(f"Agent {options['agent']} does not exist.")
+            if not len(index):
+                raise CommandError("The agent has no embedded knowledge.")
+            # Quantized variants rerank on vectors fetched from the database, as in production
+            loader_options = {}
+        else:
+            vectors = _synthetic_vectors(options['size'], options['dims'], options['cluster_size'], rng)
+            index = AgentIndex(0, np.arange(options['size']), vectors)
+            # Synthetic ids are row positions
+            loader_options = {'vector_loader': lambda ids, dims: (ids, index.vectors[ids])}
+
+        n, dims = index.vectors.shape
+        int8_index = Int8AgentIndex(0, index.ids, index.vectors, **loader_options)
+        binary_index = BinaryAgentIndex(0, index.ids, index.vectors, **loader_options)
+        # (name, index, mode, bytes read by the approximate scan per query)
+        variants = [('exact', index, 'exact', n * dims * 4)]
+        if index.prefix is not None:
+            prefix_dims = index.prefix.shape[1]
+            shortlist = min(n, RETRIEVAL_CANDIDATES)
+            variants.append(('two_stage', index, 'two_stage', n * prefix_dims * 4 + shortlist * dims * 4))
+        variants.append(('int8', int8_index, 'exact', n * dims))
+        if index.prefix is not None:
+            variants.append(('int8_2stg', int8_index, 'two_stage', n * prefix_dims + shortlist * dims))
+        variants.append(('binary', binary_index, None, n * dims // 8))
+
+        queries = _queries(index, options['queries'], options['noise'], rng)
+        top_n = options['top_n']
+        self.stdout.write(
+            f"index: {n} vectors x {dims} dims, two-stage candidates {RETRIEVAL_CANDIDATES}, "
+            f"quantized rerank candidates {RETRIEVAL_RERANK_CANDIDATES}"
+        )
+        self.stdout.write(f"{'variant':>10} {'ms/query':>9} {'MB scanned':>11} {'index MB':>9} {'recall@' + str(top_n):>9} {'top-1':>6}")
+
+        exact_results = None
+        for name, variant, mode, scanned in variants:
+            started = time.perf_counter()
+            results = [[kb_id for _, kb_id in variant.search(q, top_n=top_n, mode=mode)] for q in queries]
+            elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+            if exact_results is None:
+                exact_results = results
+            recall = np.mean([len(set(e) & set(r)) / max(1, len(e)) for e, r in zip(exact_results, results)])
+            top1 = np.mean([e[:1] == r[:1] for e, r in zip(exact_results, results)])
+            # The exact scan does not need the prefix matrix
+            index_bytes = variant.ids.nbytes + variant.vectors.nbytes if name == 'exact' else variant.nbytes
+            index_mb = index_bytes / 2**20
+            self.stdout.write(
+                f"{name:>10} {elapsed_ms:>9.2f} {scanned / 2**20:>11.1f} {index_mb:>9.1f} {recall:>9.3f} {top1:>6.3f}"
+            )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from core.models import OpenAISettings
+from knowledge.canonical import generate_canonical_answers, CANONICAL_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates missing or stale canonical answers (used for direct answers) for agents "
+        "that have direct answers on. Safe to re-run: current answers are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Only these agent ids (even with direct answers off).")
+        parser.add_argument('--batch-size', type=int, default=CANONICAL_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            agents = OpenAISettings.objects.filter(pk__in=options['ids'])
+        else:
+            agents = OpenAISettings.objects.filter(direct_answers=True)
+
+        for agent in agents.order_by('id'):
+            self.stdout.write(f"{agent.agent_name}...")
+            written = generate_canonical_answers(agent.pk, batch_size=options['batch_size'])
+            self.stdout.write(f"  {written} canonical answers written.")
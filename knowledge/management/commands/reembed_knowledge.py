@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import OpenAISettings
+from knowledge.reembedding import start_reembedding, run_reembedding, REEMBED_BATCH_SIZE, REEMBED_SLEEP
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embeds an agent's knowledge base with another embedding model while retrieval keeps "
+        "serving the old vectors, then cuts over atomically. Re-run the same command to resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('agent_id', type=int)
+        parser.add_argument('--model', required=True,
+                            choices=[choice for choice, _ in OpenAISettings.EMBEDDING_MODEL_CHOICES])
+        parser.add_argument('--dimensions', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=REEMBED_BATCH_SIZE)
+        parser.add_argument('--sleep', type=float, default=REEMBED_SLEEP,
+                            help="Seconds to pause between batches (throttling).")
+
+    def handle(self, *args, **options):
+        try:
+            agent = OpenAISettings.objects.get(pk=options['agent_id'])
+        except OpenAISettings.DoesNotExist:
+            raise CommandError(f"No Agent with ID {options['agent_id']} found.")
+
+        job = start_reembedding(agent, options['model'], options['dimensions'])
+        self.stdout.write(f"Job {job.pk}: {agent.agent_name} -> {job.target_model}, resuming after id {job.last_id}.")
+        job = run_reembedding(job.pk, batch_size=options['batch_size'], sleep=options['sleep'])
+        self.stdout.write(f"Done: {job.processed} entries re-embedded, agent switched to {job.target_model}.")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from knowledge.ingestion import run_ingestion
+from knowledge.models import DocumentIngestion
+
+
+class Command(BaseCommand):
+    help = "Resumes document ingestions left pending, running (after a crash) or failed, from their last saved chunk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Only resume these ingestion ids.")
+
+    def handle(self, *args, **options):
+        ingestions = DocumentIngestion.objects.exclude(status='done').order_by('created_at')
+        if options['ids']:
+            ingestions = ingestions.filter(pk__in=options['ids'])
+
+        for ingestion in ingestions:
+            self.stdout.write(f"Resuming {ingestion.original_name} at chunk {ingestion.chunks_done}...")
+            try:
+                ingestion = run_ingestion(ingestion.pk)
+            except Exception as e:
+                self.stderr.write(f"  failed: {e}")
+                continue
+            self.stdout.write(f"  done, {ingestion.chunks_done} chunks.")
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:27
+
+import logging
+
+from django.db import DatabaseError, migrations, models, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Makes the FAQ search (icontains on brief/question) index-backed on PostgreSQL.
+    # Creating pg_trgm needs CREATE on the database (PostgreSQL 13+, where it is a trusted
+    # extension) or a superuser; without it the indexes are skipped and search stays a scan.
+    # A DBA can run "CREATE EXTENSION pg_trgm" and then re-apply this migration.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError as e:
+        logger.warning(f"⚠️ MIGRATION: pg_trgm is unavailable ({e}); skipping the FAQ trigram indexes.")
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS kb_brief_trgm_idx ON knowledge_knowledgebase "
+        "USING gin (UPPER(brief::text) gin_trgm_ops)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS kb_question_trgm_idx ON knowledge_knowledgebase "
+        "USING gin (UPPER(question::text) gin_trgm_ops)"
+    )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS kb_brief_trgm_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS kb_question_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_openaisettings_delete_guest_delete_property_and_more'),
+        ('knowledge', '0003_knowledgebase_agent_alter_knowledgebase_embedding'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='knowledgebase',
+            index=models.Index(fields=['agent', '-id'], name='kb_agent_id_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
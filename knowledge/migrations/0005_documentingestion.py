@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_openaisettings_delete_guest_delete_property_and_more'),
+        ('knowledge', '0004_knowledgebase_agent_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='chunk_index',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DocumentIngestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='knowledge/documents/')),
+                ('original_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('chunks_done', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestions', to='core.openaisettings')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='source',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='knowledge.documentingestion'),
+        ),
+        migrations.AddConstraint(
+            model_name='knowledgebase',
+            constraint=models.UniqueConstraint(fields=('source', 'chunk_index'), name='kb_source_chunk_unique'),
+        ),
+    ]
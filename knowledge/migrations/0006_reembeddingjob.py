@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_openaisettings_embedding_model'),
+        ('knowledge', '0005_documentingestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_model',
+            field=models.CharField(default='text-embedding-3-small', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_next',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReembeddingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_model', models.CharField(choices=[('text-embedding-3-small', 'text-embedding-3-small'), ('text-embedding-3-large', 'text-embedding-3-large')], max_length=50)),
+                ('target_dimensions', models.PositiveIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reembedding_jobs', to='core.openaisettings')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0006_reembeddingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='knowledgebase',
+            index=models.Index(fields=['agent', 'embedding_model', 'updated_at'], name='kb_agent_model_upd_idx'),
+        ),
+    ]
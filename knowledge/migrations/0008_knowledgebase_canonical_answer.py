@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0007_knowledgebase_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='canonical_answer',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='canonical_answer_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -3,6 +3,34 @@ from core.models import OpenAISettings
 
 # Create your models here.
 
+class DocumentIngestion(models.Model):
+    """
+    An uploaded document being split into KnowledgeBase chunks.
+    `chunks_done` is the resume point: chunks below it are already embedded and saved.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    agent = models.ForeignKey(
+        OpenAISettings,
+        on_delete=models.CASCADE,
+        related_name="ingestions",
+    )
+    file = models.FileField(upload_to='knowledge/documents/')
+    original_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    chunks_done = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.original_name} ({self.status})"
+
+
 class KnowledgeBase(models.Model):
     """
     Model to store questions and their vector embeddings.
@@ -16,7 +44,67 @@ class KnowledgeBase(models.Model):
     brief = models.CharField(max_length=264, null =True)
     question = models.TextField(verbose_name='Question')
     embedding = models.JSONField(verbose_name='Embedding', null=True, blank=True)
+    # Embedding model (and size) that produced `embedding`, see OpenAISettings.embedding_key
+    embedding_model = models.CharField(max_length=64, default='text-embedding-3-small')
+    # Shadow vector written by a running re-embedding job; swapped in at cutover
+    embedding_next = models.JSONField(null=True, blank=True)
+    # Set for chunks produced by a document ingestion
+    source = models.ForeignKey(
+        DocumentIngestion,
+        on_delete=models.CASCADE,
+        related_name="chunks",
+        null=True,
+        blank=True,
+    )
+    chunk_index = models.PositiveIntegerField(null=True, blank=True)
+    # Reply sent as is for confident hits when the agent has direct answers on (see knowledge.canonical);
+    # valid while canonical_answer_key matches the entry's brief and text and the agent's prompt and model
+    canonical_answer = models.TextField(blank=True, default='')
+    canonical_answer_key = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Part of the retrieval index fingerprint (see knowledge.index)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of an agent's entries (newest first)
+            models.Index(fields=['agent', '-id'], name='kb_agent_id_idx'),
+            # Retrieval index fingerprint: count and latest change per agent and model
+            models.Index(fields=['agent', 'embedding_model', 'updated_at'], name='kb_agent_model_upd_idx'),
+        ]
+        constraints = [
+            # Makes re-running a resumed ingestion batch idempotent
+            models.UniqueConstraint(fields=['source', 'chunk_index'], name='kb_source_chunk_unique'),
+        ]
 
     def __str__(self):
         return self.brief
+
+
+class ReembeddingJob(models.Model):
+    """
+    Moves an agent's knowledge vectors to another embedding model without downtime.
+    `last_id` is the checkpoint of the main pass over the agent's entries.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    agent = models.ForeignKey(
+        OpenAISettings,
+        on_delete=models.CASCADE,
+        related_name="reembedding_jobs",
+    )
+    target_model = models.CharField(max_length=50, choices=OpenAISettings.EMBEDDING_MODEL_CHOICES)
+    target_dimensions = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    last_id = models.BigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.agent} -> {self.target_model} ({self.status})"
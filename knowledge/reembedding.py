@@ -0,0 +1,128 @@
+import logging
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from core.models import OpenAISettings, embedding_key
+from .models import KnowledgeBase, ReembeddingJob
+from webhook.rag_utilities import get_embeddings_batch
+
+logger = logging.getLogger(__name__)
+
+REEMBED_BATCH_SIZE = getattr(settings, 'REEMBED_BATCH_SIZE', 100)
+REEMBED_SLEEP = getattr(settings, 'REEMBED_SLEEP', 0.5)
+
+
+def start_reembedding(agent: OpenAISettings, model: str, dimensions: int = None) -> ReembeddingJob:
+    """Returns the agent's unfinished job for this target, or creates a new one."""
+    job = agent.reembedding_jobs.exclude(status='done').filter(
+        target_model=model, target_dimensions=dimensions
+    ).first()
+    if job is None:
+        job = ReembeddingJob.objects.create(agent=agent, target_model=model, target_dimensions=dimensions)
+    return job
+
+
+def _embed_batch(job: ReembeddingJob, rows: list) -> list:
+    return get_embeddings_batch(
+        [row.question for row in rows],
+        model=job.target_model,
+        dimensions=job.target_dimensions,
+    )
+
+
+def _shadow_pass(job: ReembeddingJob, target: str, batch_size: int, sleep: float, checkpoint: bool):
+    """
+    Writes target-model vectors into `embedding_next` for rows that still need one.
+    With `checkpoint`, progress is stored in job.last_id after every batch.
+    """
+    while True:
+        rows = KnowledgeBase.objects.filter(agent_id=job.agent_id, embedding_next__isnull=True).exclude(
+            embedding_model=target
+        ).only('id', 'question').order_by('id')
+        if checkpoint:
+            rows = rows.filter(id__gt=job.last_id)
+        rows = list(rows[:batch_size])
+        if not rows:
+            return
+
+        vectors = _embed_batch(job, rows)
+        with transaction.atomic():
+            for row, vector in zip(rows, vectors):
+                # Skip rows edited meanwhile (the form clears embedding_next and re-tags them)
+                KnowledgeBase.objects.filter(pk=row.pk, question=row.question).update(embedding_next=vector)
+            job.processed += len(rows)
+            if checkpoint:
+                job.last_id = rows[-1].id
+            ReembeddingJob.objects.filter(pk=job.pk).update(processed=job.processed, last_id=job.last_id)
+        if sleep:
+            time.sleep(sleep)
+
+
+def _cutover(job: ReembeddingJob, target: str):
+    """Swaps the shadow vectors in and switches the agent's embedding model in one transaction."""
+    with transaction.atomic():
+        agent = OpenAISettings.objects.select_for_update().get(pk=job.agent_id)
+        swapped = KnowledgeBase.objects.filter(agent=agent, embedding_next__isnull=False).update(
+            embedding=F('embedding_next'),
+            embedding_next=None,
+            embedding_model=target,
+            updated_at=timezone.now(),
+        )
+        agent.embedding_model = job.target_model
+        agent.embedding_dimensions = job.target_dimensions
+        # save() bumps updated_at and fires post_save, so every worker's agent cache picks it up
+        agent.save()
+    logger.info(f"🔁 REEMBED CUTOVER: Agent {job.agent_id} now uses {target} ({swapped} vectors swapped).")
+
+
+def _catch_up(job: ReembeddingJob, target: str, batch_size: int):
+    """Re-embeds in place any row still tagged with another model after cutover (added during the swap)."""
+    while True:
+        rows = list(
+            KnowledgeBase.objects.filter(agent_id=job.agent_id).exclude(embedding_model=target)
+            .only('id', 'question').order_by('id')[:batch_size]
+        )
+        if not rows:
+            return
+        vectors = _embed_batch(job, rows)
+        with transaction.atomic():
+            for row, vector in zip(rows, vectors):
+                KnowledgeBase.objects.filter(pk=row.pk).update(
+                    embedding=vector, embedding_next=None, embedding_model=target, updated_at=timezone.now()
+                )
+
+
+def run_reembedding(job_id: int, batch_size: int = REEMBED_BATCH_SIZE, sleep: float = REEMBED_SLEEP):
+    """
+    Moves an agent's knowledge base to the job's target embedding model.
+
+    1. Checkpointed, throttled pass that fills `embedding_next` for every entry.
+       Retrieval keeps using `embedding` and the old model the whole time.
+    2. A final sweep for entries added or edited during the pass.
+    3. Atomic per-agent cutover: shadow vectors become live with the new model.
+    4. Catch-up of anything written between the sweep and the cutover.
+
+    Every step reads its state from the database, so a crashed job simply resumes.
+    """
+    job = ReembeddingJob.objects.get(pk=job_id)
+    if job.status == 'done':
+        return job
+    target = embedding_key(job.target_model, job.target_dimensions)
+    ReembeddingJob.objects.filter(pk=job.pk).update(status='running', error='')
+    logger.info(f"🔁 REEMBED START: Agent {job.agent_id} -> {target}, resuming after id {job.last_id}.")
+
+    try:
+        _shadow_pass(job, target, batch_size, sleep, checkpoint=True)
+        _shadow_pass(job, target, batch_size, sleep, checkpoint=False)
+        _cutover(job, target)
+        _catch_up(job, target, batch_size)
+    except Exception as e:
+        logger.error(f"❌ REEMBED FAIL: Job {job.pk} stopped after id {job.last_id}: {e}", exc_info=True)
+        ReembeddingJob.objects.filter(pk=job.pk).update(status='failed', error=str(e))
+        raise
+
+    ReembeddingJob.objects.filter(pk=job.pk).update(status='done')
+    job.status = 'done'
+    return job
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from core.models import OpenAISettings
+from .models import KnowledgeBase
+
+
+def _schedule_canonical(agent_id: int):
+    from .canonical import schedule_canonical_answers
+    schedule_canonical_answers(agent_id)
+
+
+def _invalidate(agent_id: int):
+    # Imported here so connecting the signals at startup doesn't load numpy
+    from .index import invalidate_agent_index
+    invalidate_agent_index(agent_id)
+
+
+@receiver([post_save, post_delete], sender=KnowledgeBase)
+def invalidate_index_on_change(sender, instance, **kwargs):
+    """Rebuilds the agent's retrieval index on next use after an entry is added, edited or deleted."""
+    if instance.agent_id:
+        _invalidate(instance.agent_id)
+
+
+@receiver(post_save, sender=KnowledgeBase)
+def refresh_canonical_answer(sender, instance, **kwargs):
+    """A curated entry added or edited for an agent with direct answers gets its canonical answer in the background."""
+    if instance.agent_id and instance.source_id is None and OpenAISettings.objects.filter(
+        pk=instance.agent_id, direct_answers=True
+    ).exists():
+        _schedule_canonical(instance.agent_id)
+
+
+@receiver([post_save, post_delete], sender=OpenAISettings)
+def invalidate_index_on_agent_change(sender, instance, **kwargs):
+    """An agent switching embedding model needs an index over the new vectors."""
+    _invalidate(instance.id)
+
+
+@receiver(post_save, sender=OpenAISettings)
+def refresh_canonical_answers_on_agent_change(sender, instance, **kwargs):
+    """Turning direct answers on, or changing the prompt or model, (re)generates stale canonical answers."""
+    if instance.direct_answers:
+        _schedule_canonical(instance.id)
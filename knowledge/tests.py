@@ -1,3 +1,430 @@
-from django.test import TestCase
+import importlib
+import re
+import tempfile
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import DatabaseError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from core.models import OpenAISettings
+from . import canonical, index, ingestion, reembedding, tokens, views
+from .models import DocumentIngestion, KnowledgeBase, ReembeddingJob
 
-# Create your tests here.
+
+class _ByteEncoding:
+    """Stand-in for a tiktoken encoding with one token per UTF-8 byte, so Arabic letters span two tokens."""
+
+    def encode(self, text, disallowed_special=()):
+        return list(text.encode('utf-8'))
+
+    def decode_bytes(self, tokens):
+        return bytes(tokens)
+
+    def decode(self, tokens):
+        return bytes(tokens).decode('utf-8', errors='replace')
+
+
+class FaqPaginationTests(TestCase):
+    def setUp(self):
+        self.agent = OpenAISettings.objects.create(agent_name='Support')
+        other = OpenAISettings.objects.create(agent_name='Sales')
+        KnowledgeBase.objects.bulk_create(
+            [KnowledgeBase(agent=self.agent, brief=f"Entry {i}", question=f"Question {i}", embedding=[0.1] * 8) for i in range(60)]
+            + [KnowledgeBase(agent=self.agent, brief='Shipping', question='How long does delivery take?')]
+            + [KnowledgeBase(agent=other, brief='Shipping', question='Other agent')]
+        )
+        self.client.force_login(User.objects.create_user('staff', password='x'))
+
+    def _data(self, **params):
+        return self.client.get(reverse('knowledge:faq_data', args=[self.agent.pk]), params).json()
+
+    def _ids(self, page):
+        return [int(pk) for pk in re.findall(r'id="faqs-gen-ques-collapse-(\d+)"', page['html'])]
+
+    def test_pages_are_keyset_paginated_newest_first(self):
+        first = self._data()
+        self.assertEqual(set(first), {'html', 'next_after'})
+        self.assertEqual(len(self._ids(first)), views.FAQ_PAGE_SIZE)
+        self.assertIn('Shipping', first['html'].split('</h5>')[0])
+        second = self._data(after=first['next_after'])
+        self.assertEqual(len(self._ids(second)), 61 - views.FAQ_PAGE_SIZE)
+        self.assertIsNone(second['next_after'])
+        seen = self._ids(first) + self._ids(second)
+        self.assertEqual(seen, sorted(set(seen), reverse=True))
+
+    def test_search_filters_brief_and_question_of_the_agent(self):
+        match = KnowledgeBase.objects.get(agent=self.agent, brief='Shipping')
+        self.assertEqual(self._ids(self._data(q='delivery')), [match.pk])
+        self.assertEqual(self._ids(self._data(q='shipping')), [match.pk])
+
+    def test_embeddings_are_not_loaded(self):
+        request = RequestFactory().get('/')
+        page, _, _ = views._faq_page(request, self.agent)
+        self.assertIn('embedding', page[0].get_deferred_fields())
+
+    def test_trigram_indexes_are_skipped_without_the_extension_privilege(self):
+        migration = importlib.import_module('knowledge.migrations.0004_knowledgebase_agent_id_idx')
+        schema_editor = mock.Mock()
+        schema_editor.connection.vendor = 'postgresql'
+        schema_editor.connection.alias = 'default'
+        schema_editor.execute.side_effect = DatabaseError('permission denied to create extension "pg_trgm"')
+        with self.assertLogs(migration.logger, 'WARNING'):
+            migration.create_trigram_indexes(None, schema_editor)
+        schema_editor.execute.assert_called_once_with("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+@mock.patch.object(tokens, '_encoding', _ByteEncoding())
+class ChunkingTests(SimpleTestCase):
+    text = 'مرحبا بكم في متجرنا، نوصل الطلبات خلال ثلاثة أيام. ' * 20
+
+    def test_chunks_are_cut_on_character_boundaries(self):
+        chunks = list(ingestion.iter_chunks([self.text], max_tokens=25, overlap=7))
+        self.assertGreater(len(chunks), 10)
+        for chunk in chunks:
+            self.assertNotIn('\ufffd', chunk)
+            self.assertLessEqual(len(tokens.encode(chunk)), 25)
+            self.assertIn(chunk, self.text)
+
+    def test_consecutive_chunks_overlap(self):
+        chunks = list(ingestion.iter_chunks(['abcdefghij' * 5], max_tokens=20, overlap=5))
+        self.assertEqual(chunks[0][-5:], chunks[1][:5])
+        self.assertEqual(''.join(chunk[5:] if i else chunk for i, chunk in enumerate(chunks)), 'abcdefghij' * 5)
+
+    def test_truncation_keeps_whole_characters(self):
+        self.assertEqual(tokens.truncate_tokens('مرحبا', 5), 'مر')
+
+
+@mock.patch.object(tokens, '_encoding', None)
+@mock.patch.object(tokens, '_encoding_failed_at', None)
+@mock.patch.dict('sys.modules', {'tiktoken': None})
+class TokenizerUnavailableTests(SimpleTestCase):
+    def test_encoding_fails_instead_of_switching_tokenizer(self):
+        with self.assertRaises(tokens.TokenizerUnavailable):
+            tokens.encode('hello')
+        with self.assertRaises(tokens.TokenizerUnavailable):
+            list(ingestion.iter_chunks(['hello world']))
+
+    def test_budget_estimates_fall_back_to_words(self):
+        with self.assertLogs(tokens.logger, 'WARNING'):
+            self.assertEqual(tokens.estimate_tokens('three short words'), 3)
+
+
+@mock.patch.object(tokens, '_encoding', _ByteEncoding())
+@mock.patch.object(ingestion, 'EMBED_BATCH_SIZE', 2)
+@mock.patch.object(ingestion, 'EMBED_CONCURRENCY', 1)
+class RunIngestionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.agent = OpenAISettings.objects.create(agent_name='Support')
+        self.ingestion = DocumentIngestion(agent=self.agent, original_name='faq.txt')
+        # About eight chunks of the default size, embedded two per batch
+        lines = ''.join(f"Line number {i:03d} of the shipping policy.\n" for i in range(80))
+        self.ingestion.file.save('faq.txt', ContentFile(lines.encode()))
+
+    def _embed(self, texts, **kwargs):
+        return [[float(len(text))] for text in texts]
+
+    def test_failed_ingestion_resumes_after_its_last_saved_batch(self):
+        calls = []
+
+        def flaky(texts, **kwargs):
+            calls.append(texts)
+            if len(calls) == 2:
+                raise RuntimeError('embedding API down')
+            return self._embed(texts)
+
+        with mock.patch.object(ingestion, 'get_embeddings_batch', flaky), self.assertLogs(ingestion.logger, 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                ingestion.run_ingestion(self.ingestion.pk)
+        self.ingestion.refresh_from_db()
+        self.assertEqual((self.ingestion.status, self.ingestion.chunks_done), ('failed', 2))
+
+        with mock.patch.object(ingestion, 'get_embeddings_batch', side_effect=self._embed) as embed:
+            ingestion.run_ingestion(self.ingestion.pk)
+        # The two saved chunks are skipped without being embedded again
+        self.assertNotIn(calls[0][0], [text for call in embed.call_args_list for text in call.args[0]])
+        self.ingestion.refresh_from_db()
+        self.assertEqual(self.ingestion.status, 'done')
+        chunks = list(KnowledgeBase.objects.filter(source=self.ingestion).order_by('chunk_index'))
+        self.assertEqual([chunk.chunk_index for chunk in chunks], list(range(self.ingestion.chunks_done)))
+        self.assertEqual([chunk.question for chunk in chunks[:2]], calls[0])
+
+    def test_upload_runs_on_the_job_pool_not_the_message_pool(self):
+        self.client.force_login(User.objects.create_user('staff', password='x'))
+        upload = ContentFile(b'Shipping takes three days.', name='policy.txt')
+        with mock.patch.object(views.job_executor, 'submit') as submit, \
+                mock.patch('webhook.background.background_executor.submit') as message_submit:
+            self.client.post(reverse('knowledge:upload_document', args=[self.agent.pk]), {'file': upload})
+        uploaded = DocumentIngestion.objects.exclude(pk=self.ingestion.pk).get()
+        submit.assert_called_once_with(ingestion.run_ingestion, uploaded.pk)
+        message_submit.assert_not_called()
+
+
+class ReembeddingTests(TestCase):
+    def setUp(self):
+        self.agent = OpenAISettings.objects.create(agent_name='Support')
+        KnowledgeBase.objects.bulk_create([
+            KnowledgeBase(agent=self.agent, brief=f"Entry {i}", question=f"Question {i}", embedding=[0.0])
+            for i in range(5)
+        ])
+        self.job = reembedding.start_reembedding(self.agent, 'text-embedding-3-large', 256)
+
+    def _embed(self, texts, model, dimensions):
+        return [[float(text.split()[-1])] for text in texts]
+
+    def test_unfinished_job_is_reused(self):
+        self.assertEqual(reembedding.start_reembedding(self.agent, 'text-embedding-3-large', 256), self.job)
+        self.assertNotEqual(reembedding.start_reembedding(self.agent, 'text-embedding-3-large'), self.job)
+
+    def test_vectors_and_model_switch_together(self):
+        with mock.patch.object(reembedding, 'get_embeddings_batch', side_effect=self._embed):
+            reembedding.run_reembedding(self.job.pk, batch_size=2, sleep=0)
+        self.agent.refresh_from_db()
+        self.assertEqual(self.agent.embedding_key, 'text-embedding-3-large@256')
+        self.assertEqual(
+            sorted(KnowledgeBase.objects.values_list('embedding_model', 'embedding', 'embedding_next')),
+            [('text-embedding-3-large@256', [float(i)], None) for i in range(5)],
+        )
+        self.assertEqual(ReembeddingJob.objects.get(pk=self.job.pk).status, 'done')
+
+    def test_crashed_job_resumes_from_its_checkpoint(self):
+        embedded = []
+
+        def flaky(texts, model, dimensions):
+            if embedded:
+                raise RuntimeError('rate limited')
+            embedded.extend(texts)
+            return self._embed(texts, model, dimensions)
+
+        with mock.patch.object(reembedding, 'get_embeddings_batch', flaky), self.assertLogs(reembedding.logger, 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                reembedding.run_reembedding(self.job.pk, batch_size=2, sleep=0)
+        self.agent.refresh_from_db()
+        # Retrieval keeps the old model until the cutover
+        self.assertEqual(self.agent.embedding_model, 'text-embedding-3-small')
+
+        with mock.patch.object(reembedding, 'get_embeddings_batch', side_effect=self._embed) as embed:
+            reembedding.run_reembedding(self.job.pk, batch_size=2, sleep=0)
+        self.assertEqual(sum(len(call.args[0]) for call in embed.call_args_list), 3)
+        self.assertFalse(KnowledgeBase.objects.exclude(embedding_model='text-embedding-3-large@256').exists())
+
+
+@mock.patch.object(index, 'RETRIEVAL_PREFIX_DIMS', 16)
+@mock.patch.object(index, 'RETRIEVAL_CANDIDATES', 30)
+class TwoStageRetrievalTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(500, 64)).astype(np.float32)
+        self.ids = np.arange(1000, 1500)
+        self.queries = self.vectors[:20] + rng.normal(scale=0.2, size=(20, 64)).astype(np.float32)
+
+    def test_two_stage_finds_the_same_best_match_as_an_exact_scan(self):
+        agent_index = index.AgentIndex(1, self.ids, self.vectors)
+        self.assertEqual(agent_index.prefix.shape, (500, 16))
+        for position, query in enumerate(self.queries):
+            exact = agent_index.search(query, top_n=5, mode='exact')
+            two_stage = agent_index.search(query, top_n=5, mode='two_stage')
+            self.assertEqual(exact[0][1], 1000 + position)
+            self.assertEqual(two_stage[0], exact[0])
+            self.assertEqual([score for score, _ in exact], sorted((score for score, _ in exact), reverse=True))
+
+    def test_query_of_another_size_finds_nothing(self):
+        agent_index = index.AgentIndex(1, self.ids, self.vectors)
+        with self.assertLogs(index.logger, 'ERROR'):
+            self.assertEqual(agent_index.search(np.ones(32)), [])
+
+    def test_missing_or_mismatched_query_finds_nothing(self):
+        agent_index = index.AgentIndex(1, self.ids, self.vectors)
+        self.assertEqual(agent_index.search(None), [])
+        with self.assertLogs(index.logger, 'ERROR'):
+            self.assertEqual(agent_index.search([0.1, 0.2]), [])
+            self.assertEqual(agent_index.search(0.1), [])
+
+
+class AgentIndexBuildTests(TestCase):
+    def test_build_reads_current_model_vectors_and_skips_bad_ones(self):
+        agent = OpenAISettings.objects.create(agent_name='Support')
+        good = KnowledgeBase.objects.create(agent=agent, brief='a', question='a', embedding=[1.0, 0.0, 0.0])
+        KnowledgeBase.objects.create(agent=agent, brief='b', question='b', embedding=[1.0, 0.0])
+        KnowledgeBase.objects.create(agent=agent, brief='c', question='c', embedding=[0.0, 1.0, 0.0],
+                                     embedding_model='text-embedding-3-large')
+        with self.assertLogs(index.logger, 'WARNING'):
+            agent_index = index.AgentIndex.build(agent)
+        self.assertEqual(list(agent_index.ids), [good.pk])
+        self.assertEqual(agent_index.search([2.0, 0.0, 0.0], top_n=1), [(1.0, good.pk)])
+
+
+@mock.patch.object(index, 'RETRIEVAL_PREFIX_DIMS', 16)
+@mock.patch.object(index, 'RETRIEVAL_CANDIDATES', 60)
+@mock.patch.object(index, 'RETRIEVAL_RERANK_CANDIDATES', 20)
+class QuantizedIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.vectors = rng.normal(size=(400, 64)).astype(np.float32)
+        self.ids = np.arange(1, 401)
+        self.queries = self.vectors[:20] + rng.normal(scale=0.2, size=(20, 64)).astype(np.float32)
+        self.exact = index.AgentIndex(1, self.ids, self.vectors)
+        self.loaded = []
+
+    def _loader(self, ids, dims):
+        # Stands in for fetch_vectors: exact vectors by id
+        self.loaded.append(len(ids))
+        return np.asarray(ids), index._normalize(self.vectors[np.asarray(ids) - 1])
+
+    def test_compressed_indexes_rerank_to_exact_scores(self):
+        for cls in (index.Int8AgentIndex, index.BinaryAgentIndex):
+            quantized = cls(1, self.ids, self.vectors, vector_loader=self._loader)
+            self.assertIsNone(quantized.vectors)
+            self.assertLess(quantized.nbytes, self.exact.nbytes / 3)
+            for mode in ('exact', 'two_stage'):
+                for query in self.queries:
+                    with self.subTest(index=cls.quantization, mode=mode):
+                        expected = self.exact.search(query, top_n=3, mode='exact')[0]
+                        best = quantized.search(query, top_n=3, mode=mode)[0]
+                        self.assertEqual(best[1], expected[1])
+                        self.assertAlmostEqual(best[0], expected[0], places=5)
+        self.assertEqual(set(self.loaded), {20})
+
+
+class FetchVectorsTests(TestCase):
+    def test_deleted_entries_and_other_sizes_are_skipped(self):
+        agent = OpenAISettings.objects.create(agent_name='Support')
+        kept = KnowledgeBase.objects.create(agent=agent, brief='a', question='a', embedding=[0.0, 2.0])
+        other_size = KnowledgeBase.objects.create(agent=agent, brief='b', question='b', embedding=[1.0, 0.0, 0.0])
+        ids, vectors = index.fetch_vectors([kept.pk + 1000, kept.pk, other_size.pk], 2)
+        self.assertEqual(list(ids), [kept.pk])
+        self.assertEqual(vectors.tolist(), [[0.0, 1.0]])
+
+
+class IndexManagerTests(TestCase):
+    def setUp(self):
+        self.agents = [OpenAISettings.objects.create(agent_name=f"Agent {i}") for i in range(3)]
+        for agent in self.agents:
+            KnowledgeBase.objects.bulk_create([
+                KnowledgeBase(agent=agent, brief=str(i), question=str(i), embedding=[float(i), 1.0, 0.0, 0.0])
+                for i in range(8)
+            ])
+        self.manager = index.IndexManager()
+
+    def test_cached_index_is_reused_until_its_ttl(self):
+        first = self.manager.get(self.agents[0])
+        with self.assertNumQueries(0):
+            self.assertIs(self.manager.get(self.agents[0]), first)
+        with mock.patch.object(index, 'INDEX_TTL', 0):
+            # One aggregate query confirms nothing changed
+            with self.assertNumQueries(1):
+                self.assertIs(self.manager.get(self.agents[0]), first)
+            KnowledgeBase.objects.filter(agent=self.agents[0]).first().delete()
+            self.assertEqual(len(self.manager.get(self.agents[0])), 7)
+        self.assertEqual(self.manager.stats()['revalidations'], 1)
+
+    def test_least_recently_used_index_is_evicted_over_budget(self):
+        size = self.manager.get(self.agents[0]).nbytes
+        self.manager.memory_budget = size * 2
+        self.manager.get(self.agents[1])
+        self.manager.get(self.agents[0])
+        self.manager.get(self.agents[2])
+        self.assertEqual(
+            [self.manager.is_loaded(agent.id) for agent in self.agents],
+            [True, False, True],
+        )
+        stats = self.manager.stats()
+        self.assertEqual((stats['evictions'], stats['used_bytes']), (1, size * 2))
+
+    def test_index_built_during_an_invalidation_is_not_cached(self):
+        build = index.AgentIndex.build
+
+        def invalidated_while_building(agent):
+            self.manager.invalidate(agent.id)
+            return build(agent)
+
+        with mock.patch.object(index.AgentIndex, 'build', side_effect=invalidated_while_building):
+            self.assertEqual(len(self.manager.get(self.agents[0])), 8)
+        self.assertFalse(self.manager.is_loaded(self.agents[0].id))
+
+    def test_saving_an_entry_invalidates_the_shared_index(self):
+        index.index_manager.get(self.agents[0])
+        self.addCleanup(index.invalidate_agent_index, self.agents[0].id)
+        KnowledgeBase.objects.create(agent=self.agents[0], brief='new', question='new', embedding=[0.0, 0.0, 1.0, 0.0])
+        self.assertFalse(index.index_manager.is_loaded(self.agents[0].id))
+
+
+class CanonicalAnswerTests(TestCase):
+    def setUp(self):
+        self.agent = OpenAISettings.objects.create(agent_name='Support', model_name='gpt-4o', system_context='Be brief.')
+        self.entry = KnowledgeBase.objects.create(agent=self.agent, brief='Opening hours', question='We open 9-5, Sunday to Thursday.')
+        source = DocumentIngestion.objects.create(agent=self.agent, file='knowledge/documents/faq.txt', original_name='faq.txt')
+        KnowledgeBase.objects.create(agent=self.agent, brief='faq.txt', question='A document chunk.', source=source)
+
+    def _generate(self, agent, entry):
+        return f"Answer to {entry.brief}"
+
+    def test_key_covers_brief_text_prompt_and_model(self):
+        key = canonical.canonical_key(self.agent, self.entry)
+        changes = [
+            (self.entry, 'brief', 'Hours'),
+            (self.entry, 'question', 'We open 10-6.'),
+            (self.agent, 'system_context', 'Be friendly.'),
+            (self.agent, 'model_name', 'gpt-4o-mini'),
+        ]
+        for obj, field, value in changes:
+            original = getattr(obj, field)
+            setattr(obj, field, value)
+            self.assertNotEqual(canonical.canonical_key(self.agent, self.entry), key, field)
+            setattr(obj, field, original)
+        self.assertEqual(canonical.canonical_key(self.agent, self.entry), key)
+
+    def test_answers_are_generated_for_curated_entries_until_they_go_stale(self):
+        with mock.patch.object(canonical, '_generate', side_effect=self._generate) as generate:
+            self.assertEqual(canonical.generate_canonical_answers(self.agent.pk), 1)
+            self.assertEqual(canonical.generate_canonical_answers(self.agent.pk), 0)
+            KnowledgeBase.objects.filter(pk=self.entry.pk).update(brief='Hours')
+            self.assertEqual(canonical.generate_canonical_answers(self.agent.pk), 1)
+        self.assertEqual(generate.call_count, 2)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.canonical_answer, 'Answer to Hours')
+        self.assertEqual(self.entry.canonical_answer_key, canonical.canonical_key(self.agent, self.entry))
+        self.assertFalse(KnowledgeBase.objects.filter(source__isnull=False).exclude(canonical_answer='').exists())
+
+    def test_failed_generation_is_left_for_the_next_run(self):
+        with mock.patch.object(canonical, '_generate', side_effect=ConnectionError('offline')), \
+                self.assertLogs(canonical.logger, 'WARNING'):
+            self.assertEqual(canonical.generate_canonical_answers(self.agent.pk), 0)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.canonical_answer_key, '')
+
+    def test_direct_answer_needs_a_confident_unambiguous_current_match(self):
+        self.agent.direct_answers = True
+        self.entry.canonical_answer = 'Nine to five.'
+        self.entry.canonical_answer_key = canonical.canonical_key(self.agent, self.entry)
+        other = KnowledgeBase(question='Delivery takes three days.')
+
+        self.assertEqual(canonical.find_direct_answer(self.agent, [(0.95, self.entry), (0.7, other)]), 'Nine to five.')
+        self.assertIsNone(canonical.find_direct_answer(self.agent, [(0.85, self.entry)]))
+        self.assertIsNone(canonical.find_direct_answer(self.agent, [(0.95, self.entry), (0.93, other)]))
+        self.assertIsNone(canonical.find_direct_answer(self.agent, []))
+        self.entry.brief = 'Hours'
+        self.assertIsNone(canonical.find_direct_answer(self.agent, [(0.95, self.entry)]))
+        self.agent.direct_answers = False
+        self.entry.brief = 'Opening hours'
+        self.assertIsNone(canonical.find_direct_answer(self.agent, [(0.95, self.entry)]))
+
+    def test_editing_a_curated_entry_schedules_one_run_after_commit(self):
+        OpenAISettings.objects.filter(pk=self.agent.pk).update(direct_answers=True)
+        with mock.patch.object(canonical, '_submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            self.entry.question = 'We open 10-6.'
+            self.entry.save()
+        submit.assert_called_once_with(self.agent.pk)
+
+    def test_runs_go_to_the_job_pool_once_per_agent(self):
+        with mock.patch.object(canonical, '_scheduled', set()), \
+                mock.patch('webhook.background.job_executor.submit') as submit, \
+                mock.patch('webhook.background.background_executor.submit') as message_submit:
+            canonical._submit(self.agent.pk)
+            canonical._submit(self.agent.pk)
+        submit.assert_called_once_with(canonical._run_scheduled, self.agent.pk)
+        message_submit.assert_not_called()
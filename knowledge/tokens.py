@@ -0,0 +1,91 @@
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# text-embedding-3-* and the gpt-4o/gpt-5 families are close enough to cl100k_base for budgeting.
+# tiktoken downloads the BPE file on first use; point TIKTOKEN_CACHE_DIR at a copy to load it offline.
+ENCODING_NAME = 'cl100k_base'
+# Seconds before a failed load is tried again, so callers don't each wait on the download
+ENCODING_RETRY_SECONDS = 60
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed_at = None
+_WORD_RE = re.compile(r'\S+\s*|\s+')
+
+
+class TokenizerUnavailable(RuntimeError):
+    """The tiktoken encoding could not be loaded (package missing or BPE file not downloadable)."""
+
+
+def _get_encoding():
+    """Loads tiktoken once, under a lock. Raises TokenizerUnavailable when it can't be loaded."""
+    global _encoding, _encoding_failed_at
+    if _encoding is not None:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            if _encoding_failed_at is not None and time.monotonic() - _encoding_failed_at < ENCODING_RETRY_SECONDS:
+                raise TokenizerUnavailable(f"the {ENCODING_NAME} tokenizer failed to load less than {ENCODING_RETRY_SECONDS}s ago")
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception as e:
+                _encoding_failed_at = time.monotonic()
+                raise TokenizerUnavailable(f"could not load the {ENCODING_NAME} tokenizer: {e}") from e
+    return _encoding
+
+
+def encode(text: str) -> list:
+    """Splits text into tiktoken ids."""
+    return _get_encoding().encode(text, disallowed_special=())
+
+
+def decode(tokens: list) -> str:
+    """Inverse of `encode`."""
+    return _get_encoding().decode(tokens)
+
+
+def token_boundary(tokens: list, end: int) -> int:
+    """
+    Returns the largest position up to `end` where `tokens[:position]` decodes to whole
+    characters. A token can hold part of a multibyte character (Arabic letters often span
+    two tokens), and cutting there leaves U+FFFD on both sides. `tokens` must start on a
+    character boundary. Falls back to `end` if no position before it is clean.
+    """
+    encoding = _get_encoding()
+    for position in range(end, 0, -1):
+        try:
+            encoding.decode_bytes(tokens[:position]).decode('utf-8')
+            return position
+        except UnicodeDecodeError:
+            # The incomplete character is at most 3 bytes, so only a few steps back
+            continue
+    return end
+
+
+def count_tokens(text: str) -> int:
+    return len(encode(text)) if text else 0
+
+
+def estimate_tokens(text: str) -> int:
+    """count_tokens, or a word count while the tokenizer is unavailable. For budgets only, never for chunking."""
+    try:
+        return count_tokens(text)
+    except TokenizerUnavailable as e:
+        logger.warning(f"⚠️ TOKENS: {e}; estimating with a word count.")
+        return len(_WORD_RE.findall(text)) if text else 0
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text to at most `max_tokens` tokens on a character boundary (words while the tokenizer is unavailable)."""
+    try:
+        tokens = encode(text)
+    except TokenizerUnavailable:
+        return ''.join(_WORD_RE.findall(text)[:max_tokens])
+    if len(tokens) <= max_tokens:
+        return text
+    return decode(tokens[:token_boundary(tokens, max_tokens)])
@@ -5,6 +5,9 @@ app_name = "knowledge"
 urlpatterns = [
     path('<int:agent_id>/add/', views.add_question, name='add_knowledge_to_agent'),
     path('<int:agent_id>/faq/', views.faq, name="faq"), 
+    path('<int:agent_id>/faq/data/', views.faq_data, name="faq_data"),
+    path('<int:agent_id>/upload/', views.upload_document, name='upload_document'),
     path('<int:agent_id>/faq/edit/<int:pk>/', views.edit_question, name='edit_question'),
+    path('index/stats/', views.index_stats, name='index_stats'),
    
 ]
\ No newline at end of file
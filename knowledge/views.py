@@ -1,24 +1,69 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.db.models import Q
+from django.template.loader import render_to_string
 from django.urls import reverse
 from datetime import datetime
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from .models import *
-from .forms import KnowledgeBaseForm
+from .forms import KnowledgeBaseForm, DocumentUploadForm
+from .ingestion import run_ingestion
+from webhook.background import job_executor
 from core.models import OpenAISettings
 
+FAQ_PAGE_SIZE = 50
+
+
+def _faq_page(request, agent):
+    """
+    Returns one keyset page of an agent's knowledge entries, newest first.
+
+    The embedding column is never loaded. `q` filters brief/question (trigram-indexed
+    on PostgreSQL) and `after` is the id of the last entry of the previous page.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        after = int(request.GET.get('after', ''))
+    except ValueError:
+        after = None
+
+    entries = KnowledgeBase.objects.filter(agent=agent).only('id', 'brief', 'question', 'created_at').order_by('-id')
+    if query:
+        entries = entries.filter(Q(brief__icontains=query) | Q(question__icontains=query))
+    if after:
+        entries = entries.filter(id__lt=after)
+
+    page = list(entries[:FAQ_PAGE_SIZE + 1])
+    next_after = page[FAQ_PAGE_SIZE - 1].id if len(page) > FAQ_PAGE_SIZE else None
+    return page[:FAQ_PAGE_SIZE], next_after, query
+
+
 # Create your views here
 @login_required
 def faq(request, agent_id: int):
-    try:
-        agent = get_object_or_404(OpenAISettings, pk=agent_id)
-    except ObjectDoesNotExist:
-         return render(request, '404_template.html', {'message': f'Agent ID {agent_id} not found.'}, status=404)
-        
-    knowledgebase = KnowledgeBase.objects.filter(agent=agent).select_related('agent')
+    agent = get_object_or_404(OpenAISettings, pk=agent_id)
+    knowledgebase, next_after, query = _faq_page(request, agent)
     return render(request, 'knowledge/faq.html',{
         'knowledgebase' : knowledgebase,
         'current_agent': agent,
+        'next_after': next_after,
+        'query': query,
+    })
+
+
+@login_required
+def faq_data(request, agent_id: int):
+    """AJAX endpoint behind the FAQ page's "load more" button."""
+    agent = get_object_or_404(OpenAISettings, pk=agent_id)
+    knowledgebase, next_after, query = _faq_page(request, agent)
+    html = render_to_string('knowledge/faq_items.html', {
+        'knowledgebase': knowledgebase,
+        'current_agent': agent,
+    }, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_after': next_after,
     })
 
 
@@ -28,7 +73,7 @@ def add_question(request, agent_id: int):
     agent = get_object_or_404(OpenAISettings, pk=agent_id)
 
     if request.method == 'POST':
-        form = KnowledgeBaseForm(request.POST)
+        form = KnowledgeBaseForm(request.POST, agent=agent)
         if form.is_valid():
             kb = form.save(commit=False)
             kb.agent = agent
@@ -50,7 +95,7 @@ def edit_question(request, agent_id: int, pk: int):
     kb = get_object_or_404(KnowledgeBase, pk=pk, agent=agent) 
 
     if request.method == 'POST':
-        form = KnowledgeBaseForm(request.POST, instance=kb)
+        form = KnowledgeBaseForm(request.POST, instance=kb, agent=agent)
         if form.is_valid():
             form.save()
             return redirect('knowledge:faq', agent_id=agent_id) 
@@ -61,4 +106,34 @@ def edit_question(request, agent_id: int, pk: int):
         'form': form, 
         'kb': kb,
         'current_agent': agent
-    })
\ No newline at end of file
+    })
+
+
+@login_required
+def upload_document(request, agent_id: int):
+    agent = get_object_or_404(OpenAISettings, pk=agent_id)
+
+    if request.method == 'POST':
+        form = DocumentUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            ingestion = form.save(commit=False)
+            ingestion.agent = agent
+            ingestion.save()
+            # Parsing and embedding run in the background; the page shows progress
+            job_executor.submit(run_ingestion, ingestion.id)
+            return redirect('knowledge:upload_document', agent_id=agent_id)
+    else:
+        form = DocumentUploadForm()
+
+    return render(request, 'knowledge/upload_document.html', {
+        'form': form,
+        'current_agent': agent,
+        'ingestions': agent.ingestions.order_by('-created_at')[:20],
+    })
+
+
+@staff_member_required
+def index_stats(request):
+    """Retrieval index occupancy, load and eviction counters of the serving process."""
+    from .index import index_manager
+    return JsonResponse(index_manager.stats())
@@ -4,3 +4,9 @@ from .models import *
 admin.site.register(Client)
 admin.site.register(Message)
 admin.site.register(Response)
+admin.site.register(ArchivedMessage)
+admin.site.register(OutboxMessage)
+admin.site.register(QuarantinedRow)
+admin.site.register(ProcessedWebhook)
+admin.site.register(DailyConversationStats)
+admin.site.register(MessageProfile)
@@ -0,0 +1,151 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Message, Response, DailyConversationStats, DailyActiveClient, RollupCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Rows younger than this are left for the next run, so write-behind batches that commit
+# late (with older ids/timestamps) are never skipped by the checkpoints
+ROLLUP_LAG_SECONDS = getattr(settings, 'ROLLUP_LAG_SECONDS', 120)
+ROLLUP_BATCH_SIZE = getattr(settings, 'ROLLUP_BATCH_SIZE', 5000)
+
+_MEDIA_FIELDS = {
+    'text': 'text_messages',
+    'image': 'image_messages',
+    'voice': 'voice_messages',
+}
+
+
+def _checkpoint(name: str) -> RollupCheckpoint:
+    checkpoint, _ = RollupCheckpoint.objects.select_for_update().get_or_create(name=name)
+    return checkpoint
+
+
+def _stats_key_filter(keys):
+    query = Q()
+    for date, agent_id in keys:
+        query |= Q(date=date, agent_id=agent_id) if agent_id is not None else Q(date=date, agent__isnull=True)
+    return query
+
+
+def _apply(deltas: dict):
+    """Adds {(date, agent_id): {field: delta}} to the daily stats rows, creating missing ones."""
+    existing = {
+        (row.date, row.agent_id): row
+        for row in DailyConversationStats.objects.select_for_update().filter(_stats_key_filter(deltas))
+    }
+    new_rows = []
+    for key, fields in deltas.items():
+        if key in existing:
+            DailyConversationStats.objects.filter(pk=existing[key].pk).update(
+                **{field: F(field) + value for field, value in fields.items()}
+            )
+        else:
+            new_rows.append(DailyConversationStats(date=key[0], agent_id=key[1], **fields))
+    DailyConversationStats.objects.bulk_create(new_rows)
+
+
+def _new_active_clients(clients: dict) -> dict:
+    """Records {(date, agent_id): {client ids}} and returns how many of them are new per key."""
+    seen = defaultdict(set)
+    for date, agent_id, client_id in DailyActiveClient.objects.filter(_stats_key_filter(clients)).filter(
+        client_id__in={client for ids in clients.values() for client in ids}
+    ).values_list('date', 'agent_id', 'client_id'):
+        seen[(date, agent_id)].add(client_id)
+
+    new_rows, counts = [], {}
+    for key, ids in clients.items():
+        fresh = ids - seen[key]
+        counts[key] = len(fresh)
+        new_rows.extend(DailyActiveClient(date=key[0], agent_id=key[1], client_id=client) for client in fresh)
+    DailyActiveClient.objects.bulk_create(new_rows)
+    return counts
+
+
+def rollup_messages(batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """Folds one batch of new messages into the daily stats. Returns the number of messages read."""
+    cutoff = timezone.now() - timedelta(seconds=ROLLUP_LAG_SECONDS)
+    with transaction.atomic():
+        checkpoint = _checkpoint('messages')
+        rows = list(
+            Message.objects.filter(id__gt=checkpoint.last_id, timestamp__lt=cutoff)
+            .order_by('id')
+            .values_list('id', 'timestamp', 'agent_id', 'client_id', 'message_type')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        clients = defaultdict(set)
+        for _, timestamp, agent_id, client_id, message_type in rows:
+            key = (timezone.localdate(timestamp), agent_id)
+            deltas[key]['messages'] += 1
+            deltas[key][_MEDIA_FIELDS.get(message_type, 'text_messages')] += 1
+            clients[key].add(client_id)
+        for key, count in _new_active_clients(clients).items():
+            if count:
+                deltas[key]['active_clients'] += count
+        _apply(deltas)
+
+        checkpoint.last_id = rows[-1][0]
+        checkpoint.save(update_fields=['last_id', 'updated_at'])
+    return len(rows)
+
+
+def rollup_responses(batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Folds one batch of new responses into the daily stats of their message's day and agent.
+    Response ids are message ids (not insertion ordered), so the checkpoint is (timestamp, id).
+    """
+    cutoff = timezone.now() - timedelta(seconds=ROLLUP_LAG_SECONDS)
+    with transaction.atomic():
+        checkpoint = _checkpoint('responses')
+        responses = Response.objects.filter(timestamp__lt=cutoff)
+        if checkpoint.last_timestamp is not None:
+            responses = responses.filter(
+                Q(timestamp__gt=checkpoint.last_timestamp)
+                | Q(timestamp=checkpoint.last_timestamp, message_id__gt=checkpoint.last_id)
+            )
+        rows = list(
+            responses.order_by('timestamp', 'message_id')
+            .values_list('message_id', 'timestamp', 'message__timestamp', 'message__agent_id')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        deltas = defaultdict(lambda: defaultdict(float))
+        for _, timestamp, message_timestamp, agent_id in rows:
+            key = (timezone.localdate(message_timestamp), agent_id)
+            deltas[key]['responses'] += 1
+            deltas[key]['response_seconds'] += max(0.0, (timestamp - message_timestamp).total_seconds())
+        for fields in deltas.values():
+            fields['responses'] = int(fields['responses'])
+        _apply(deltas)
+
+        checkpoint.last_id = rows[-1][0]
+        checkpoint.last_timestamp = rows[-1][1]
+        checkpoint.save(update_fields=['last_id', 'last_timestamp', 'updated_at'])
+    return len(rows)
+
+
+def update_rollups(batch_size: int = ROLLUP_BATCH_SIZE):
+    """Brings the rollups up to date, one short transaction per batch. Returns (messages, responses) read."""
+    messages = responses = 0
+    while True:
+        read = rollup_messages(batch_size)
+        messages += read
+        if read < batch_size:
+            break
+    while True:
+        read = rollup_responses(batch_size)
+        responses += read
+        if read < batch_size:
+            break
+    if messages or responses:
+        logger.info(f"📊 ROLLUP: Folded {messages} messages and {responses} responses into daily stats.")
+    return messages, responses
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WebhookConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'webhook'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,70 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on concurrently processed messages, and so on DB connections held by background work
+BACKGROUND_MAX_WORKERS = getattr(settings, 'BACKGROUND_MAX_WORKERS', 8)
+# Long jobs (document ingestion, canonical answers) get their own, smaller pool so a burst of
+# uploads can't occupy the workers that answer WhatsApp messages
+BACKGROUND_JOB_WORKERS = getattr(settings, 'BACKGROUND_JOB_WORKERS', 2)
+
+
+class BackgroundExecutor:
+    """
+    A bounded thread pool for background processing with managed DB connections.
+
+    Each worker thread holds at most one connection per database. Connections are
+    checked before every job (stale or broken ones are dropped, see CONN_MAX_AGE and
+    CONN_HEALTH_CHECKS) and reused across the jobs of a burst. As soon as a worker
+    finishes a job with nothing left in the queue it closes its connections, so an
+    idle pool holds none.
+    """
+
+    def __init__(self, max_workers: int = BACKGROUND_MAX_WORKERS, name: str = 'background'):
+        self.max_workers = max_workers
+        self.name = name
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = 0
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"🔴 BACKGROUND FAIL: {getattr(fn, '__name__', fn)} raised: {e}", exc_info=True)
+            raise
+        finally:
+            with self._lock:
+                idle = self._queued == 0
+            if idle:
+                connections.close_all()
+            else:
+                close_old_connections()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            # Created lazily so gunicorn workers don't inherit pool threads from the master
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.name,
+                )
+            self._queued += 1
+            return self._executor.submit(self._run, fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+background_executor = BackgroundExecutor()
+job_executor = BackgroundExecutor(max_workers=BACKGROUND_JOB_WORKERS, name='background-job')
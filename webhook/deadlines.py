@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# End-to-end budget of one message, from webhook arrival (debounce included) to the queued reply
+MESSAGE_SLA_SECONDS = getattr(settings, 'MESSAGE_SLA_SECONDS', 60)
+# Timeout of calls made without a deadline (the OpenAI client's own default)
+OPENAI_TIMEOUT = getattr(settings, 'OPENAI_TIMEOUT', 60)
+# A call never gets less than this, even when the message is already late
+OPENAI_MIN_TIMEOUT = getattr(settings, 'OPENAI_MIN_TIMEOUT', 3)
+# Hedging: once a call outlasts its model's observed p95, a duplicate is sent and the first answer wins
+OPENAI_HEDGE_ENABLED = getattr(settings, 'OPENAI_HEDGE_ENABLED', False)
+OPENAI_HEDGE_MIN_SAMPLES = getattr(settings, 'OPENAI_HEDGE_MIN_SAMPLES', 20)
+# Calls remembered per key, for hedging and for model routing's health checks (webhook.routing)
+OPENAI_CALL_WINDOW = 200
+# Threads that run hedged calls; a losing duplicate keeps its thread until it returns or times out
+OPENAI_HEDGE_MAX_WORKERS = getattr(settings, 'OPENAI_HEDGE_MAX_WORKERS', 16)
+
+
+class Deadline:
+    """The time left of one message's SLA, counted from `started` (time.monotonic())."""
+
+    def __init__(self, seconds: float = MESSAGE_SLA_SECONDS, started: float = None):
+        self.expires = (time.monotonic() if started is None else started) + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, share: float = 1.0) -> float:
+        """Timeout for the next call: `share` of the remaining budget, so later stages keep the rest."""
+        return max(OPENAI_MIN_TIMEOUT, self.remaining() * share)
+
+
+# Per-process outcomes of recent calls (attempts, when hedged): key (e.g. 'chat:gpt-4o') -> deque of (seconds, ok)
+_calls = {}
+_calls_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def record_call(key: str, seconds: float, ok: bool = True):
+    with _calls_lock:
+        _calls.setdefault(key, deque(maxlen=OPENAI_CALL_WINDOW)).append((seconds, ok))
+
+
+def forget(key: str):
+    """Drops the history of `key`, e.g. once routing has judged it on that history."""
+    with _calls_lock:
+        _calls.pop(key, None)
+
+
+def tracked_keys() -> list:
+    with _calls_lock:
+        return list(_calls)
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def call_stats(key: str, q: float = 0.95, window: int = None) -> dict:
+    """
+    The last `window` calls of `key` (every remembered one by default): their count, the
+    `q` quantile latency of the successful ones (None without any) and the error rate.
+    """
+    with _calls_lock:
+        calls = list(_calls.get(key, ()))
+    if window is not None:
+        calls = calls[-window:]
+    latencies = [seconds for seconds, ok in calls if ok]
+    return {
+        'calls': len(calls),
+        'percentile': _percentile(latencies, q) if latencies else None,
+        'error_rate': (len(calls) - len(latencies)) / len(calls) if calls else 0.0,
+    }
+
+
+def observed_p95(key: str):
+    """p95 latency of `key`'s recent successful calls, or None until there are enough of them."""
+    with _calls_lock:
+        latencies = [seconds for seconds, ok in _calls.get(key, ()) if ok]
+    if len(latencies) < OPENAI_HEDGE_MIN_SAMPLES:
+        return None
+    return _percentile(latencies, 0.95)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=OPENAI_HEDGE_MAX_WORKERS, thread_name_prefix='openai-hedge')
+    return _executor
+
+
+def _timed(key: str, call, timeout):
+    started = time.perf_counter()
+    try:
+        result = call(timeout)
+    except Exception:
+        record_call(key, time.perf_counter() - started, ok=False)
+        raise
+    record_call(key, time.perf_counter() - started)
+    return result
+
+
+def call_with_deadline(key: str, call, deadline: Deadline = None, share: float = 1.0, hedge: bool = None):
+    """
+    Runs `call(timeout)`, an API request that must give up after `timeout` seconds
+    (None: the client's default). The timeout is `share` of what is left of `deadline`.
+
+    With hedging on and enough history for `key`, a call still running after the
+    key's p95 latency gets a duplicate with the time that is left; the first successful
+    result is returned and the other request is left to finish on its own. An error
+    is raised only when every attempt failed, or TimeoutError once the attempts' time
+    is up (e.g. when the hedge pool is saturated and an attempt never started).
+    """
+    timeout = deadline.timeout(share) if deadline is not None else None
+    delay = observed_p95(key) if (OPENAI_HEDGE_ENABLED if hedge is None else hedge) else None
+    if delay is None or (timeout is not None and delay >= timeout):
+        return _timed(key, call, timeout)
+
+    started = time.monotonic()
+    ends_at = started + (timeout if timeout is not None else OPENAI_TIMEOUT)
+    executor = _get_executor()
+    pending = {executor.submit(_timed, key, call, timeout)}
+    done, _ = wait(pending, timeout=delay)
+    if not done:
+        hedge_timeout = None if timeout is None else max(OPENAI_MIN_TIMEOUT, timeout - (time.monotonic() - started))
+        logger.info(f"🪃 HEDGE: {key} still running after p95 {delay * 1000:.0f}ms; sending a duplicate.")
+        pending.add(executor.submit(_timed, key, call, hedge_timeout))
+        ends_at = max(ends_at, time.monotonic() + (hedge_timeout if hedge_timeout is not None else OPENAI_TIMEOUT))
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, ends_at - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            # Attempts still queued behind busy hedge threads are dropped
+            for future in pending:
+                future.cancel()
+            raise TimeoutError(f"{key} got no answer within {ends_at - started:.1f}s.")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
@@ -0,0 +1,146 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import Message, ArchivedMessage
+
+# Messages read per keyset range (one query each)
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+# Output is buffered into pieces of about this many bytes before being yielded
+EXPORT_WRITE_BUFFER = 64 * 1024
+
+EXPORT_FIELDS = (
+    'message_id', 'timestamp', 'agent_id', 'client_jid', 'client_name', 'message_type',
+    'content', 'image_url', 'voice_note_url', 'response', 'response_timestamp',
+    'response_model', 'response_route', 'generation_ms',
+)
+_COLUMNS = (
+    'id', 'timestamp', 'agent_id', 'client__jid', 'client__name', 'message_type',
+    'content', 'image_url', 'voice_note_url', 'response__content', 'response__timestamp',
+    'response__model', 'response__route', 'response__generation_ms',
+)
+# The same fields read from ArchivedMessage; rows are walked by the archive's own id
+_ARCHIVE_COLUMNS = (
+    'id', 'original_id', 'timestamp', 'agent_id', 'client__jid', 'client__name', 'message_type',
+    'content', 'image_url', 'voice_note_url', 'response_content', 'response_timestamp',
+    'response_model', 'response_route', 'response_generation_ms',
+)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _filtered(queryset, agent_id, client_id, since, until):
+    if agent_id is not None:
+        queryset = queryset.filter(agent_id=agent_id)
+    if client_id is not None:
+        queryset = queryset.filter(client_id=client_id)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=_day_start(since))
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=_day_start(until + timedelta(days=1)))
+    return queryset
+
+
+def _keyset_rows(queryset, columns, chunk_size):
+    """Yields the values of `columns` (the first one is the id walked on) one keyset range at a time."""
+    last_id = 0
+    while True:
+        chunk = (
+            queryset.filter(id__gt=last_id)
+            .order_by('id')
+            .values_list(*columns)[:chunk_size]
+            .iterator(chunk_size=chunk_size)
+        )
+        read = 0
+        for values in chunk:
+            read += 1
+            last_id = values[0]
+            yield values
+        if read < chunk_size:
+            return
+
+
+def export_rows(agent_id=None, client_id=None, since=None, until=None, chunk_size: int = EXPORT_CHUNK_SIZE,
+                include_archive: bool = False):
+    """
+    Yields conversation rows (dicts keyed by EXPORT_FIELDS) in message id order.
+    `since` and `until` are dates, both inclusive, in the project time zone.
+    With `include_archive`, the matching ArchivedMessage rows (the older history moved
+    there by archive_messages) come first, in the order they were archived and keyed by
+    their original message id. Rows
+    archived while the export runs can be missed, so don't run it during archive_messages.
+
+    Walks the table in keyset ranges (id > last seen id, LIMIT chunk_size), so every
+    query is short and bounded whatever the history size, and only one range is held
+    in memory at a time. Responses come from the same query through a LEFT JOIN.
+    """
+    sources = [(_filtered(Message.objects.all(), agent_id, client_id, since, until), _COLUMNS)]
+    if include_archive:
+        archived = _filtered(ArchivedMessage.objects.all(), agent_id, client_id, since, until)
+        sources.insert(0, (archived, _ARCHIVE_COLUMNS))
+
+    for queryset, columns in sources:
+        for values in _keyset_rows(queryset, columns, chunk_size):
+            # Archive rows start with their own id, which isn't exported
+            row = dict(zip(EXPORT_FIELDS, values[len(columns) - len(EXPORT_FIELDS):]))
+            for field in ('timestamp', 'response_timestamp'):
+                if row[field] is not None:
+                    row[field] = row[field].isoformat()
+            yield row
+
+
+class _Echo:
+    """File-like object whose write() returns the line, so csv.writer output can be streamed."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def encode_stream(lines, compress: bool = False):
+    """Encodes text lines to UTF-8 bytes in ~64 KB pieces, gzip-compressed on the fly if `compress`."""
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= EXPORT_WRITE_BUFFER:
+            piece = b''.join(buffer)
+            buffer, size = [], 0
+            piece = compressor.compress(piece) if compressor else piece
+            if piece:
+                yield piece
+    piece = b''.join(buffer)
+    if compressor:
+        piece = compressor.compress(piece) + compressor.flush()
+    if piece:
+        yield piece
+
+
+def export_stream(fmt: str = 'csv', compress: bool = False, **filters):
+    """Yields the encoded export (bytes) for export_rows(**filters) in the given format."""
+    lines, _ = EXPORT_FORMATS[fmt]
+    return encode_stream(lines(export_rows(**filters)), compress)
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .background import background_executor
+from .models import ProcessedWebhook
+
+logger = logging.getLogger(__name__)
+
+# A message key is remembered this long; Evolution retries arrive within minutes
+IDEMPOTENCY_TTL = getattr(settings, 'WEBHOOK_IDEMPOTENCY_TTL', 24 * 3600)
+# Keys remembered in process memory (least recently seen are forgotten first)
+IDEMPOTENCY_CACHE_SIZE = getattr(settings, 'WEBHOOK_IDEMPOTENCY_CACHE_SIZE', 50000)
+# Expired rows are deleted at most this often per process
+IDEMPOTENCY_PURGE_INTERVAL = 600
+
+# (instance_id, message_id) -> time.monotonic() of the claim
+_seen = OrderedDict()
+_seen_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def _remember(key):
+    with _seen_lock:
+        _seen[key] = time.monotonic()
+        _seen.move_to_end(key)
+        while len(_seen) > IDEMPOTENCY_CACHE_SIZE:
+            _seen.popitem(last=False)
+
+
+def _seen_recently(key) -> bool:
+    claimed_at = _seen.get(key)
+    return claimed_at is not None and time.monotonic() - claimed_at < IDEMPOTENCY_TTL
+
+
+def claim_webhook(instance_id: str, message_id: str) -> bool:
+    """
+    Records a webhook message key and returns True the first time it is seen, across all
+    workers, within IDEMPOTENCY_TTL. Repeats of a key this process has already seen are
+    rejected from memory; new keys cost one INSERT on the unique (instance, message) key.
+    """
+    key = (instance_id, message_id)
+    if _seen_recently(key):
+        return False
+
+    _maybe_purge()
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            ProcessedWebhook.objects.create(instance_id=instance_id, message_id=message_id, created_at=now)
+        claimed = True
+    except IntegrityError:
+        # Claimed before; take it over only if that claim has expired and was not purged yet
+        claimed = ProcessedWebhook.objects.filter(
+            instance_id=instance_id,
+            message_id=message_id,
+            created_at__lt=now - timedelta(seconds=IDEMPOTENCY_TTL),
+        ).update(created_at=now) == 1
+
+    _remember(key)
+    return claimed
+
+
+def release_webhook(instance_id: str, message_id: str):
+    """Forgets a claim whose processing failed, so Evolution's retry is accepted."""
+    with _seen_lock:
+        _seen.pop((instance_id, message_id), None)
+    ProcessedWebhook.objects.filter(instance_id=instance_id, message_id=message_id).delete()
+
+
+def purge_expired_webhooks() -> int:
+    cutoff = timezone.now() - timedelta(seconds=IDEMPOTENCY_TTL)
+    deleted, _ = ProcessedWebhook.objects.filter(created_at__lt=cutoff).delete()
+    if deleted:
+        logger.info(f"🧹 IDEMPOTENCY: Purged {deleted} expired webhook keys.")
+    return deleted
+
+
+def _maybe_purge():
+    global _last_purge
+    now = time.monotonic()
+    with _seen_lock:
+        if now - _last_purge < IDEMPOTENCY_PURGE_INTERVAL:
+            return
+        _last_purge = now
+    background_executor.submit(purge_expired_webhooks)
@@ -0,0 +1,230 @@
+import binascii
+import json
+import logging
+import tempfile
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Size of each read from the request stream
+CHUNK_SIZE = 64 * 1024
+# The JSON key that carries the media payload in Evolution webhooks (data.message.base64)
+MEDIA_KEY = b'base64'
+# Decoded media stays in memory up to this size, then rolls over to a temp file on disk
+MEDIA_SPOOL_MAX_MEMORY = getattr(settings, 'WEBHOOK_MEDIA_SPOOL_MAX_MEMORY', 1024 * 1024)
+# Bodies are streamed, so Django's DATA_UPLOAD_MAX_MEMORY_SIZE never sees them; this caps what is read
+MAX_BODY_SIZE = getattr(settings, 'WEBHOOK_MAX_BODY_SIZE', 32 * 1024 * 1024)
+
+_WHITESPACE = b' \t\r\n'
+
+# Scanner states
+_OUT, _STR, _STR_ESC, _MEDIA, _MEDIA_ESC = range(5)
+
+
+class WebhookBodyTooLarge(ValueError):
+    """The webhook body is larger than MAX_BODY_SIZE."""
+
+
+def _find_string_special(chunk: bytes, start: int) -> int:
+    """Returns the index of the next quote or backslash in chunk, or -1 (memchr-backed bytes.find)."""
+    quote = chunk.find(b'"', start)
+    backslash = chunk.find(b'\\', start, len(chunk) if quote == -1 else quote)
+    return quote if backslash == -1 else backslash
+
+
+class _Base64Decoder:
+    """Incrementally decodes base64 text into a file, 4 characters at a time."""
+
+    def __init__(self, out):
+        self.out = out
+        self.pending = b''
+        self.head = bytearray()
+        self.head_done = False
+        self.size = 0
+
+    def write(self, data: bytes):
+        if not self.head_done:
+            # Strip a data URI header (data:image/jpeg;base64,...) before decoding
+            self.head += data
+            if self.head.startswith(b'data:'):
+                comma = self.head.find(b',')
+                if comma == -1:
+                    return
+                data = bytes(self.head[comma + 1:])
+            elif len(self.head) < 5 and b'data:'.startswith(bytes(self.head)):
+                return
+            else:
+                data = bytes(self.head)
+            self.head_done = True
+            self.head = None
+
+        data = self.pending + data.translate(None, _WHITESPACE)
+        cut = len(data) - len(data) % 4
+        if cut:
+            decoded = binascii.a2b_base64(data[:cut])
+            self.out.write(decoded)
+            self.size += len(decoded)
+        self.pending = data[cut:]
+
+    def close(self):
+        if not self.head_done:
+            self.head_done = True
+            head, self.head = bytes(self.head), None
+            self.write(head)
+        if self.pending:
+            decoded = binascii.a2b_base64(self.pending + b'=' * (-len(self.pending) % 4))
+            self.out.write(decoded)
+            self.size += len(decoded)
+            self.pending = b''
+        self.out.seek(0)
+
+
+class WebhookStreamParser:
+    """
+    Parses an Evolution webhook body incrementally.
+
+    Everything except the first `"base64"` string value is copied into a small
+    envelope buffer. The base64 value itself is decoded on the fly into a spooled
+    temporary file and replaced by `null` in the envelope, so the media is never
+    held as one large string.
+    """
+
+    def __init__(self, max_memory: int = MEDIA_SPOOL_MAX_MEMORY):
+        self.envelope = bytearray()
+        self.media_file = None
+        self.state = _OUT
+        self.key = bytearray()
+        self.key_overflow = False
+        self.after_key = False
+        self.expect_media = False
+        self.max_memory = max_memory
+        self.decoder = None
+
+    def _start_media(self):
+        self.media_file = tempfile.SpooledTemporaryFile(max_size=self.max_memory)
+        self.decoder = _Base64Decoder(self.media_file)
+        self.envelope += b'null'
+        self.state = _MEDIA
+
+    def feed(self, chunk: bytes):
+        i, n = 0, len(chunk)
+        while i < n:
+            if self.state == _OUT:
+                if self.after_key or self.expect_media:
+                    c = chunk[i]
+                    if c in _WHITESPACE:
+                        self.envelope.append(c)
+                        i += 1
+                        continue
+                    if self.after_key:
+                        self.after_key = False
+                        self.expect_media = c == ord(':')
+                        self.envelope.append(c)
+                        i += 1
+                        continue
+                    self.expect_media = False
+                    if c == ord('"'):
+                        self._start_media()
+                        i += 1
+                        continue
+
+                j = chunk.find(b'"', i)
+                if j == -1:
+                    self.envelope += chunk[i:]
+                    break
+                self.envelope += chunk[i:j + 1]
+                i = j + 1
+                self.state = _STR
+                self.key.clear()
+                self.key_overflow = False
+
+            elif self.state == _STR:
+                end = _find_string_special(chunk, i)
+                found = end != -1
+                end = end if found else n
+                piece = chunk[i:end]
+                self.envelope += piece
+                if not self.key_overflow:
+                    self.key += piece
+                    self.key_overflow = len(self.key) > len(MEDIA_KEY)
+                if not found:
+                    break
+                self.envelope.append(chunk[end])
+                i = end + 1
+                if chunk[end] == ord('"'):
+                    self.state = _OUT
+                    # Only the first media field is spooled; later ones stay in the envelope
+                    self.after_key = (
+                        self.media_file is None
+                        and not self.key_overflow
+                        and bytes(self.key) == MEDIA_KEY
+                    )
+                else:
+                    self.state = _STR_ESC
+                    self.key_overflow = True
+
+            elif self.state == _STR_ESC:
+                self.envelope.append(chunk[i])
+                i += 1
+                self.state = _STR
+
+            elif self.state == _MEDIA:
+                end = _find_string_special(chunk, i)
+                found = end != -1
+                end = end if found else n
+                self.decoder.write(chunk[i:end])
+                if not found:
+                    break
+                i = end + 1
+                if chunk[end] == ord('"'):
+                    self.decoder.close()
+                    self.state = _OUT
+                else:
+                    self.state = _MEDIA_ESC
+
+            elif self.state == _MEDIA_ESC:
+                # JSON may escape "/" as "\/"; line-break escapes of wrapped base64 are dropped
+                if chunk[i] == ord('/'):
+                    self.decoder.write(b'/')
+                i += 1
+                self.state = _MEDIA
+
+    def close(self):
+        """Returns the parsed envelope and the decoded media file (or None)."""
+        if self.state in (_MEDIA, _MEDIA_ESC):
+            self.media_file.close()
+            self.media_file = None
+            raise json.JSONDecodeError("Unterminated media string", self.envelope.decode('utf-8', 'replace'), len(self.envelope))
+
+        payload = json.loads(self.envelope.decode('utf-8'))
+        if self.media_file is not None:
+            logger.info(f"📦 INGEST: Spooled {self.decoder.size} decoded media bytes.")
+        return payload, self.media_file
+
+
+def parse_webhook_stream(stream, chunk_size: int = CHUNK_SIZE, max_memory: int = MEDIA_SPOOL_MAX_MEMORY,
+                         max_body_size: int = MAX_BODY_SIZE):
+    """
+    Reads a webhook body from a file-like stream (e.g. the Django request) in chunks.
+
+    Returns `(payload, media_file)`. `media_file` is a seekable file holding the
+    decoded bytes of `data.message.base64`, or None when the payload has no media.
+    The caller owns the file and must close it. Raises WebhookBodyTooLarge once more
+    than `max_body_size` bytes have been read (the declared length isn't trusted).
+    """
+    parser = WebhookStreamParser(max_memory=max_memory)
+    read = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            read += len(chunk)
+            if read > max_body_size:
+                raise WebhookBodyTooLarge(f"Webhook body is larger than {max_body_size} bytes.")
+            parser.feed(chunk)
+        return parser.close()
+    except Exception:
+        if parser.media_file is not None:
+            parser.media_file.close()
+        raise
@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from webhook.models import Message, Response, ArchivedMessage
+
+
+def _archived_row(message: Message) -> ArchivedMessage:
+    try:
+        response = message.response
+    except Response.DoesNotExist:
+        response = None
+    return ArchivedMessage(
+        original_id=message.pk,
+        client_id=message.client_id,
+        agent_id=message.agent_id,
+        message_type=message.message_type,
+        content=message.content,
+        image_url=message.image_url,
+        voice_note_url=message.voice_note_url,
+        timestamp=message.timestamp,
+        response_content=response.content if response else None,
+        response_timestamp=response.timestamp if response else None,
+        response_model=response.model if response else '',
+        response_route=response.route if response else '',
+        response_generation_ms=response.generation_ms if response else None,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves messages older than MESSAGE_ARCHIVE_AFTER_DAYS (with their responses) into "
+        "ArchivedMessage in small batches, then deletes archived rows older than "
+        "MESSAGE_RETENTION_DAYS. Meant to run periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--retention-days', type=int, default=settings.MESSAGE_RETENTION_DAYS,
+                            help="Delete archived rows older than this. 0 keeps the archive forever.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Seconds to pause between batches to limit load on the database.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+
+        # 1. Move old messages into the archive, one short transaction per batch
+        cutoff = now - timedelta(days=options['older_than_days'])
+        moved = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Message.objects.filter(timestamp__lt=cutoff)
+                    .select_related('response')
+                    .order_by('timestamp')[:batch_size]
+                )
+                if not batch:
+                    break
+                ArchivedMessage.objects.bulk_create([_archived_row(m) for m in batch], ignore_conflicts=True)
+                # Responses are removed by the cascade
+                Message.objects.filter(pk__in=[m.pk for m in batch]).delete()
+            moved += len(batch)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"Archived {moved} messages older than {cutoff:%Y-%m-%d}.")
+
+        # 2. Apply the retention policy to the archive itself
+        if options['retention_days'] <= 0:
+            return
+        retention_cutoff = now - timedelta(days=options['retention_days'])
+        purged = 0
+        while True:
+            ids = list(
+                ArchivedMessage.objects.filter(timestamp__lt=retention_cutoff)
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            ArchivedMessage.objects.filter(pk__in=ids).delete()
+            purged += len(ids)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"Purged {purged} archived messages older than {retention_cutoff:%Y-%m-%d}.")
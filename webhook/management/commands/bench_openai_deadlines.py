@@ -0,0 +1,130 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from webhook.deadlines import Deadline, call_with_deadline, OPENAI_HEDGE_MIN_SAMPLES
+
+
+def _fake_completions(base_latency: float, slow_fraction: float, slow_seconds: float,
+                      stall_fraction: float, seed: int):
+    """
+    Local stand-in for the chat completions endpoint. Most requests take about
+    `base_latency`; `slow_fraction` of them take `slow_seconds` and `stall_fraction`
+    never answer in time (they sleep for ten minutes).
+    """
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    counter = {'requests': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            with rng_lock:
+                counter['requests'] += 1
+                draw = rng.random()
+                latency = base_latency * rng.uniform(0.7, 1.3)
+            if draw < stall_fraction:
+                latency = 600
+            elif draw < stall_fraction + slow_fraction:
+                latency = slow_seconds
+            time.sleep(latency)
+            payload = json.dumps({
+                'id': 'bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': 'bench',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': 'ok'}}],
+            }).encode()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            except OSError:
+                # The client gave up (timeout or a winning hedge)
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counter
+
+
+def _percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures completion latency under a per-message deadline, with and without hedging, "
+        "against a local fake server that injects slow and stalled responses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--sla', type=float, default=5.0, help="Per-message deadline (s).")
+        parser.add_argument('--base-latency', type=float, default=0.2, help="Typical fake server latency (s).")
+        parser.add_argument('--slow-fraction', type=float, default=0.05)
+        parser.add_argument('--slow-seconds', type=float, default=3.0)
+        parser.add_argument('--stall-fraction', type=float, default=0.01)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        from openai import OpenAI
+
+        server, counter = _fake_completions(
+            options['base_latency'], options['slow_fraction'], options['slow_seconds'],
+            options['stall_fraction'], options['seed'],
+        )
+        client = OpenAI(api_key='bench', base_url=f'http://127.0.0.1:{server.server_port}/v1', max_retries=0)
+        self.stdout.write(
+            f"fake server: ~{options['base_latency']}s, {options['slow_fraction']:.0%} take "
+            f"{options['slow_seconds']}s, {options['stall_fraction']:.0%} stall; deadline {options['sla']}s, "
+            f"{options['requests']} requests, concurrency {options['concurrency']}"
+        )
+        self.stdout.write(
+            f"{'mode':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7} {'sent':>6}"
+        )
+        try:
+            for hedge in (False, True):
+                key = f"bench:{'hedged' if hedge else 'deadline'}"
+
+                def one_request(_):
+                    deadline = Deadline(options['sla'])
+                    started = time.perf_counter()
+                    try:
+                        call_with_deadline(
+                            key,
+                            lambda timeout: client.with_options(timeout=timeout).chat.completions.create(
+                                model='bench', messages=[{'role': 'user', 'content': 'hi'}],
+                            ),
+                            deadline,
+                            hedge=hedge,
+                        )
+                        ok = True
+                    except Exception:
+                        ok = False
+                    return time.perf_counter() - started, ok
+
+                # Latency history for the p95 that hedging waits for
+                for _ in range(OPENAI_HEDGE_MIN_SAMPLES):
+                    one_request(None)
+                sent_before = counter['requests']
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                    results = list(executor.map(one_request, range(options['requests'])))
+                latencies = [seconds * 1000 for seconds, _ in results]
+                errors = sum(1 for _, ok in results if not ok)
+                self.stdout.write(
+                    f"{'hedged' if hedge else 'deadline':>9} {_percentile(latencies, 0.5):>8.0f} "
+                    f"{_percentile(latencies, 0.95):>8.0f} {_percentile(latencies, 0.99):>8.0f} "
+                    f"{max(latencies):>8.0f} {errors:>7} {counter['requests'] - sent_before:>6}"
+                )
+        finally:
+            server.shutdown()
@@ -0,0 +1,109 @@
+import io
+import json
+import threading
+import time
+import wave
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from django.core.management.base import BaseCommand
+from webhook.transcription import (
+    transcribe_audio,
+    TRANSCRIBE_CHUNK_THRESHOLD,
+    TRANSCRIBE_SEGMENT_SECONDS,
+    TRANSCRIBE_CONCURRENCY,
+    WHISPER_FRAME_RATE,
+)
+
+
+def _speech_like(seconds: float, rng):
+    """Tone bursts of 1-4 s ("sentences") separated by 0.3-0.9 s pauses, 16 kHz mono."""
+    from pydub import AudioSegment
+    rate = WHISPER_FRAME_RATE
+    parts, total = [], 0
+    while total < seconds * rate:
+        burst = int(rng.uniform(1, 4) * rate)
+        t = np.arange(burst) / rate
+        parts.append((0.3 * np.sin(2 * np.pi * rng.uniform(120, 300) * t) * np.hanning(burst)).astype(np.float32))
+        parts.append(np.zeros(int(rng.uniform(0.3, 0.9) * rate), dtype=np.float32))
+        total += len(parts[-2]) + len(parts[-1])
+    samples = (np.concatenate(parts)[:int(seconds * rate)] * 32767).astype(np.int16)
+    return AudioSegment(samples.tobytes(), frame_rate=rate, sample_width=2, channels=1)
+
+
+def _fake_whisper(base_latency: float, seconds_per_audio_second: float):
+    """Local stand-in for the transcription endpoint: latency grows with the uploaded WAV's duration."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            message = BytesParser().parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body
+            )
+            audio = next(part.get_payload(decode=True) for part in message.get_payload()
+                         if part.get_param('name', header='content-disposition') == 'file')
+            with wave.open(io.BytesIO(audio)) as wav:
+                duration = wav.getnframes() / wav.getframerate()
+            time.sleep(base_latency + duration * seconds_per_audio_second)
+            payload = json.dumps({'text': f'{duration:.1f}s'}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares single-request and segmented (parallel) voice note transcription latency "
+        "across audio lengths, against a local fake transcription server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', default='15,45,90,180,300', help="Audio lengths in seconds.")
+        parser.add_argument('--base-latency', type=float, default=0.4, help="Fake server latency per request (s).")
+        parser.add_argument('--rtf', type=float, default=0.1, help="Fake server seconds per second of audio.")
+        parser.add_argument('--threshold', type=float, default=TRANSCRIBE_CHUNK_THRESHOLD)
+        parser.add_argument('--segment-seconds', type=float, default=TRANSCRIBE_SEGMENT_SECONDS)
+        parser.add_argument('--concurrency', type=int, default=TRANSCRIBE_CONCURRENCY)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        from openai import OpenAI
+
+        server = _fake_whisper(options['base_latency'], options['rtf'])
+        client = OpenAI(api_key='bench', base_url=f'http://127.0.0.1:{server.server_port}/v1', max_retries=0)
+        rng = np.random.default_rng(options['seed'])
+        self.stdout.write(
+            f"fake server: {options['base_latency']}s + {options['rtf']}s per audio second; threshold "
+            f"{options['threshold']}s, segments ~{options['segment_seconds']}s, concurrency {options['concurrency']}"
+        )
+        self.stdout.write(f"{'audio s':>8} {'single ms':>10} {'segmented ms':>13} {'segments':>9} {'speedup':>8}")
+        try:
+            for seconds in [float(value) for value in options['lengths'].split(',')]:
+                audio = _speech_like(seconds, rng)
+
+                started = time.perf_counter()
+                transcribe_audio(audio, client, export_format='wav', threshold=float('inf'))
+                single = time.perf_counter() - started
+
+                started = time.perf_counter()
+                text = transcribe_audio(
+                    audio, client, export_format='wav', threshold=options['threshold'],
+                    segment_seconds=options['segment_seconds'], concurrency=options['concurrency'],
+                )
+                segmented = time.perf_counter() - started
+
+                self.stdout.write(
+                    f"{seconds:>8.0f} {single * 1000:>10.0f} {segmented * 1000:>13.0f} "
+                    f"{len(text.split()):>9} {single / segmented:>7.2f}x"
+                )
+        finally:
+            server.shutdown()
@@ -0,0 +1,70 @@
+import base64
+import io
+import json
+import os
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from webhook.ingest import parse_webhook_stream
+
+
+def _build_payload(media_bytes: int) -> bytes:
+    """Builds an Evolution-style audio upsert body carrying `media_bytes` of base64 media."""
+    payload = {
+        "event": "messages.upsert",
+        "instance": "bench",
+        "apikey": "bench",
+        "server_url": "http://localhost",
+        "data": {
+            "key": {"remoteJid": "201000000000@s.whatsapp.net", "fromMe": False, "id": "BENCH"},
+            "pushName": "Bench",
+            "messageType": "audioMessage",
+            "message": {
+                "audioMessage": {"mimetype": "audio/ogg; codecs=opus"},
+                "base64": base64.b64encode(os.urandom(media_bytes)).decode('ascii'),
+            },
+        },
+    }
+    return json.dumps(payload).encode('utf-8')
+
+
+def _buffered(body: bytes):
+    # The previous path: decode the whole body, json.loads it, then b64decode the media field
+    request_body = json.loads(body.decode('utf-8'))
+    return len(base64.b64decode(request_body['data']['message']['base64']))
+
+
+def _streaming(body: bytes):
+    request_body, media_file = parse_webhook_stream(io.BytesIO(body))
+    try:
+        media_file.seek(0, io.SEEK_END)
+        return media_file.tell()
+    finally:
+        media_file.close()
+
+
+class Command(BaseCommand):
+    help = "Benchmarks peak memory and CPU time of buffered vs streaming webhook body parsing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,4,16', help="Comma separated media sizes in MB.")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        sizes = [float(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f"{'media MB':>9} {'path':>10} {'peak MB':>9} {'cpu ms':>9}")
+
+        for size in sizes:
+            body = _build_payload(int(size * 1024 * 1024))
+            for name, parse in (('buffered', _buffered), ('streaming', _streaming)):
+                peaks, cpu_times = [], []
+                for _ in range(options['repeat']):
+                    tracemalloc.start()
+                    started = time.process_time()
+                    parse(body)
+                    cpu_times.append(time.process_time() - started)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                self.stdout.write(
+                    f"{size:>9.1f} {name:>10} {max(peaks) / 2**20:>9.2f} {min(cpu_times) * 1000:>9.1f}"
+                )
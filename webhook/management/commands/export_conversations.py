@@ -0,0 +1,61 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from webhook.models import Client
+from webhook.export import export_stream, EXPORT_FORMATS, EXPORT_CHUNK_SIZE
+
+
+def _date(value):
+    day = parse_date(value)
+    if day is None:
+        raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+    return day
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams conversation logs (messages with their responses) as CSV or JSONL, "
+        "optionally gzipped, with constant memory whatever the history size. "
+        "Replaces dumpdata for QA exports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agent', type=int, help="Only messages received by this agent id.")
+        parser.add_argument('--client', help="Only messages from this client jid.")
+        parser.add_argument('--since', type=_date, help="First day to export (YYYY-MM-DD).")
+        parser.add_argument('--until', type=_date, help="Last day to export, inclusive (YYYY-MM-DD).")
+        parser.add_argument('--include-archive', action='store_true',
+                            help="Also export the history moved to the archive by archive_messages.")
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='jsonl')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help="Output file. Defaults to stdout.")
+
+    def handle(self, *args, **options):
+        filters = {
+            'agent_id': options['agent'],
+            'since': options['since'],
+            'until': options['until'],
+            'chunk_size': options['chunk_size'],
+            'include_archive': options['include_archive'],
+        }
+        if options['client']:
+            client_id = Client.objects.filter(jid=options['client']).values_list('pk', flat=True).first()
+            if client_id is None:
+                raise CommandError(f"Unknown client '{options['client']}'.")
+            filters['client_id'] = client_id
+
+        stream = export_stream(options['format'], options['gzip'], **filters)
+        written = 0
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for piece in stream:
+                output.write(piece)
+                written += len(piece)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+        if options['output']:
+            self.stderr.write(f"Wrote {written} bytes to {options['output']}.")
@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from webhook.models import OutboxMessage
+from webhook.outbox import relay_due
+
+
+class Command(BaseCommand):
+    help = (
+        "Delivers pending outbox replies to Evolution. Web workers relay on their own; "
+        "run this as a sidecar (or with --once from cron) so entries left by a stopped "
+        "worker are retried even when no new messages arrive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Deliver what is due, then exit.")
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_RELAY_INTERVAL)
+        parser.add_argument('--purge-sent-days', type=int, default=7,
+                            help="Delete delivered entries older than this. 0 keeps them.")
+
+    def _purge(self, days: int):
+        if days:
+            deleted, _ = OutboxMessage.objects.filter(
+                status='sent', sent_at__lt=timezone.now() - timedelta(days=days)
+            ).delete()
+            if deleted:
+                self.stdout.write(f"Purged {deleted} delivered entries.")
+
+    def handle(self, *args, **options):
+        self._purge(options['purge_sent_days'])
+        while True:
+            close_old_connections()
+            sent, failed = relay_due()
+            if sent or failed:
+                self.stdout.write(f"Delivered {sent}, failed {failed}.")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
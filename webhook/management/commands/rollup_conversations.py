@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from webhook.analytics import update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds new messages and responses into the daily dashboard statistics. "
+        "Incremental: each run only reads rows after the stored checkpoints. "
+        "Run it from cron, or as a sidecar with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running, updating every this many seconds. 0 runs once.")
+        parser.add_argument('--batch-size', type=int, default=settings.ROLLUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            messages, responses = update_rollups(options['batch_size'])
+            self.stdout.write(f"Rolled up {messages} messages and {responses} responses.")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
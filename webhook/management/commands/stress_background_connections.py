@@ -0,0 +1,71 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from webhook.background import BackgroundExecutor
+from webhook.models import Client
+
+
+class Command(BaseCommand):
+    help = (
+        "Bursts DB-touching jobs through the background executor (or one thread per job, the old "
+        "threading.Timer behaviour) and samples how many DB connections are open."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=500)
+        parser.add_argument('--work', type=float, default=0.02, help="Seconds each job holds its connection.")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--mode', choices=['executor', 'threads'], default='executor')
+
+    def handle(self, *args, **options):
+        opened = 0
+        wrappers = set()
+        lock = threading.Lock()
+
+        def track(sender, connection, **kwargs):
+            nonlocal opened
+            with lock:
+                opened += 1
+                wrappers.add(connection)
+
+        def job():
+            Client.objects.exists()
+            time.sleep(options['work'])
+
+        def open_connections():
+            with lock:
+                return sum(1 for conn in wrappers if conn.connection is not None)
+
+        connection_created.connect(track)
+        peak, samples = 0, []
+        started = time.monotonic()
+        try:
+            if options['mode'] == 'executor':
+                executor = BackgroundExecutor(max_workers=options['workers'])
+                futures = [executor.submit(job) for _ in range(options['jobs'])]
+                pending = lambda: sum(1 for f in futures if not f.done())
+            else:
+                threads = [threading.Thread(target=job) for _ in range(options['jobs'])]
+                for thread in threads:
+                    thread.start()
+                pending = lambda: sum(1 for t in threads if t.is_alive())
+
+            while pending():
+                current = open_connections()
+                peak = max(peak, current)
+                samples.append(current)
+                time.sleep(0.01)
+
+            if options['mode'] == 'executor':
+                executor.shutdown()
+        finally:
+            connection_created.disconnect(track)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"mode={options['mode']} jobs={options['jobs']} backend={connection.vendor}")
+        self.stdout.write(f"connections opened: {opened}")
+        self.stdout.write(f"peak open connections: {peak}")
+        self.stdout.write(f"still open at the end: {open_connections()}")
+        self.stdout.write(f"elapsed: {elapsed:.2f}s over {len(samples)} samples")
@@ -0,0 +1,21 @@
+import sys
+import time
+from django.core.management.base import BaseCommand
+from webhook.warmup import warm_up, HEAVY_MODULES
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the worker warm-up (heavy imports, tokenizer, OpenAI/Evolution connections, "
+        "indexes of recently active agents) and prints how long each step took."
+    )
+
+    def handle(self, *args, **options):
+        preloaded = [name for name in HEAVY_MODULES if name in sys.modules]
+        if preloaded:
+            self.stdout.write(f"Already imported at startup: {', '.join(preloaded)}")
+        started = time.perf_counter()
+        timings = warm_up()
+        for name, ms in timings.items():
+            self.stdout.write(f"{name:>10} {ms:>8.0f} ms")
+        self.stdout.write(f"{'total':>10} {(time.perf_counter() - started) * 1000:>8.0f} ms")
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook', '0003_delete_knowledgebasechunk_remove_response_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('message_type', models.CharField(choices=[('text', 'Text'), ('image', 'Image'), ('voice', 'Voice Note')], default='text', max_length=10)),
+                ('content', models.TextField(blank=True, null=True)),
+                ('image_url', models.URLField(blank=True, null=True)),
+                ('voice_note_url', models.URLField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('response_content', models.TextField(blank=True, null=True)),
+                ('response_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['client', '-timestamp'], name='message_client_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['timestamp'], name='message_ts_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='client',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webhook.client'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['client', '-timestamp'], name='archived_client_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['timestamp'], name='archived_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook', '0005_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedWebhook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.CharField(max_length=255)),
+                ('message_id', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('instance_id', 'message_id'), name='processed_webhook_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_openaisettings_context_packing'),
+        ('webhook', '0006_processedwebhook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActiveClient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyConversationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('text_messages', models.PositiveIntegerField(default=0)),
+                ('image_messages', models.PositiveIntegerField(default=0)),
+                ('voice_messages', models.PositiveIntegerField(default=0)),
+                ('active_clients', models.PositiveIntegerField(default=0)),
+                ('responses', models.PositiveIntegerField(default=0)),
+                ('response_seconds', models.FloatField(default=0.0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='core.openaisettings'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['timestamp', 'message'], name='response_ts_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailyactiveclient',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.openaisettings'),
+        ),
+        migrations.AddField(
+            model_name='dailyactiveclient',
+            name='client',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webhook.client'),
+        ),
+        migrations.AddField(
+            model_name='dailyconversationstats',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.openaisettings'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyactiveclient',
+            constraint=models.UniqueConstraint(fields=('date', 'agent', 'client'), name='daily_active_client_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyconversationstats',
+            constraint=models.UniqueConstraint(fields=('date', 'agent'), name='daily_stats_date_agent_unique'),
+        ),
+    ]
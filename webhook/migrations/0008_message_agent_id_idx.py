@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_openaisettings_context_packing'),
+        ('webhook', '0007_message_agent_conversation_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['agent', 'id'], name='message_agent_id_idx'),
+        ),
+    ]
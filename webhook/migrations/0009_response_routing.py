@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook', '0008_message_agent_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='generation_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='model',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='route',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
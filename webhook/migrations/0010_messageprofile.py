@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_openaisettings_direct_answers'),
+        ('webhook', '0009_response_routing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('webhook', 'Webhook request'), ('process', 'Background processing')], max_length=10)),
+                ('mode', models.CharField(choices=[('stacks', 'Sampled stacks'), ('tracemalloc', 'tracemalloc snapshot')], max_length=12)),
+                ('label', models.CharField(blank=True, max_length=255)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('data', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.openaisettings')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_openaisettings_direct_answers'),
+        ('webhook', '0011_quarantinedrow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.openaisettings'),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='response_generation_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='response_model',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='response_route',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
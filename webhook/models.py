@@ -1,5 +1,8 @@
 # web-hook/models.py
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+from core.models import OpenAISettings
 
 # قائمة بجميع الدول الأعضاء في جامعة الدول العربية، مع إضافة خيار "أخرى"
 COUNTRY_CHOICES = (
@@ -52,6 +55,14 @@ class Client(models.Model):
 class Message(models.Model):
     # ربط الرسالة بالعميل الذي أرسلها
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    # الوكيل الذي استقبل الرسالة (فارغ للرسائل القديمة)
+    agent = models.ForeignKey(
+        OpenAISettings,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='messages',
+    )
     
     # أنواع الرسائل
     MESSAGE_TYPES = (
@@ -70,8 +81,18 @@ class Message(models.Model):
     # حقل لتخزين رابط الرسالة الصوتية (اختياري)
     voice_note_url = models.URLField(max_length=200, blank=True, null=True)
     
-    # وقت إرسال الرسالة
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # وقت إرسال الرسالة (يُحدَّد عند الاستلام لا عند الحفظ، لأن الكتابة تتم على دفعات)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # سجل المحادثة: آخر رسائل العميل
+            models.Index(fields=['client', '-timestamp'], name='message_client_ts_idx'),
+            # نقل الرسائل القديمة إلى الأرشيف
+            models.Index(fields=['timestamp'], name='message_ts_idx'),
+            # تصدير محادثات وكيل على دفعات حسب المعرف
+            models.Index(fields=['agent', 'id'], name='message_agent_id_idx'),
+        ]
 
     def __str__(self):
         if self.message_type == 'text':
@@ -89,10 +110,185 @@ class Response(models.Model):
     )
     # محتوى الرد النصي
     content = models.TextField()
-    # وقت إرسال الرد
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # وقت إرسال الرد (يُحدَّد عند الإرسال لا عند الحفظ، لأن الكتابة تتم على دفعات)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # قرار توجيه النموذج: النموذج المستخدم وسبب اختياره وزمن التوليد
+    model = models.CharField(max_length=50, blank=True)
+    route = models.CharField(max_length=50, blank=True)
+    generation_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # مسح الردود الجديدة بالترتيب الزمني عند تحديث الإحصائيات اليومية
+            models.Index(fields=['timestamp', 'message'], name='response_ts_idx'),
+        ]
 
     def __str__(self):
         # الاعتماد على __str__ لنموذج Message لتجنب الأخطاء
         return f"Response to {self.message}" if self.message else "Response to a deleted message"
 
+# أرشيف الرسائل القديمة مع ردودها، يتم نقلها إليه بواسطة أمر archive_messages
+class ArchivedMessage(models.Model):
+    # المعرف الأصلي للرسالة في جدول Message
+    original_id = models.BigIntegerField(unique=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    agent = models.ForeignKey(OpenAISettings, on_delete=models.SET_NULL, null=True, blank=True)
+    message_type = models.CharField(max_length=10, choices=Message.MESSAGE_TYPES, default='text')
+    content = models.TextField(blank=True, null=True)
+    image_url = models.URLField(max_length=200, blank=True, null=True)
+    voice_note_url = models.URLField(max_length=200, blank=True, null=True)
+    timestamp = models.DateTimeField()
+    # الرد المرتبط بالرسالة (إن وجد)
+    response_content = models.TextField(blank=True, null=True)
+    response_timestamp = models.DateTimeField(blank=True, null=True)
+    # قرار توجيه النموذج كما حفظ في الرد
+    response_model = models.CharField(max_length=50, blank=True)
+    response_route = models.CharField(max_length=50, blank=True)
+    response_generation_ms = models.PositiveIntegerField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', '-timestamp'], name='archived_client_ts_idx'),
+            models.Index(fields=['timestamp'], name='archived_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.original_id} from {self.client}"
+
+
+# صندوق الصادر: الردود المنتظرة للإرسال إلى Evolution، يكتب مع الرد في نفس المعاملة ويرسله outbox_relay
+class OutboxMessage(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    response = models.OneToOneField(
+        Response,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='outbox',
+    )
+    jid = models.CharField(max_length=255)
+    text = models.TextField()
+    # بيانات الاتصال بـ Evolution كما وصلت في الـ webhook (يمسح المفتاح بعد الإرسال)
+    instance_id = models.CharField(max_length=255)
+    server_url = models.CharField(max_length=500)
+    api_key = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # لا يحاول الـ relay الإرسال قبل هذا الوقت (إعادة المحاولة أو حجز مؤقت)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Outbox {self.pk} to {self.jid} ({self.status})"
+
+
+# صفوف لم يتمكن الكاتب الخلفي من حفظها حتى بعد المحاولة صفًا صفًا، تحفظ كما هي للمراجعة بدل حذفها
+class QuarantinedRow(models.Model):
+    model = models.CharField(max_length=100)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.model} ({self.created_at:%Y-%m-%d %H:%M})"
+
+
+# مفاتيح رسائل الـ webhook التي تم استلامها، لرفض إعادة الإرسال من Evolution عبر كل العمال (مع مدة صلاحية)
+class ProcessedWebhook(models.Model):
+    instance_id = models.CharField(max_length=255)
+    message_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['instance_id', 'message_id'], name='processed_webhook_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.instance_id}:{self.message_id}"
+
+
+# إحصائيات يومية مجمعة لكل وكيل، يحدثها أمر rollup_conversations تدريجيًا وتقرأ منها لوحة التحكم فقط
+class DailyConversationStats(models.Model):
+    date = models.DateField()
+    agent = models.ForeignKey(OpenAISettings, on_delete=models.CASCADE, null=True, blank=True)
+    messages = models.PositiveIntegerField(default=0)
+    text_messages = models.PositiveIntegerField(default=0)
+    image_messages = models.PositiveIntegerField(default=0)
+    voice_messages = models.PositiveIntegerField(default=0)
+    # عدد العملاء المختلفين الذين راسلوا الوكيل في هذا اليوم
+    active_clients = models.PositiveIntegerField(default=0)
+    responses = models.PositiveIntegerField(default=0)
+    # مجموع زمن الرد بالثواني (المتوسط = المجموع / عدد الردود)
+    response_seconds = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'agent'], name='daily_stats_date_agent_unique'),
+        ]
+
+    @property
+    def avg_response_seconds(self):
+        return self.response_seconds / self.responses if self.responses else None
+
+    def __str__(self):
+        return f"{self.date} {self.agent}: {self.messages} messages"
+
+
+# العملاء النشطون في كل يوم لكل وكيل، لحساب active_clients بدون تكرار
+class DailyActiveClient(models.Model):
+    date = models.DateField()
+    agent = models.ForeignKey(OpenAISettings, on_delete=models.CASCADE, null=True, blank=True)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'agent', 'client'], name='daily_active_client_unique'),
+        ]
+
+
+# آخر نقطة وصل إليها التجميع لكل مصدر (الرسائل / الردود)
+class RollupCheckpoint(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
+# ملفات التحليل (profiling) لكل رسالة: مكدسات مطوية متوافقة مع flamegraph أو لقطة tracemalloc، للتنزيل من لوحة الإدارة
+class MessageProfile(models.Model):
+    KIND_CHOICES = [
+        ('webhook', 'Webhook request'),
+        ('process', 'Background processing'),
+    ]
+    MODE_CHOICES = [
+        ('stacks', 'Sampled stacks'),
+        ('tracemalloc', 'tracemalloc snapshot'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    mode = models.CharField(max_length=12, choices=MODE_CHOICES)
+    label = models.CharField(max_length=255, blank=True)
+    agent = models.ForeignKey(OpenAISettings, on_delete=models.SET_NULL, null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+    # عدد العينات المأخوذة من المكدس (وضع stacks فقط)
+    samples = models.PositiveIntegerField(default=0)
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.mode} {self.label} ({self.duration_ms}ms)"
@@ -0,0 +1,189 @@
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Seconds between scans for due entries when nothing wakes the relay
+OUTBOX_RELAY_INTERVAL = getattr(settings, 'OUTBOX_RELAY_INTERVAL', 5)
+OUTBOX_BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 20)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+# A claimed entry is hidden from other relays this long; if the claiming process dies it is retried after it.
+# The lease restarts right before each send, so it only has to outlast one request (timeout (5, 15)).
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_BACKOFF = 600
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Shared requests session, so replies reuse keep-alive connections to Evolution
+    instead of a new TCP/TLS handshake per message. requests is imported on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                _session = requests.Session()
+    return _session
+
+
+def send_message_to_client(jid: str, text: str, instance_id: str, evolution_key: str, server_url: str):
+    """Sends the final text reply to the Evolution API."""
+    import requests
+
+    try:
+        url = f"{server_url}/message/sendText/{instance_id}"
+        headers = {
+            "apikey": evolution_key,
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "number": jid.split('@')[0],
+            "text": text,
+            "delay": 7000,
+            "linkPreview": True,
+        }
+
+        # Added timeout for safety
+        response = get_session().post(url, json=payload, headers=headers, timeout=(5, 15))
+        response.raise_for_status()
+
+        logger.info(f"✅ API SUCCESS: Message sent to {jid}. Status: {response.status_code}.")
+        return response.json()
+
+    except requests.exceptions.RequestException as e:
+        # Added detailed error logging for API failure
+        error_details = f"URL: {url}, Error: {e}"
+        if hasattr(e, 'response') and e.response is not None:
+             error_details += f", API Response: {e.response.text}"
+
+        logger.error(f"❌ API FAILURE: Error sending message to {jid}: {error_details}", exc_info=True)
+        return None
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_MAX_BACKOFF, 5 * 2 ** (attempts - 1)))
+
+
+def _claim(limit: int):
+    """
+    Leases up to `limit` due entries in a short transaction; other relays skip locked rows.
+    Each entry's next_attempt_at is left at its lease expiry, which `_renew_lease` checks.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+    with transaction.atomic():
+        entries = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:limit]
+        )
+        if entries:
+            OutboxMessage.objects.filter(pk__in=[entry.pk for entry in entries]).update(next_attempt_at=lease_until)
+    for entry in entries:
+        entry.next_attempt_at = lease_until
+    return entries
+
+
+def _renew_lease(entry: OutboxMessage) -> bool:
+    """
+    Restarts the lease of a claimed entry right before it is sent, so entries later in the
+    batch aren't sent after their lease ran out. Returns False when the lease already
+    expired and another relay claimed the entry (or it is no longer pending).
+    """
+    lease_until = timezone.now() + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+    renewed = OutboxMessage.objects.filter(
+        pk=entry.pk, status='pending', next_attempt_at=entry.next_attempt_at
+    ).update(next_attempt_at=lease_until)
+    entry.next_attempt_at = lease_until
+    return renewed == 1
+
+
+def _deliver(entry: OutboxMessage) -> bool:
+    try:
+        delivered = send_message_to_client(entry.jid, entry.text, entry.instance_id, entry.api_key, entry.server_url) is not None
+        error = '' if delivered else 'Evolution API request failed'
+    except Exception as e:
+        delivered, error = False, str(e)
+
+    attempts = entry.attempts + 1
+    # Only a pending entry moves on, so a reply another relay already finished is never rewritten
+    pending = OutboxMessage.objects.filter(pk=entry.pk, status='pending')
+    if delivered:
+        if not pending.update(status='sent', attempts=attempts, sent_at=timezone.now(), api_key='', last_error=''):
+            logger.warning(f"⚠️ OUTBOX: Reply {entry.pk} to {entry.jid} was already handled by another relay.")
+        return True
+
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        logger.critical(f"❌ OUTBOX FAIL: Giving up on reply {entry.pk} to {entry.jid} after {attempts} attempts.")
+        pending.update(status='failed', attempts=attempts, api_key='', last_error=error)
+    else:
+        retry_at = timezone.now() + _backoff(attempts)
+        logger.warning(f"⚠️ OUTBOX RETRY: Reply {entry.pk} to {entry.jid} failed (attempt {attempts}), retrying at {retry_at:%H:%M:%S}.")
+        pending.update(attempts=attempts, next_attempt_at=retry_at, last_error=error)
+    return False
+
+
+def relay_due(limit: int = OUTBOX_BATCH_SIZE):
+    """Delivers due outbox entries until none are left. Returns (sent, failed) counts."""
+    sent = failed = 0
+    while True:
+        entries = _claim(limit)
+        if not entries:
+            return sent, failed
+        for entry in entries:
+            if not _renew_lease(entry):
+                logger.info(f"🔁 OUTBOX: Lease on reply {entry.pk} expired before it was sent; leaving it to its new owner.")
+                continue
+            if _deliver(entry):
+                sent += 1
+            else:
+                failed += 1
+
+
+class OutboxRelay:
+    """
+    Background thread that delivers outbox entries to Evolution.
+
+    The conversation writer wakes it right after committing new entries, and it
+    rescans every OUTBOX_RELAY_INTERVAL seconds for retries. Several workers can run
+    a relay at once: entries are leased with SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+
+    def __init__(self, interval: float = OUTBOX_RELAY_INTERVAL):
+        self.interval = interval
+        self.wake_event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _ensure_thread(self):
+        # Started lazily so gunicorn workers don't inherit a dead thread from the master
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='outbox-relay', daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        self._ensure_thread()
+        self.wake_event.set()
+
+    def _run(self):
+        while True:
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+            close_old_connections()
+            try:
+                relay_due()
+            except Exception as e:
+                logger.error(f"🔴 OUTBOX RELAY FAIL: {e}", exc_info=True)
+
+
+outbox_relay = OutboxRelay()
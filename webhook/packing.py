@@ -0,0 +1,81 @@
+import logging
+import re
+from django.conf import settings
+from knowledge.tokens import estimate_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Candidates retrieved per message before packing
+CONTEXT_CANDIDATES = getattr(settings, 'CONTEXT_CANDIDATES', 8)
+# Candidates after a drop of more than this (in cosine similarity) from the previous one are cut
+CONTEXT_MAX_SCORE_GAP = getattr(settings, 'CONTEXT_MAX_SCORE_GAP', 0.15)
+# Word-shingle Jaccard similarity at which a chunk counts as a near-duplicate of a kept one
+CONTEXT_DUPLICATE_THRESHOLD = getattr(settings, 'CONTEXT_DUPLICATE_THRESHOLD', 0.8)
+
+_WORD_RE = re.compile(r'\w+')
+SHINGLE_SIZE = 3
+
+
+def _shingles(text: str) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def pack_context(candidates, similarity_floor: float, token_budget: int,
+                 max_gap: float = CONTEXT_MAX_SCORE_GAP,
+                 duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD):
+    """
+    Selects the knowledge texts to put in the prompt from `candidates`, a list of
+    (similarity, KnowledgeBase item) ordered best first as returned by find_most_similar_question.
+
+    1. Drops candidates below `similarity_floor`, and everything after a score drop larger than `max_gap`.
+    2. Skips chunks whose word shingles overlap a kept chunk by `duplicate_threshold` or more.
+    3. Adds the rest in relevance order while they fit in `token_budget` tokens. If even the
+       best chunk is too long it is truncated to the budget, so the prompt is never left without it.
+    """
+    dropped = {'floor': 0, 'gap': 0, 'duplicate': 0, 'budget': 0}
+    relevant = []
+    previous = None
+    for position, (similarity, item) in enumerate(candidates):
+        if similarity < similarity_floor:
+            # Candidates are sorted, nothing after this one passes either
+            dropped['floor'] += len(candidates) - position
+            break
+        if previous is not None and previous - similarity > max_gap:
+            dropped['gap'] += len(candidates) - position
+            break
+        relevant.append(item.question)
+        previous = similarity
+
+    packed, kept_shingles = [], []
+    used = 0
+    for text in relevant:
+        shingles = _shingles(text)
+        if any(_jaccard(shingles, kept) >= duplicate_threshold for kept in kept_shingles):
+            dropped['duplicate'] += 1
+            continue
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            if packed:
+                dropped['budget'] += 1
+                continue
+            text = truncate_tokens(text, token_budget)
+            tokens = token_budget
+        packed.append(text)
+        kept_shingles.append(shingles)
+        used += tokens
+
+    logger.info(
+        f"📦 CONTEXT PACK: Kept {len(packed)}/{len(candidates)} chunks, {used}/{token_budget} tokens "
+        f"(dropped: {dropped['floor']} below floor, {dropped['gap']} after gap, "
+        f"{dropped['duplicate']} duplicates, {dropped['budget']} over budget)."
+    )
+    return packed
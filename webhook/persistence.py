@@ -0,0 +1,305 @@
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from .models import Client, Message, Response, OutboxMessage, QuarantinedRow
+from .outbox import outbox_relay
+
+logger = logging.getLogger(__name__)
+
+# Write-behind settings: pending rows are flushed every FLUSH_INTERVAL seconds,
+# or as soon as BATCH_SIZE rows are waiting. A batch that fails MAX_FLUSH_ATTEMPTS times
+# in a row is written row by row, and only the rows that still fail are quarantined.
+FLUSH_INTERVAL = getattr(settings, 'PERSISTENCE_FLUSH_INTERVAL', 0.5)
+BATCH_SIZE = getattr(settings, 'PERSISTENCE_BATCH_SIZE', 100)
+MAX_FLUSH_ATTEMPTS = 3
+CLIENT_CACHE_SIZE = getattr(settings, 'CLIENT_CACHE_SIZE', 10000)
+
+# jid -> (client_id, name), least recently used first
+_client_cache = OrderedDict()
+_client_cache_lock = threading.Lock()
+
+
+def _cache_client(jid: str, client_id: int, name: str):
+    with _client_cache_lock:
+        _client_cache[jid] = (client_id, name)
+        _client_cache.move_to_end(jid)
+        while len(_client_cache) > CLIENT_CACHE_SIZE:
+            _client_cache.popitem(last=False)
+
+
+def forget_client(jid: str):
+    """Drops a client from the jid cache (e.g. after it was deleted)."""
+    with _client_cache_lock:
+        _client_cache.pop(jid, None)
+
+
+def upsert_client(jid: str, name: str) -> int:
+    """
+    Creates the client or updates its name in a single INSERT ... ON CONFLICT statement.
+    Skips the database entirely when the cached name is unchanged.
+    """
+    cached = _client_cache.get(jid)
+    if cached and cached[1] == name:
+        return cached[0]
+
+    client = Client(jid=jid, name=name)
+    Client.objects.bulk_create(
+        [client],
+        update_conflicts=True,
+        unique_fields=['jid'],
+        update_fields=['name'],
+    )
+    if client.pk is None:
+        # Backends that don't return ids from upserts
+        client.pk = Client.objects.values_list('id', flat=True).get(jid=jid)
+
+    _cache_client(jid, client.pk, name)
+    return client.pk
+
+
+def get_client_id(jid: str) -> int:
+    """Returns the client id for a jid, from the cache when possible."""
+    cached = _client_cache.get(jid)
+    if cached:
+        return cached[0]
+    client, _ = Client.objects.get_or_create(jid=jid)
+    _cache_client(jid, client.pk, client.name)
+    return client.pk
+
+
+class ConversationWriter:
+    """
+    Buffers Message, Response and OutboxMessage rows and writes them with bulk_create.
+
+    Rows stay in the pending lists until their batch is committed, so
+    `get_recent_history` can merge them with what is already in the database.
+    A reply's Response and OutboxMessage are always committed in the same transaction.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, batch_size: int = BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.messages = []
+        self.responses = []
+        self.outbox = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.failures = 0
+
+    def _ensure_thread(self):
+        # Started lazily so gunicorn workers don't inherit a dead thread from the master
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='conversation-writer', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            # Same connection handling as the background executor: reuse, but drop stale ones
+            close_old_connections()
+            self.flush()
+
+    def _enqueue(self, queue: list, obj):
+        with self.lock:
+            queue.append(obj)
+            size = len(self.messages) + len(self.responses) + len(self.outbox)
+            self._ensure_thread()
+        if size >= self.batch_size:
+            self.wake.set()
+
+    def add_message(self, client_id: int, message_type: str, content: str, image_url: str = None, agent_id: int = None) -> Message:
+        """Queues a Message row and returns the (not yet saved) instance."""
+        message = Message(
+            client_id=client_id,
+            agent_id=agent_id,
+            message_type=message_type,
+            content=content,
+            image_url=image_url,
+        )
+        self._enqueue(self.messages, message)
+        return message
+
+    def add_response(self, message: Message, content: str) -> Response:
+        """Queues a Response row for a queued or saved message."""
+        response = Response(message=message, content=content)
+        self._enqueue(self.responses, response)
+        return response
+
+    def add_reply(self, message: Message, content: str, jid: str, instance_id: str, server_url: str, api_key: str,
+                  model: str = '', route: str = '', generation_ms: int = None) -> Response:
+        """
+        Queues a Response and the OutboxMessage that delivers it, and flushes right away
+        so the outbox relay can send it without waiting for the flush interval.
+        `model`, `route` and `generation_ms` record the routing decision (webhook.routing).
+        """
+        response = Response(
+            message=message,
+            content=content,
+            model=model,
+            route=route,
+            generation_ms=generation_ms,
+        )
+        outbox = OutboxMessage(
+            response=response,
+            jid=jid,
+            text=content,
+            instance_id=instance_id,
+            server_url=server_url,
+            api_key=api_key or '',
+        )
+        with self.lock:
+            self.responses.append(response)
+            self.outbox.append(outbox)
+            self._ensure_thread()
+        self.wake.set()
+        return response
+
+    def pending_for_client(self, client_id: int):
+        """Returns the queued messages of a client and its queued responses keyed by id(message)."""
+        with self.lock:
+            messages = [m for m in self.messages if m.client_id == client_id]
+            responses = {id(r.message): r for r in self.responses if r.message.client_id == client_id}
+        return messages, responses
+
+    def flush(self):
+        """Writes all pending rows in one transaction. Safe to call from any thread."""
+        with self.flush_lock:
+            with self.lock:
+                messages = list(self.messages)
+                responses = list(self.responses)
+                outbox = list(self.outbox)
+            if not messages and not responses and not outbox:
+                return
+
+            kept = ([], [], [])
+            try:
+                with transaction.atomic():
+                    if messages:
+                        Message.objects.bulk_create(messages)
+                    if responses:
+                        Response.objects.bulk_create(responses)
+                    if outbox:
+                        OutboxMessage.objects.bulk_create(outbox)
+            except Exception as e:
+                self.failures += 1
+                if self.failures < MAX_FLUSH_ATTEMPTS:
+                    logger.error(f"❌ PERSIST FAIL: Flush of {len(messages)} messages / {len(responses)} responses failed (attempt {self.failures}): {e}", exc_info=True)
+                    return
+                logger.error(f"❌ PERSIST FAIL: Batch failed {self.failures} times ({e}); writing its rows one by one.")
+                kept = self._write_rows(messages, responses, outbox)
+            else:
+                logger.info(f"💾 PERSIST: Flushed {len(messages)} messages, {len(responses)} responses and {len(outbox)} outbox entries.")
+
+            self.failures = 0
+            with self.lock:
+                # Rows that could be neither saved nor quarantined go back to the front of the queue
+                self.messages[:len(messages)] = kept[0]
+                self.responses[:len(responses)] = kept[1]
+                self.outbox[:len(outbox)] = kept[2]
+            if outbox:
+                outbox_relay.wake()
+
+    def _write_rows(self, messages, responses, outbox):
+        """
+        Writes each message, and each response with its outbox entry, in its own transaction,
+        so one bad row (e.g. an image_url over the column limit) doesn't take the batch down.
+        A reply whose response can't be saved is still delivered: its outbox entry is saved
+        without the response. Rows that still fail are quarantined; those that can't even be
+        quarantined (database down) are returned as (messages, responses, outbox) to keep.
+        """
+        kept = ([], [], [])
+        for message in messages:
+            error = _create_rows(message)
+            if error is not None and not _quarantine(message, error):
+                kept[0].append(message)
+
+        replies = {id(entry.response): entry for entry in outbox}
+        for response in responses:
+            entry = replies.pop(id(response), None)
+            rows = (response, entry) if entry is not None else (response,)
+            error = _create_rows(*rows)
+            if error is None:
+                continue
+            if not _quarantine(response, error):
+                kept[1].append(response)
+            if entry is not None:
+                logger.warning(f"⚠️ PERSIST: Response to message {response.message_id} failed ({error}); queuing its reply to {entry.jid} without it.")
+                entry.response = None
+                replies[id(entry)] = entry
+
+        for entry in replies.values():
+            error = _create_rows(entry)
+            if error is None:
+                continue
+            logger.critical(f"❌ PERSIST: Reply to {entry.jid} could not be queued for delivery: {error}")
+            if not _quarantine(entry, error):
+                kept[2].append(entry)
+        return kept
+
+
+def _create_rows(*rows):
+    """Inserts `rows` in one transaction. Returns the error, or None once they are saved."""
+    try:
+        with transaction.atomic():
+            for row in rows:
+                type(row).objects.bulk_create([row])
+    except Exception as e:
+        return e
+    return None
+
+
+def _quarantine(row, error) -> bool:
+    """Saves the field values of a row that can't be written as a QuarantinedRow."""
+    data = {field.attname: getattr(row, field.attname) for field in row._meta.concrete_fields}
+    try:
+        QuarantinedRow.objects.create(model=row._meta.label, data=data, error=str(error))
+    except Exception as e:
+        logger.critical(f"❌ PERSIST QUARANTINE FAIL: Keeping {row._meta.label} row {data} in the buffer: {e}")
+        return False
+    logger.error(f"☣️ PERSIST QUARANTINE: {row._meta.label} row quarantined: {error}")
+    return True
+
+
+conversation_writer = ConversationWriter()
+# Best effort: write whatever is still buffered when the worker shuts down
+atexit.register(conversation_writer.flush)
+
+
+def get_recent_history(client_id: int, limit: int = 10):
+    """
+    Returns the client's last `limit` messages, oldest first, as (message, response content or None).
+    Rows still waiting in the write-behind buffer are included.
+    """
+    # Read the buffer before the database: a row flushed in between then shows up in
+    # both places (deduplicated by pk) instead of in neither.
+    pending_messages, pending_responses = conversation_writer.pending_for_client(client_id)
+    saved = Message.objects.filter(client_id=client_id).select_related('response').order_by('-timestamp')[:limit]
+
+    seen = set()
+    merged = []
+    for msg in pending_messages + list(saved):
+        if msg.pk is not None:
+            if msg.pk in seen:
+                continue
+            seen.add(msg.pk)
+        merged.append(msg)
+    merged.sort(key=lambda m: m.timestamp)
+    merged = merged[-limit:]
+
+    pending_by_pk = {r.message.pk: r for r in pending_responses.values() if r.message.pk is not None}
+    history = []
+    for msg in merged:
+        response = pending_responses.get(id(msg)) or pending_by_pk.get(msg.pk)
+        if response is None and msg.pk is not None:
+            try:
+                response = msg.response
+            except Response.DoesNotExist:
+                response = None
+        history.append((msg, response.content if response else None))
+    return history
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Threads for the network-bound stages of all messages being processed at once
+PIPELINE_MAX_WORKERS = getattr(settings, 'PIPELINE_MAX_WORKERS', 16)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        # Created lazily so gunicorn workers don't inherit pool threads from the master
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix='pipeline')
+        return _executor
+
+
+class Pipeline:
+    """
+    Runs the stages of one message as a dependency graph.
+
+    A stage is a function called with the results of its dependencies as keyword
+    arguments. Stages added with `inline=True` run on the calling thread: Django DB
+    connections are per thread, so everything that touches the database stays on the
+    caller's connection (and inside its transaction). The other stages (network calls
+    that don't touch the database) start on a shared pool as soon as their dependencies
+    are done, and overlap the inline work.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+
+    def add(self, name: str, fn, deps=(), inline: bool = False):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'.")
+        self.stages[name] = (fn, tuple(deps), inline)
+        return self
+
+    def _call(self, name: str, started_at: float):
+        fn, deps, _ = self.stages[name]
+        start = time.perf_counter()
+        try:
+            return fn(**{dep: self.results[dep] for dep in deps})
+        finally:
+            self.timings[name] = (start - started_at, time.perf_counter() - started_at)
+
+    def run(self) -> dict:
+        """Runs every stage and returns their results by name. The first failing stage's error is raised."""
+        started_at = time.perf_counter()
+        pending = list(self.stages)
+        running = {}
+        try:
+            while pending or running:
+                ready = [name for name in pending if all(dep in self.results for dep in self.stages[name][1])]
+                for name in ready:
+                    if not self.stages[name][2]:
+                        pending.remove(name)
+                        running[_get_executor().submit(self._call, name, started_at)] = name
+
+                inline_ready = [name for name in ready if self.stages[name][2]]
+                if inline_ready:
+                    name = inline_ready[0]
+                    pending.remove(name)
+                    self.results[name] = self._call(name, started_at)
+                    continue
+
+                if not running:
+                    raise RuntimeError(f"Pipeline '{self.label}' has unsatisfiable stages: {pending}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.results[running.pop(future)] = future.result()
+        finally:
+            for future in running:
+                future.cancel()
+            self._log(time.perf_counter() - started_at)
+        return self.results
+
+    def _log(self, total: float):
+        sequential = sum(end - start for start, end in self.timings.values())
+        stages = ' | '.join(
+            f"{name} {start * 1000:.0f}-{end * 1000:.0f}ms"
+            for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0])
+        )
+        logger.info(f"⏱️ PIPELINE {self.label}: {total * 1000:.0f}ms wall, {sequential * 1000:.0f}ms of stage time | {stages}")
@@ -0,0 +1,220 @@
+import functools
+import logging
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Fraction of messages profiled (sampled stacks) without the admin toggle; 0 disables sampling
+PROFILE_SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+# Stack sampling period of the profiler thread
+PROFILE_INTERVAL_MS = getattr(settings, 'PROFILE_INTERVAL_MS', 5)
+# Seconds the admin toggle stays on unless it is switched off earlier
+PROFILE_TOGGLE_TTL = getattr(settings, 'PROFILE_TOGGLE_TTL', 3600)
+# Stored profiles kept; older ones are deleted as new ones are saved
+PROFILE_MAX_STORED = getattr(settings, 'PROFILE_MAX_STORED', 200)
+# Frames kept per allocation traceback, and allocation sites listed per tracemalloc report
+TRACEMALLOC_FRAMES = getattr(settings, 'PROFILE_TRACEMALLOC_FRAMES', 10)
+TRACEMALLOC_TOP = 30
+# The profiler's own bookkeeping is left out of the reports
+_TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+)
+
+PROFILE_MODES = ('stacks', 'tracemalloc')
+# Shared through the cache, so the toggle reaches every worker (with Redis) at once
+_TOGGLE_CACHE_KEY = 'profiling:mode'
+
+# tracemalloc is process-wide: started by the first traced message, stopped once the mode is off.
+# The baseline is the snapshot of the previous traced message, so reports show growth between messages.
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_started = False
+_tracemalloc_baseline = None
+
+
+def set_profiling_mode(mode: str = None, ttl: int = PROFILE_TOGGLE_TTL):
+    """Turns profiling of every message on ('stacks' or 'tracemalloc') for `ttl` seconds, or off (None)."""
+    if mode is None:
+        cache.delete(_TOGGLE_CACHE_KEY)
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode {mode!r}.")
+    cache.set(_TOGGLE_CACHE_KEY, mode, ttl)
+
+
+def get_profiling_mode() -> str:
+    """The mode set with the admin toggle, or None."""
+    return cache.get(_TOGGLE_CACHE_KEY)
+
+
+def _mode_for_message() -> str:
+    mode = get_profiling_mode()
+    if mode is None and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        mode = 'stacks'
+    return mode
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    # Package and file name are enough to tell modules apart (e.g. webhook/views.py)
+    path = '/'.join(code.co_filename.replace('\\', '/').rsplit('/', 2)[-2:])
+    return f"{code.co_name} ({path}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """
+    Samples one thread's stack every `interval_ms` from a helper thread (wall time:
+    waiting on I/O or locks shows up too). Stacks are counted in the folded format
+    ("outer;inner count") read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def folded(self) -> str:
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_started, _tracemalloc_baseline
+    with _tracemalloc_lock:
+        if _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+            _tracemalloc_baseline = None
+            logger.info("🔬 PROFILE: tracemalloc stopped.")
+
+
+def _start_tracemalloc():
+    global _tracemalloc_started
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracemalloc_started = True
+            logger.info("🔬 PROFILE: tracemalloc started.")
+        return tracemalloc.take_snapshot().filter_traces(_TRACEMALLOC_FILTERS)
+
+
+def _tracemalloc_report(before, gauges) -> str:
+    """Allocation growth during the message and since the previous traced message, plus the gauges."""
+    global _tracemalloc_baseline
+    after = tracemalloc.take_snapshot().filter_traces(_TRACEMALLOC_FILTERS)
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"traced: {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB"]
+    lines += [f"{name}: {value}" for name, value in gauges.items()]
+    with _tracemalloc_lock:
+        baseline, _tracemalloc_baseline = _tracemalloc_baseline, after
+    sections = [('during this message', before)]
+    if baseline is not None:
+        sections.append(('since the previous traced message', baseline))
+    for title, reference in sections:
+        lines += ['', f"top allocation growth {title}:"]
+        for stat in after.compare_to(reference, 'lineno')[:TRACEMALLOC_TOP]:
+            lines.append(str(stat))
+    lines += ['', "largest allocation sites:"]
+    for stat in after.statistics('traceback')[:5]:
+        lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    return '\n'.join(lines)
+
+
+def _store(kind, mode, label, agent_id, duration_ms, samples, data):
+    from .models import MessageProfile
+    try:
+        profile = MessageProfile.objects.create(
+            kind=kind, mode=mode, label=label[:255], agent_id=agent_id,
+            duration_ms=duration_ms, samples=samples, data=data,
+        )
+        stale = MessageProfile.objects.order_by('-id').values_list('id', flat=True)[PROFILE_MAX_STORED:]
+        MessageProfile.objects.filter(id__in=list(stale)).delete()
+        logger.info(f"🔬 PROFILE: Stored {mode} profile {profile.pk} for {kind} {label} ({duration_ms}ms).")
+    except Exception as e:
+        logger.error(f"🔴 PROFILE: Could not store the {mode} profile of {kind} {label}: {e}")
+
+
+@contextmanager
+def profile_message(kind: str, label: str = '', agent_id: int = None, gauges=None):
+    """
+    Profiles the enclosed block when profiling is on (admin toggle) or the message is
+    sampled (PROFILE_SAMPLE_RATE), and stores the result as a MessageProfile. Otherwise
+    it costs one cache read. `gauges` is a callable returning {name: value} added to
+    tracemalloc reports (e.g. buffer sizes).
+    """
+    mode = _mode_for_message()
+    if mode != 'tracemalloc' and _tracemalloc_started:
+        _stop_tracemalloc()
+    if mode is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    sampler = None
+    before = None
+    if mode == 'stacks':
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+    else:
+        before = _start_tracemalloc()
+    try:
+        yield
+    finally:
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        try:
+            if sampler is not None:
+                samples = sum(sampler.stop().values())
+                data = sampler.folded()
+            else:
+                samples = 0
+                data = _tracemalloc_report(before, gauges() if gauges else {})
+        except Exception as e:
+            # e.g. tracemalloc stopped by another message once the mode was switched off
+            logger.warning(f"⚠️ PROFILE: Could not finish the {mode} profile of {kind} {label}: {e}")
+        else:
+            _store(kind, mode, label, agent_id, duration_ms, samples, data)
+
+
+def profiled(kind: str, label=None, gauges=None):
+    """Decorator form of profile_message; `label` builds the label from the call's arguments."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_message(
+                kind,
+                label=label(*args, **kwargs) if label else fn.__name__,
+                agent_id=kwargs.get('agent_id'),
+                gauges=gauges,
+            ):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
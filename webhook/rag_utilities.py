@@ -1,41 +1,102 @@
-import numpy as np
 import json
-import requests
 import io
 import base64
-import tempfile
-import os
-from openai import OpenAI
-from pydub import AudioSegment
+import threading
 from django.conf import settings
 from knowledge.models import KnowledgeBase
 from core.models import OpenAISettings 
+from .utils import get_agent_prompt_prefix
+from .transcription import transcribe_audio
+from .deadlines import call_with_deadline
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-# Initialize OpenAI client with API key from settings
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# openai, numpy, pydub and requests are imported on first use: this module is reached from the
+# URLconf (via knowledge.forms and the webhook views), so every management command and worker
+# would otherwise pay for them at startup. webhook.warmup loads them ahead of the first message.
+_openai_client = None
+_openai_client_lock = threading.Lock()
 
-def get_embeddings(text):
+# Default per-request timeout (seconds); calls made for a message get shorter ones from its deadline
+OPENAI_TIMEOUT = getattr(settings, 'OPENAI_TIMEOUT', 60)
+# Share of a message's remaining budget given to the stages that run before the reply is generated
+EMBEDDING_DEADLINE_SHARE = 0.25
+MEDIA_DEADLINE_SHARE = 0.5
+
+
+def get_openai_client():
+    """Returns the shared OpenAI client (and its connection pool), creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=settings.OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+    return _openai_client
+
+
+def _client_with_timeout(timeout):
+    """The shared client, or a view of it that gives up after `timeout` seconds without retrying."""
+    client = get_openai_client()
+    return client if timeout is None else client.with_options(timeout=timeout, max_retries=0)
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def _embedding_options(model, dimensions):
+    options = {"model": model or DEFAULT_EMBEDDING_MODEL}
+    if dimensions:
+        options["dimensions"] = dimensions
+    return options
+
+
+def get_embeddings(text, model=DEFAULT_EMBEDDING_MODEL, dimensions=None, deadline=None):
     """
     Generates a vector embedding for a given text using OpenAI's API.
+    With a message `deadline`, the call is bounded by part of its remaining time (and may be hedged).
     """
+    options = _embedding_options(model, dimensions)
     try:
-        response = openai_client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
+        response = call_with_deadline(
+            f"embeddings:{options['model']}",
+            lambda timeout: _client_with_timeout(timeout).embeddings.create(input=text, **options),
+            deadline,
+            share=EMBEDDING_DEADLINE_SHARE,
         )
         return response.data[0].embedding
     except Exception as e:
         print(f"Error getting embeddings: {e}")
         return None
 
-def find_most_similar_question(user_embedding, knowledge_base, top_n=5):
+def get_embeddings_batch(texts, model=DEFAULT_EMBEDDING_MODEL, dimensions=None):
+    """
+    Embeds several texts in one API call. Returns the vectors in input order.
+    Errors are raised so callers (e.g. document ingestion) can retry or resume.
+    """
+    response = get_openai_client().embeddings.create(
+        input=list(texts),
+        **_embedding_options(model, dimensions)
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def find_most_similar_question(user_embedding, knowledge_base, top_n=5, mode=None):
     """
     Finds the most similar questions in the knowledge base to the user's question.
+    `knowledge_base` is an agent's AgentIndex (see knowledge.index) or a list of KnowledgeBase items.
     """
+    from knowledge.index import AgentIndex
+    import numpy as np
+
+    if isinstance(knowledge_base, AgentIndex):
+        matches = knowledge_base.search(user_embedding, top_n=top_n, mode=mode)
+        items = KnowledgeBase.objects.only(
+            'id', 'brief', 'question', 'canonical_answer', 'canonical_answer_key'
+        ).in_bulk([kb_id for _, kb_id in matches])
+        # An entry deleted since the index was built is simply skipped
+        return [(similarity, items[kb_id]) for similarity, kb_id in matches if kb_id in items]
+
     user_embedding_np = np.array(user_embedding)
     similarities = []
     for item in knowledge_base:
@@ -48,7 +109,8 @@ def find_most_similar_question(user_embedding, knowledge_base, top_n=5):
                 
             similarity = np.dot(user_embedding_np, db_embedding_np) / (np.linalg.norm(user_embedding_np) * np.linalg.norm(db_embedding_np))
             similarities.append((similarity, item))
-        except (json.JSONDecodeError, TypeError) as e:
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            # ValueError: vector from a different embedding model/size than the query
             print(f"Error processing embedding for chunk {item.id}: {e}")
             continue
     
@@ -56,21 +118,24 @@ def find_most_similar_question(user_embedding, knowledge_base, top_n=5):
     return similarities[:top_n]
 
 
-def generate_answer(user_question, context_questions, history, agent_settings: OpenAISettings):
-    """
-    Generates an answer using the provided context and conversation history.
-    """
-    context_text = "\n".join(context_questions)
+# Reasoning models only accept the default sampling parameters
+REASONING_MODEL_PREFIXES = ('gpt-5', 'o1', 'o3', 'o4')
+
 
-    # OpenAI API settings
-    system_prompt = agent_settings.system_context
-    model_name = agent_settings.model_name
-    temperature = agent_settings.temperature
-    top_p = agent_settings.top_p
-    frequency_penalty = agent_settings.frequency_penalty
-    presence_penalty = agent_settings.presence_penalty
+def _sampling_options(model, agent_settings: OpenAISettings):
+    if model.startswith(REASONING_MODEL_PREFIXES) and not model.startswith('gpt-5-chat'):
+        return {}
+    return {
+        "temperature": agent_settings.temperature,
+        "top_p": agent_settings.top_p,
+        "frequency_penalty": agent_settings.frequency_penalty,
+        "presence_penalty": agent_settings.presence_penalty,
+    }
 
-    full_system_content = f"{system_prompt}\n\n[Knowledge Base Context Start]\n{context_text}\n[Knowledge Base Context End]"
+
+def _answer_messages(user_question, context_questions, history, agent_settings: OpenAISettings):
+    context_text = "\n".join(context_questions)
+    full_system_content = f"{get_agent_prompt_prefix(agent_settings)}{context_text}\n[Knowledge Base Context End]"
 
     # Combine all messages for the API call
     messages = [{"role": "system", "content": full_system_content}]
@@ -81,18 +146,39 @@ def generate_answer(user_question, context_questions, history, agent_settings: O
         
     # Add the current user question
     messages.append({"role": "user", "content": user_question})
+    return messages
 
- 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-5-chat-latest",  # You can change this to a different model if needed
+
+def complete_answer(user_question, context_questions, history, agent_settings: OpenAISettings, model,
+                    deadline=None, share=1.0):
+    """
+    Generates an answer with `model` and the agent's sampling settings, within `share`
+    of what is left of the message `deadline` (and hedged when enabled).
+    Errors are raised so the caller (webhook.routing) can fall back to another model.
+    """
+    messages = _answer_messages(user_question, context_questions, history, agent_settings)
+    response = call_with_deadline(
+        f"chat:{model}",
+        lambda timeout: _client_with_timeout(timeout).chat.completions.create(
+            model=model,
             messages=messages,
-            temperature=0.7,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty
+            **_sampling_options(model, agent_settings)
+        ),
+        deadline,
+        share=share,
+    )
+    return response.choices[0].message.content
+
+
+def generate_answer(user_question, context_questions, history, agent_settings: OpenAISettings, model=None):
+    """
+    Generates an answer using the provided context and conversation history,
+    with `model` or the agent's configured model.
+    """
+    try:
+        return complete_answer(
+            user_question, context_questions, history, agent_settings, model or agent_settings.model_name
         )
-        return response.choices[0].message.content
     except Exception as e:
         print(f"Error generating answer: {e}")
         return "Sorry, there was an error processing your request."
@@ -101,8 +187,10 @@ def transcribe_audio_from_url(audio_url):
     """
     Downloads and transcribes an audio file from a given URL.
     """
+    import requests
+
     try:
-        response = requests.get(audio_url)
+        response = requests.get(audio_url, timeout=OPENAI_TIMEOUT)
         response.raise_for_status()
         audio_bytes = response.content
         
@@ -111,7 +199,7 @@ def transcribe_audio_from_url(audio_url):
         audio_file_io.name = "audio.ogg"
             
         # Transcribe the audio file directly from memory
-        transcription = openai_client.audio.transcriptions.create(
+        transcription = get_openai_client().audio.transcriptions.create(
             model="whisper-1", 
             file=audio_file_io,
             language="ar"
@@ -133,30 +221,30 @@ def transcribe_audio_from_base64(base64_audio, mimetype="audio/ogg"):
     try:
         # Decode the base64 string
         audio_data = base64.b64decode(base64_audio)
-        
+    except Exception as e:
+        print(f"❌ Error decoding base64 audio: {e}")
+        return "عذراً، حدث خطأ أثناء معالجة الرسالة الصوتية. هل يمكنك كتابة سؤالك بدلاً من ذلك؟"
+
+    return transcribe_audio_from_file(io.BytesIO(audio_data), mimetype)
+
+
+def transcribe_audio_from_file(audio_file, mimetype="audio/ogg", deadline=None):
+    """
+    Transcribes already-decoded audio from a file object (e.g. the spooled webhook media).
+    With a message `deadline`, each request is bounded by part of its remaining time.
+    """
+    try:
         # Determine file extension from mimetype
         ext = mimetype.split("/")[-1].split(";")[0]
 
-        # Use pydub to load the audio from memory
-        audio_segment = AudioSegment.from_file(io.BytesIO(audio_data), format=ext)
-        
-        # Create a temporary file to convert to a format that Whisper prefers (like mp3 or wav)
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio:
-            audio_segment.export(temp_audio.name, format="mp3")
-            temp_audio_path = temp_audio.name
-            
-        # Transcribe the converted audio file
-        with open(temp_audio_path, "rb") as audio_file:
-            transcription = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="ar"
-            )
-        
-        # Clean up the temporary file
-        os.remove(temp_audio_path)
+        # Use pydub to load the audio straight from the file object
+        from pydub import AudioSegment
+        audio_file.seek(0)
+        audio_segment = AudioSegment.from_file(audio_file, format=ext)
 
-        return transcription.text
+        # Converted to mp3 in memory; long voice notes are split at pauses and transcribed in parallel
+        timeout = deadline.timeout(MEDIA_DEADLINE_SHARE) if deadline is not None else None
+        return transcribe_audio(audio_segment, _client_with_timeout(timeout))
 
     except Exception as e:
         print(f"❌ Error transcribing audio from base64: {e}")
@@ -165,11 +253,21 @@ def transcribe_audio_from_base64(base64_audio, mimetype="audio/ogg"):
 
 
 
-def analyze_image_from_base64(base64_image: str, user_question: str) -> str:
+def analyze_image_from_file(image_file, user_question: str, deadline=None) -> str:
+    """
+    Analyzes already-decoded image bytes from a file object (e.g. the spooled webhook media).
+    The Vision API only accepts URLs or data URIs, so the bytes are base64-encoded once here.
+    """
+    image_file.seek(0)
+    base64_image = base64.b64encode(image_file.read()).decode('ascii')
+    return analyze_image_from_base64(base64_image, user_question, deadline)
+
+
+def analyze_image_from_base64(base64_image: str, user_question: str, deadline=None) -> str:
     """
     Analyzes an image provided as a base64 string using GPT-4 Vision API.
     """
-    if not openai_client:
+    if not settings.OPENAI_API_KEY:
         return "Sorry, the AI service is not properly configured."
     
     if not base64_image:
@@ -199,15 +297,20 @@ def analyze_image_from_base64(base64_image: str, user_question: str) -> str:
     ]
     
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4.1",  # ← لازم موديل Vision
-            messages=[
-                {
-                    "role": "user",
-                    "content": content_parts
-                }
-            ],
-            max_completion_tokens=500,
+        response = call_with_deadline(
+            "vision:gpt-4.1",
+            lambda timeout: _client_with_timeout(timeout).chat.completions.create(
+                model="gpt-4.1",  # ← لازم موديل Vision
+                messages=[
+                    {
+                        "role": "user",
+                        "content": content_parts
+                    }
+                ],
+                max_completion_tokens=500,
+            ),
+            deadline,
+            share=MEDIA_DEADLINE_SHARE,
         )
         
         analysis_text = response.choices[0].message.content
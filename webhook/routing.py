@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from .deadlines import call_stats, forget, tracked_keys
+from .rag_utilities import complete_answer
+
+logger = logging.getLogger(__name__)
+
+# Turns of at most this many words (e.g. "thanks", "hi", "what time do you open") count as simple
+ROUTING_SIMPLE_MAX_WORDS = getattr(settings, 'ROUTING_SIMPLE_MAX_WORDS', 6)
+# A best knowledge match at least this similar means the answer is mostly in the context
+ROUTING_CONFIDENT_SIMILARITY = getattr(settings, 'ROUTING_CONFIDENT_SIMILARITY', 0.8)
+# A model is degraded when its p90 latency (seconds) or error rate over the window crosses these
+ROUTING_LATENCY_THRESHOLD = getattr(settings, 'ROUTING_LATENCY_THRESHOLD', 12)
+ROUTING_ERROR_RATE_THRESHOLD = getattr(settings, 'ROUTING_ERROR_RATE_THRESHOLD', 0.3)
+# Latest calls a model is judged on (at most deadlines.OPENAI_CALL_WINDOW), and calls needed before it is judged
+ROUTING_WINDOW = getattr(settings, 'ROUTING_WINDOW', 50)
+ROUTING_MIN_SAMPLES = getattr(settings, 'ROUTING_MIN_SAMPLES', 10)
+# Seconds a degraded model is skipped; afterwards it gets traffic again and is judged on fresh calls
+ROUTING_COOLDOWN = getattr(settings, 'ROUTING_COOLDOWN', 60)
+
+# With a fallback model configured, the first attempt leaves it this much less of the message deadline
+PRIMARY_DEADLINE_SHARE = 0.6
+
+ERROR_REPLY = "Sorry, there was an error processing your request."
+
+# Per-process model -> monotonic time it is skipped until. Call latencies and errors are the ones
+# webhook.deadlines records for hedging, under the key complete_answer uses ('chat:<model>').
+_degraded_until = {}
+_health_lock = threading.Lock()
+
+
+def _key(model: str) -> str:
+    return f"chat:{model}"
+
+
+def check_health(model: str):
+    """Marks `model` degraded when its p90 latency or error rate over the window crosses a threshold."""
+    stats = call_stats(_key(model), q=0.9, window=ROUTING_WINDOW)
+    if stats['calls'] < ROUTING_MIN_SAMPLES:
+        return
+    p90, error_rate = stats['percentile'], stats['error_rate']
+    if (p90 is None or p90 < ROUTING_LATENCY_THRESHOLD) and error_rate < ROUTING_ERROR_RATE_THRESHOLD:
+        return
+    with _health_lock:
+        _degraded_until[model] = time.monotonic() + ROUTING_COOLDOWN
+    # After the cooldown the model is judged on fresh calls only
+    forget(_key(model))
+    latency = 'n/a' if p90 is None else f"{p90:.1f}s"
+    logger.warning(
+        f"⚠️ ROUTING: {model} degraded (p90 {latency}, errors {error_rate:.0%}); "
+        f"using fallbacks for {ROUTING_COOLDOWN}s."
+    )
+
+
+def is_degraded(model: str) -> bool:
+    with _health_lock:
+        return _degraded_until.get(model, 0) > time.monotonic()
+
+
+def model_health() -> dict:
+    """Per-model calls in the window, p90 latency, error rate and whether it is degraded."""
+    with _health_lock:
+        degraded = {model for model, until in _degraded_until.items() if until > time.monotonic()}
+    models = {key.split(':', 1)[1] for key in tracked_keys() if key.startswith('chat:')} | degraded
+    health = {}
+    for model in models:
+        stats = call_stats(_key(model), q=0.9, window=ROUTING_WINDOW)
+        health[model] = {
+            'calls': stats['calls'],
+            'p90_seconds': stats['percentile'],
+            'error_rate': stats['error_rate'],
+            'degraded': model in degraded,
+        }
+    return health
+
+
+def is_simple(question: str) -> bool:
+    """Short single-line turns: greetings, thanks, yes/no follow-ups."""
+    return '\n' not in question.strip() and len(question.split()) <= ROUTING_SIMPLE_MAX_WORDS
+
+
+def choose_model(agent_settings, question: str, top_similarity=None) -> tuple:
+    """
+    Picks the model for one turn. Returns (model, reason).
+
+    The agent's model_name is the default. With a fast_model_name, simple turns and turns
+    whose best knowledge match is confident go to the fast model. With a fallback_model_name,
+    a degraded choice is replaced by the fallback.
+    """
+    model, reason = agent_settings.model_name, 'primary'
+    fast = agent_settings.fast_model_name
+    if fast and fast != model:
+        if is_simple(question):
+            model, reason = fast, 'fast_simple'
+        elif top_similarity is not None and top_similarity >= ROUTING_CONFIDENT_SIMILARITY:
+            model, reason = fast, 'fast_confident'
+    fallback = agent_settings.fallback_model_name
+    if fallback and fallback != model and is_degraded(model):
+        model, reason = fallback, 'fallback_degraded'
+    return model, reason
+
+
+def _completion(question, context, history, agent_settings, model, deadline=None, share=1.0):
+    try:
+        return complete_answer(question, context, history, agent_settings, model, deadline=deadline, share=share)
+    finally:
+        # complete_answer's attempts were recorded by call_with_deadline
+        check_health(model)
+
+
+def generate_routed_answer(question, context, history, agent_settings, top_similarity=None, deadline=None) -> tuple:
+    """
+    Generates the reply with the routed model. A failed (or timed out) call is retried
+    once on the agent's fallback model while the message `deadline` has time left.
+    Returns (text, route), where route holds the Response fields model, route and generation_ms.
+    """
+    started = time.perf_counter()
+    model, reason = choose_model(agent_settings, question, top_similarity)
+    fallback = agent_settings.fallback_model_name
+    share = PRIMARY_DEADLINE_SHARE if fallback and fallback != model else 1.0
+    try:
+        text = _completion(question, context, history, agent_settings, model, deadline, share)
+    except Exception as e:
+        if not fallback or fallback == model:
+            logger.error(f"🔴 ROUTING: {model} failed and there is no fallback to try: {e}")
+            text, reason = ERROR_REPLY, 'error'
+        elif deadline is not None and deadline.expired():
+            logger.error(f"🔴 ROUTING: {model} failed and the message deadline has passed: {e}")
+            text, reason = ERROR_REPLY, 'error'
+        else:
+            logger.warning(f"⚠️ ROUTING: {model} failed ({e}); retrying with {fallback}.")
+            model, reason = fallback, 'fallback_error'
+            try:
+                text = _completion(question, context, history, agent_settings, model, deadline)
+            except Exception as e:
+                logger.error(f"🔴 ROUTING: Fallback {model} failed too: {e}")
+                text, reason = ERROR_REPLY, 'error'
+
+    generation_ms = int((time.perf_counter() - started) * 1000)
+    logger.info(f"🧭 ROUTING: {model} ({reason}) answered in {generation_ms}ms.")
+    return text, {'model': model, 'route': reason, 'generation_ms': generation_ms}
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from core.models import OpenAISettings
+from .models import Client
+from .persistence import forget_client
+from .utils import invalidate_agent_settings
+
+
+@receiver([post_save, post_delete], sender=OpenAISettings)
+def invalidate_agent_cache(sender, instance, **kwargs):
+    """Drops the cached agent settings whenever an agent is saved or deleted."""
+    invalidate_agent_settings(instance.id)
+
+
+@receiver(post_delete, sender=Client)
+def forget_deleted_client(sender, instance, **kwargs):
+    """Keeps the jid -> client id cache from pointing at deleted clients."""
+    forget_client(instance.jid)
@@ -1,3 +1,1017 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from core.models import OpenAISettings
+from knowledge import tokens
+from . import (
+    analytics, background, deadlines, idempotency, outbox, persistence, profiling, routing, transcription, utils, views,
+    warmup,
+)
+from .export import export_rows, export_stream
+from .packing import pack_context
+from .pipeline import Pipeline
+from .ingest import WebhookBodyTooLarge, parse_webhook_stream
+from .models import (
+    ArchivedMessage, Client, DailyConversationStats, Message, MessageProfile, OutboxMessage, ProcessedWebhook,
+    QuarantinedRow, Response,
+)
 
-# Create your tests here.
+
+class AgentSettingsCacheTests(TestCase):
+    def setUp(self):
+        utils._agent_cache.clear()
+        self.agent = OpenAISettings.objects.create(agent_name='Support', system_context='Be brief.')
+
+    def test_cached_agent_is_served_without_queries(self):
+        utils.get_agent_settings_by_id(self.agent.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(utils.get_agent_settings_by_id(self.agent.pk).pk, self.agent.pk)
+
+    def test_save_drops_the_cached_agent(self):
+        utils.get_agent_settings_by_id(self.agent.pk)
+        self.agent.system_context = 'Be thorough.'
+        self.agent.save()
+        self.assertEqual(utils.get_agent_settings_by_id(self.agent.pk).system_context, 'Be thorough.')
+
+    def test_expired_entry_only_rereads_the_version(self):
+        utils.get_agent_settings_by_id(self.agent.pk)
+        with mock.patch.object(utils, 'AGENT_CACHE_TTL', 0), self.assertNumQueries(1):
+            self.assertEqual(utils.get_agent_settings_by_id(self.agent.pk).system_context, 'Be brief.')
+
+    def test_expired_entry_picks_up_edits_from_other_workers(self):
+        utils.get_agent_settings_by_id(self.agent.pk)
+        # A queryset update sends no signal, like a save made in another process
+        OpenAISettings.objects.filter(pk=self.agent.pk).update(system_context='Be thorough.', updated_at=timezone.now())
+        self.assertEqual(utils.get_agent_settings_by_id(self.agent.pk).system_context, 'Be brief.')
+        with mock.patch.object(utils, 'AGENT_CACHE_TTL', 0):
+            self.assertEqual(utils.get_agent_settings_by_id(self.agent.pk).system_context, 'Be thorough.')
+
+    def test_prompt_prefix(self):
+        agent = utils.get_agent_settings_by_id(self.agent.pk)
+        self.assertEqual(utils.get_agent_prompt_prefix(agent), "Be brief.\n\n[Knowledge Base Context Start]\n")
+
+    def test_missing_agent_raises(self):
+        with self.assertRaises(ObjectDoesNotExist):
+            utils.get_agent_settings_by_id(self.agent.pk + 1000)
+
+
+class WebhookStreamParserTests(SimpleTestCase):
+    media = bytes(range(256)) * 40
+
+    def _body(self, encoded: str, **extra) -> bytes:
+        message = {'conversation': 'hi "there" \\ base64', 'base64': encoded, **extra}
+        return json.dumps({'event': 'messages.upsert', 'data': {'message': message}}).encode()
+
+    def _parse(self, body: bytes, chunk_size: int):
+        payload, media_file = parse_webhook_stream(io.BytesIO(body), chunk_size=chunk_size, max_memory=1024)
+        self.addCleanup(lambda: media_file and media_file.close())
+        return payload, media_file
+
+    def test_payload_without_media(self):
+        body = json.dumps({'event': 'messages.upsert', 'data': {'message': {'conversation': 'hi'}}}).encode()
+        payload, media_file = self._parse(body, chunk_size=5)
+        self.assertEqual(payload, json.loads(body))
+        self.assertIsNone(media_file)
+
+    def test_media_is_decoded_and_replaced_by_null_at_any_chunk_size(self):
+        body = self._body(base64.b64encode(self.media).decode())
+        for chunk_size in (1, 3, 7, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                payload, media_file = self._parse(body, chunk_size)
+                self.assertIsNone(payload['data']['message']['base64'])
+                self.assertEqual(payload['data']['message']['conversation'], 'hi "there" \\ base64')
+                self.assertEqual(media_file.read(), self.media)
+
+    def test_data_uri_header_escaped_slashes_and_line_breaks(self):
+        encoded = 'data:image/jpeg;base64,' + base64.encodebytes(self.media).decode()
+        body = self._body(encoded).replace(b'/', b'\\/')
+        payload, media_file = self._parse(body, chunk_size=11)
+        self.assertEqual(media_file.read(), self.media)
+
+    def test_only_the_first_media_field_is_spooled(self):
+        body = self._body(base64.b64encode(b'first').decode(), quoted={'base64': 'c2Vjb25k'})
+        payload, media_file = self._parse(body, chunk_size=4)
+        self.assertEqual(media_file.read(), b'first')
+        self.assertEqual(payload['data']['message']['quoted']['base64'], 'c2Vjb25k')
+
+    def test_unterminated_media_raises(self):
+        body = self._body(base64.b64encode(self.media).decode())[:200]
+        with self.assertRaises(json.JSONDecodeError):
+            parse_webhook_stream(io.BytesIO(body))
+
+    def test_body_over_the_cap_raises_and_closes_the_media_file(self):
+        body = self._body(base64.b64encode(self.media).decode())
+        spooled = []
+        real = tempfile.SpooledTemporaryFile
+
+        def spool(**kwargs):
+            spooled.append(real(**kwargs))
+            return spooled[-1]
+
+        with mock.patch('webhook.ingest.tempfile.SpooledTemporaryFile', side_effect=spool), \
+                self.assertRaises(WebhookBodyTooLarge):
+            parse_webhook_stream(io.BytesIO(body), chunk_size=64, max_memory=16, max_body_size=len(body) - 1)
+        self.assertTrue(spooled and spooled[0].closed)
+        # Exactly at the cap is fine
+        payload, media_file = parse_webhook_stream(io.BytesIO(body), max_body_size=len(body))
+        self.addCleanup(media_file.close)
+        self.assertEqual(media_file.read(), self.media)
+
+    @mock.patch.object(views, 'MAX_BODY_SIZE', 100)
+    def test_view_answers_413_over_the_cap(self):
+        url = reverse('webhook:agent_webhook', args=[1])
+        response = self.client.post(url, data=b'{}', content_type='application/json', CONTENT_LENGTH='101')
+        self.assertEqual(response.status_code, 413)
+        # A body that lies about its length is still cut off while streaming
+        with mock.patch.object(views, 'parse_webhook_stream', side_effect=WebhookBodyTooLarge('too large')):
+            response = self.client.post(url, data=b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 413)
+
+
+class ClientUpsertTests(TestCase):
+    def setUp(self):
+        persistence._client_cache.clear()
+
+    def test_unchanged_name_is_served_from_the_cache(self):
+        client_id = persistence.upsert_client('966500000001@s.whatsapp.net', 'Sara')
+        with self.assertNumQueries(0):
+            self.assertEqual(persistence.upsert_client('966500000001@s.whatsapp.net', 'Sara'), client_id)
+            self.assertEqual(persistence.get_client_id('966500000001@s.whatsapp.net'), client_id)
+
+    def test_new_name_updates_the_same_row(self):
+        client_id = persistence.upsert_client('966500000001@s.whatsapp.net', 'Sara')
+        self.assertEqual(persistence.upsert_client('966500000001@s.whatsapp.net', 'Sara A.'), client_id)
+        self.assertEqual(Client.objects.get(pk=client_id).name, 'Sara A.')
+
+
+@mock.patch.object(persistence.outbox_relay, 'wake')
+@mock.patch.object(persistence.ConversationWriter, '_ensure_thread')
+class ConversationWriterTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(jid='966500000001@s.whatsapp.net', name='Sara')
+        self.writer = persistence.ConversationWriter()
+
+    def _reply(self, message, text):
+        return self.writer.add_reply(message, text, self.client_row.jid, 'instance', 'https://evolution.test', 'key')
+
+    def test_flush_writes_messages_replies_and_outbox(self, *mocks):
+        message = self.writer.add_message(self.client_row.pk, 'text', 'What are your hours?')
+        self._reply(message, '9 to 5.')
+        self.writer.flush()
+        self.assertEqual((self.writer.messages, self.writer.responses, self.writer.outbox), ([], [], []))
+        self.assertEqual(Response.objects.get(message=message).content, '9 to 5.')
+        self.assertEqual(OutboxMessage.objects.get().response_id, message.pk)
+
+    def test_rows_keep_the_time_they_were_queued_at(self, *mocks):
+        message = self.writer.add_message(self.client_row.pk, 'text', 'What are your hours?')
+        response = self._reply(message, '9 to 5.')
+        flushed_at = timezone.now() + timedelta(seconds=30)
+        with mock.patch('django.utils.timezone.now', return_value=flushed_at):
+            self.writer.flush()
+        self.assertEqual(Message.objects.get().timestamp, message.timestamp)
+        self.assertEqual(Response.objects.get().timestamp, response.timestamp)
+        self.assertLess(message.timestamp, flushed_at)
+
+    def test_history_merges_buffered_and_saved_rows(self, *mocks):
+        saved = self.writer.add_message(self.client_row.pk, 'text', 'first')
+        self._reply(saved, 'first reply')
+        self.writer.flush()
+        pending = self.writer.add_message(self.client_row.pk, 'text', 'second')
+        with mock.patch.object(persistence, 'conversation_writer', self.writer):
+            history = persistence.get_recent_history(self.client_row.pk)
+        self.assertEqual(
+            [(message.content, reply) for message, reply in history],
+            [('first', 'first reply'), ('second', None)],
+        )
+        self.assertIs(history[-1][0], pending)
+
+    def test_failed_batch_is_retried_then_written_row_by_row(self, *mocks):
+        good = self.writer.add_message(self.client_row.pk, 'text', 'good')
+        self._reply(good, 'good reply')
+        # No client: rejected by the database, so the whole batch fails
+        bad = self.writer.add_message(None, 'text', 'bad')
+        self._reply(bad, 'bad reply')
+
+        for _ in range(persistence.MAX_FLUSH_ATTEMPTS - 1):
+            self.writer.flush()
+            self.assertEqual(len(self.writer.messages), 2)
+            self.assertFalse(Message.objects.exists())
+        self.writer.flush()
+
+        self.assertEqual(self.writer.messages, [])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['good'])
+        self.assertEqual(
+            sorted(QuarantinedRow.objects.values_list('model', flat=True)),
+            ['webhook.Message', 'webhook.Response'],
+        )
+        self.assertEqual(QuarantinedRow.objects.get(model='webhook.Response').data['content'], 'bad reply')
+        # Both replies are still delivered; the bad one without its response row
+        self.assertEqual(
+            sorted(OutboxMessage.objects.values_list('text', 'response_id')),
+            [('bad reply', None), ('good reply', good.pk)],
+        )
+
+
+class ArchiveMessagesTests(TestCase):
+    def setUp(self):
+        self.agent = OpenAISettings.objects.create(agent_name='Support')
+        self.client_row = Client.objects.create(jid='966500000001@s.whatsapp.net', name='Sara')
+        self.old = self._message('old question', days_ago=120)
+        Response.objects.create(message=self.old, content='old answer', model='gpt-4o-mini', route='fast_simple', generation_ms=420)
+        self.recent = self._message('recent question', days_ago=1)
+
+    def _message(self, content, days_ago):
+        message = Message.objects.create(client=self.client_row, agent=self.agent, content=content)
+        Message.objects.filter(pk=message.pk).update(timestamp=timezone.now() - timedelta(days=days_ago))
+        return message
+
+    def test_old_messages_move_to_the_archive_with_their_response(self):
+        call_command('archive_messages', older_than_days=90, retention_days=0, stdout=io.StringIO())
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['recent question'])
+        self.assertFalse(Response.objects.exists())
+        archived = ArchivedMessage.objects.get()
+        self.assertEqual(
+            (archived.original_id, archived.agent_id, archived.content, archived.response_content),
+            (self.old.pk, self.agent.pk, 'old question', 'old answer'),
+        )
+        self.assertEqual(
+            (archived.response_model, archived.response_route, archived.response_generation_ms),
+            ('gpt-4o-mini', 'fast_simple', 420),
+        )
+
+    def test_retention_purges_old_archived_rows(self):
+        call_command('archive_messages', older_than_days=90, retention_days=100, stdout=io.StringIO())
+        self.assertFalse(ArchivedMessage.objects.exists())
+
+    def test_export_includes_archived_history_first(self):
+        call_command('archive_messages', older_than_days=90, retention_days=0, stdout=io.StringIO())
+        self.assertEqual([row['content'] for row in export_rows(agent_id=self.agent.pk)], ['recent question'])
+        rows = list(export_rows(agent_id=self.agent.pk, include_archive=True))
+        self.assertEqual([row['message_id'] for row in rows], [self.old.pk, self.recent.pk])
+        self.assertEqual((rows[0]['response'], rows[0]['response_route']), ('old answer', 'fast_simple'))
+
+
+@mock.patch.object(background, 'close_old_connections')
+@mock.patch.object(background, 'connections')
+class BackgroundExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = background.BackgroundExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_results_and_errors_come_back_through_the_future(self, connections, close_old_connections):
+        self.assertEqual(self.executor.submit(sum, [1, 2, 3]).result(), 6)
+        with self.assertLogs(background.logger, 'ERROR'):
+            future = self.executor.submit(int, 'not a number')
+            with self.assertRaises(ValueError):
+                future.result()
+
+    def test_concurrency_is_bounded_by_max_workers(self, connections, close_old_connections):
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        def job():
+            started.release()
+            release.wait(5)
+
+        futures = [self.executor.submit(job) for _ in range(4)]
+        self.assertTrue(started.acquire(timeout=5) and started.acquire(timeout=5))
+        # The other two jobs wait for a free worker
+        self.assertFalse(started.acquire(timeout=0.2))
+        release.set()
+        for future in futures:
+            future.result()
+
+    def test_connections_are_closed_once_the_queue_is_empty(self, connections, close_old_connections):
+        self.executor.submit(lambda: None).result()
+        close_old_connections.assert_called_once()
+        connections.close_all.assert_called_once()
+
+
+class _CharEncoding:
+    """Stand-in for a tiktoken encoding with one token per character."""
+
+    def encode(self, text, disallowed_special=()):
+        return [ord(char) for char in text]
+
+    def decode_bytes(self, tokens):
+        return ''.join(map(chr, tokens)).encode('utf-8')
+
+    def decode(self, tokens):
+        return ''.join(map(chr, tokens))
+
+
+@mock.patch.object(tokens, '_encoding', _CharEncoding())
+class PackContextTests(SimpleTestCase):
+    def _candidates(self, *pairs):
+        return [(similarity, SimpleNamespace(question=text)) for similarity, text in pairs]
+
+    def test_floor_and_score_gap_cut_the_tail(self):
+        candidates = self._candidates((0.9, 'opening hours'), (0.85, 'holiday hours'), (0.5, 'returns'), (0.45, 'refunds'))
+        self.assertEqual(pack_context(candidates, similarity_floor=0.3, token_budget=1000),
+                         ['opening hours', 'holiday hours'])
+        self.assertEqual(pack_context(candidates, similarity_floor=0.88, token_budget=1000), ['opening hours'])
+
+    def test_near_duplicates_are_skipped(self):
+        text = 'we open every day from nine in the morning until five'
+        candidates = self._candidates((0.9, text), (0.89, text + ' pm'), (0.88, 'delivery takes three days'))
+        self.assertEqual(pack_context(candidates, similarity_floor=0.3, token_budget=1000),
+                         [text, 'delivery takes three days'])
+
+    def test_budget_keeps_relevance_order_and_skips_what_does_not_fit(self):
+        candidates = self._candidates((0.9, 'a' * 60), (0.89, 'b' * 50), (0.88, 'c' * 30))
+        self.assertEqual(pack_context(candidates, similarity_floor=0.3, token_budget=100), ['a' * 60, 'c' * 30])
+
+    def test_best_chunk_is_truncated_rather_than_dropped(self):
+        candidates = self._candidates((0.9, 'x' * 500))
+        self.assertEqual(pack_context(candidates, similarity_floor=0.3, token_budget=40), ['x' * 40])
+
+
+class PipelineTests(SimpleTestCase):
+    def test_stages_get_their_dependencies_by_name(self):
+        pipeline = Pipeline('test')
+        pipeline.add('a', lambda: 2)
+        pipeline.add('b', lambda: 3, inline=True)
+        pipeline.add('total', lambda a, b: a * 10 + b, deps=['a', 'b'], inline=True)
+        self.assertEqual(pipeline.run(), {'a': 2, 'b': 3, 'total': 23})
+
+    def test_pool_stages_overlap_and_inline_stages_stay_on_the_caller_thread(self):
+        barrier = threading.Barrier(2, timeout=5)
+        caller = threading.get_ident()
+        pipeline = Pipeline('test')
+        pipeline.add('first', lambda: barrier.wait() is not None)
+        pipeline.add('second', lambda: barrier.wait() is not None)
+        pipeline.add('inline', threading.get_ident, inline=True)
+        results = pipeline.run()
+        self.assertTrue(results['first'] and results['second'])
+        self.assertEqual(results['inline'], caller)
+
+    def test_unknown_dependency_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Pipeline('test').add('reply', lambda context: context, deps=['context'])
+
+    def test_stage_error_is_raised_to_the_caller(self):
+        def fail():
+            raise ConnectionError('embedding API down')
+
+        pipeline = Pipeline('test')
+        pipeline.add('embedding', fail)
+        pipeline.add('context', lambda embedding: embedding, deps=['embedding'], inline=True)
+        with self.assertRaisesMessage(ConnectionError, 'embedding API down'):
+            pipeline.run()
+
+
+@mock.patch.object(tokens, '_encoding', _CharEncoding())
+class BufferedMessagePipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.agent = SimpleNamespace(
+            id=7, embedding_model='text-embedding-3-small', embedding_dimensions=None,
+            context_similarity_floor=0.3, context_token_budget=1000, direct_answers=False,
+        )
+        self.message = SimpleNamespace(id=None, client_id=1, content='when do you open?')
+        self.writer = mock.Mock()
+        self.writer.add_message.return_value = self.message
+        patches = [
+            mock.patch.object(views, 'conversation_writer', self.writer),
+            mock.patch.object(views, 'get_client_id', return_value=1),
+            mock.patch.object(views, 'get_recent_history', return_value=[(self.message, None)]),
+            mock.patch.object(views, 'get_embeddings', return_value=[0.1, 0.2]),
+            mock.patch.object(views, 'find_most_similar_question',
+                              return_value=[(0.9, SimpleNamespace(question='We open at nine.'))]),
+            mock.patch('knowledge.index.get_agent_index', return_value='index'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _process(self):
+        views._user_buffers['jid:inst:1'] = {}
+        user_data = {'content': 'when do you open?', 'message_type': 'conversation', 'image_url': None}
+        views._process_buffered_message_logic('jid', 'inst', 'key', 'https://evo', user_data, self.agent, 'jid:inst:1')
+
+    def test_retrieved_context_reaches_the_routed_answer(self):
+        route = {'model': 'gpt-4o-mini', 'route': 'cheap', 'generation_ms': 12}
+        with mock.patch.object(views, 'generate_routed_answer', return_value=('We open at nine.', route)) as generate:
+            self._process()
+        content, context, history, agent, top_similarity, _deadline = generate.call_args.args
+        self.assertEqual((content, context, history, agent, top_similarity),
+                         ('when do you open?', ['We open at nine.'], [{'role': 'user', 'content': 'when do you open?'}], self.agent, 0.9))
+        self.writer.add_reply.assert_called_once_with(
+            self.message, 'We open at nine.', 'jid', 'inst', 'https://evo', 'key', **route
+        )
+        self.assertNotIn('jid:inst:1', views._user_buffers)
+
+    def test_direct_answer_skips_the_completion(self):
+        with mock.patch.object(views, 'find_direct_answer', return_value='Nine to five.'), \
+                mock.patch.object(views, 'generate_routed_answer') as generate:
+            self._process()
+        generate.assert_not_called()
+        self.writer.add_reply.assert_called_once_with(
+            self.message, 'Nine to five.', 'jid', 'inst', 'https://evo', 'key',
+            model='', route='direct', generation_ms=0,
+        )
+
+    def test_failed_embedding_still_queues_a_reply(self):
+        route = {'model': 'gpt-4o', 'route': 'primary', 'generation_ms': 30}
+        with mock.patch.object(views, 'get_embeddings', return_value=None), \
+                mock.patch.object(views, 'find_most_similar_question') as search, \
+                mock.patch.object(views, 'generate_routed_answer', return_value=('Let me check.', route)) as generate, \
+                self.assertLogs(views.logger, 'WARNING'):
+            self._process()
+        search.assert_not_called()
+        _content, context, _history, _agent, top_similarity, _deadline = generate.call_args.args
+        self.assertEqual((context, top_similarity), ([], None))
+        self.writer.add_reply.assert_called_once_with(
+            self.message, 'Let me check.', 'jid', 'inst', 'https://evo', 'key', **route
+        )
+
+
+@mock.patch.object(outbox, 'OUTBOX_MAX_ATTEMPTS', 3)
+class OutboxRelayTests(TestCase):
+    def _entry(self, **fields):
+        fields = {'jid': '966500000001@s.whatsapp.net', 'text': 'hi', 'instance_id': 'inst',
+                  'server_url': 'https://evo', 'api_key': 'secret', **fields}
+        return OutboxMessage.objects.create(**fields)
+
+    def test_claim_leases_due_entries_only(self):
+        due = self._entry()
+        self._entry(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        self._entry(status='sent')
+        claimed = outbox._claim(10)
+        self.assertEqual([entry.pk for entry in claimed], [due.pk])
+        due.refresh_from_db()
+        self.assertEqual(due.next_attempt_at, claimed[0].next_attempt_at)
+        self.assertGreater(due.next_attempt_at, timezone.now())
+        self.assertEqual(outbox._claim(10), [])
+
+    def test_delivered_entry_is_marked_sent_and_forgets_the_key(self):
+        entry = self._entry()
+        with mock.patch.object(outbox, 'send_message_to_client', return_value={'key': {}}) as send:
+            self.assertEqual(outbox.relay_due(), (1, 0))
+        send.assert_called_once_with(entry.jid, 'hi', 'inst', 'secret', 'https://evo')
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts, entry.api_key), ('sent', 1, ''))
+        self.assertIsNotNone(entry.sent_at)
+
+    def test_failed_send_backs_off_then_gives_up(self):
+        entry = self._entry()
+        with mock.patch.object(outbox, 'send_message_to_client', return_value=None):
+            self.assertEqual(outbox.relay_due(), (0, 1))
+            entry.refresh_from_db()
+            self.assertEqual((entry.status, entry.attempts, entry.api_key), ('pending', 1, 'secret'))
+            self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=3))
+            self.assertEqual(entry.last_error, 'Evolution API request failed')
+
+            OutboxMessage.objects.filter(pk=entry.pk).update(attempts=2, next_attempt_at=timezone.now())
+            self.assertEqual(outbox.relay_due(), (0, 1))
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts, entry.api_key), ('failed', 3, ''))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        self.assertEqual(outbox._backoff(1), timedelta(seconds=5))
+        self.assertEqual(outbox._backoff(3), timedelta(seconds=20))
+        self.assertEqual(outbox._backoff(20), timedelta(seconds=outbox.OUTBOX_MAX_BACKOFF))
+
+    def test_entry_whose_lease_was_taken_over_is_not_sent(self):
+        entry = self._entry()
+        [claimed] = outbox._claim(10)
+        # Another relay claimed it after the lease ran out
+        OutboxMessage.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertFalse(outbox._renew_lease(claimed))
+
+    def test_entry_finished_by_another_relay_is_not_rewritten(self):
+        entry = self._entry()
+        [claimed] = outbox._claim(10)
+        OutboxMessage.objects.filter(pk=entry.pk).update(status='sent', attempts=1)
+        with mock.patch.object(outbox, 'send_message_to_client', return_value=None):
+            self.assertFalse(outbox._deliver(claimed))
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts, entry.last_error), ('sent', 1, ''))
+
+
+@mock.patch.object(idempotency, '_maybe_purge', mock.Mock())
+class WebhookIdempotencyTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(idempotency, '_seen', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_is_claimed_once(self):
+        self.assertTrue(idempotency.claim_webhook('inst', 'MSG1'))
+        self.assertFalse(idempotency.claim_webhook('inst', 'MSG1'))
+        self.assertTrue(idempotency.claim_webhook('other', 'MSG1'))
+        self.assertEqual(ProcessedWebhook.objects.count(), 2)
+
+    def test_claim_made_by_another_worker_is_honoured(self):
+        ProcessedWebhook.objects.create(instance_id='inst', message_id='MSG1', created_at=timezone.now())
+        self.assertFalse(idempotency.claim_webhook('inst', 'MSG1'))
+
+    def test_expired_claim_is_taken_over(self):
+        expired = timezone.now() - timedelta(seconds=idempotency.IDEMPOTENCY_TTL + 60)
+        ProcessedWebhook.objects.create(instance_id='inst', message_id='MSG1', created_at=expired)
+        self.assertTrue(idempotency.claim_webhook('inst', 'MSG1'))
+        self.assertEqual(idempotency.purge_expired_webhooks(), 0)
+
+    def test_released_key_can_be_claimed_again(self):
+        idempotency.claim_webhook('inst', 'MSG1')
+        idempotency.release_webhook('inst', 'MSG1')
+        self.assertFalse(ProcessedWebhook.objects.exists())
+        self.assertTrue(idempotency.claim_webhook('inst', 'MSG1'))
+
+    @mock.patch.object(idempotency, 'IDEMPOTENCY_CACHE_SIZE', 2)
+    def test_memory_keeps_the_most_recent_keys(self):
+        for message_id in ('MSG1', 'MSG2', 'MSG3'):
+            idempotency.claim_webhook('inst', message_id)
+        self.assertEqual(list(idempotency._seen), [('inst', 'MSG2'), ('inst', 'MSG3')])
+        # Forgotten in memory, still rejected by the database
+        self.assertFalse(idempotency.claim_webhook('inst', 'MSG1'))
+
+    def test_purge_deletes_only_expired_keys(self):
+        expired = timezone.now() - timedelta(seconds=idempotency.IDEMPOTENCY_TTL + 60)
+        ProcessedWebhook.objects.create(instance_id='inst', message_id='OLD', created_at=expired)
+        ProcessedWebhook.objects.create(instance_id='inst', message_id='NEW', created_at=timezone.now())
+        self.assertEqual(idempotency.purge_expired_webhooks(), 1)
+        self.assertEqual(list(ProcessedWebhook.objects.values_list('message_id', flat=True)), ['NEW'])
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.agent = OpenAISettings.objects.create(agent_name='Support')
+        self.sara = Client.objects.create(jid='966500000001@s.whatsapp.net', name='Sara')
+        self.omar = Client.objects.create(jid='966500000002@s.whatsapp.net', name='Omar')
+        self.sent_at = timezone.now() - timedelta(hours=1)
+
+    def _message(self, client, message_type='text', reply_after=None, agent=True):
+        message = Message.objects.create(client=client, agent=self.agent if agent else None, message_type=message_type)
+        Message.objects.filter(pk=message.pk).update(timestamp=self.sent_at)
+        if reply_after is not None:
+            response = Response.objects.create(message=message, content='ok')
+            Response.objects.filter(pk=response.pk).update(timestamp=self.sent_at + timedelta(seconds=reply_after))
+        return message
+
+    def _stats(self, agent=True):
+        return DailyConversationStats.objects.get(
+            date=timezone.localdate(self.sent_at), agent=self.agent if agent else None
+        )
+
+    def test_messages_and_responses_are_counted_per_day_and_agent(self):
+        self._message(self.sara, reply_after=4)
+        self._message(self.sara, 'voice', reply_after=2)
+        self._message(self.omar, 'image')
+        self._message(self.omar, agent=False)
+        self.assertEqual(analytics.update_rollups(), (4, 2))
+
+        stats = self._stats()
+        self.assertEqual(
+            (stats.messages, stats.text_messages, stats.image_messages, stats.voice_messages,
+             stats.active_clients, stats.responses, stats.response_seconds),
+            (3, 1, 1, 1, 2, 2, 6.0),
+        )
+        self.assertEqual((self._stats(agent=False).messages, self._stats(agent=False).active_clients), (1, 1))
+
+    def test_runs_are_incremental_and_clients_are_counted_once_a_day(self):
+        self._message(self.sara, reply_after=1)
+        analytics.update_rollups()
+        self.assertEqual(analytics.update_rollups(), (0, 0))
+
+        self._message(self.sara, reply_after=3)
+        self.assertEqual(analytics.update_rollups(batch_size=1), (1, 1))
+        stats = self._stats()
+        self.assertEqual((stats.messages, stats.active_clients, stats.responses, stats.response_seconds), (2, 1, 2, 4.0))
+
+    def test_recent_rows_wait_for_the_lag(self):
+        message = Message.objects.create(client=self.sara, agent=self.agent)
+        self.assertEqual(analytics.update_rollups(), (0, 0))
+        Message.objects.filter(pk=message.pk).update(timestamp=self.sent_at)
+        self.assertEqual(analytics.update_rollups(), (1, 0))
+
+    def test_command_reports_the_counts(self):
+        self._message(self.sara, reply_after=1)
+        out = io.StringIO()
+        call_command('rollup_conversations', stdout=out)
+        self.assertIn('Rolled up 1 messages and 1 responses.', out.getvalue())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.agent = OpenAISettings.objects.create(agent_name='Support')
+        self.other_agent = OpenAISettings.objects.create(agent_name='Sales')
+        self.client_row = Client.objects.create(jid='966500000001@s.whatsapp.net', name='Sara')
+        self.messages = [
+            Message.objects.create(client=self.client_row, agent=self.agent, content=f"سؤال {i}") for i in range(5)
+        ]
+        Response.objects.create(message=self.messages[0], content='جواب', model='gpt-4o-mini', route='fast_simple', generation_ms=300)
+        Message.objects.create(client=self.client_row, agent=self.other_agent, content='other agent')
+
+    def test_rows_are_walked_in_keyset_chunks(self):
+        rows = list(export_rows(agent_id=self.agent.pk, chunk_size=2))
+        self.assertEqual([row['message_id'] for row in rows], [message.pk for message in self.messages])
+        self.assertEqual(
+            (rows[0]['response'], rows[0]['response_model'], rows[0]['response_route'], rows[0]['generation_ms']),
+            ('جواب', 'gpt-4o-mini', 'fast_simple', 300),
+        )
+        self.assertIsNone(rows[1]['response'])
+        self.assertEqual(rows[0]['timestamp'], self.messages[0].timestamp.isoformat())
+
+    def test_date_filters_are_inclusive_days(self):
+        Message.objects.filter(pk=self.messages[0].pk).update(timestamp=timezone.now() - timedelta(days=3))
+        today = timezone.localdate()
+        self.assertEqual(len(list(export_rows(agent_id=self.agent.pk, since=today, until=today))), 4)
+        self.assertEqual(len(list(export_rows(agent_id=self.agent.pk, until=today - timedelta(days=1)))), 1)
+
+    def test_csv_and_jsonl_streams(self):
+        lines = b''.join(export_stream('csv', agent_id=self.agent.pk)).decode('utf-8').splitlines()
+        rows = list(csv.DictReader(lines))
+        self.assertEqual([row['content'] for row in rows], [f"سؤال {i}" for i in range(5)])
+
+        lines = b''.join(export_stream('jsonl', compress=True, client_id=self.client_row.pk))
+        rows = [json.loads(line) for line in gzip.decompress(lines).decode('utf-8').splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['client_jid'], self.client_row.jid)
+
+    def test_view_streams_the_export_to_staff(self):
+        url = reverse('webhook:export_conversations')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        response = self.client.get(url, {'agent': self.agent.pk, 'format': 'jsonl', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('conversations.jsonl.gz', response['Content-Disposition'])
+        body = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+        self.assertEqual(len(body.splitlines()), 5)
+
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'client': 'nobody'}).status_code, 404)
+
+
+@mock.patch.object(warmup, 'connection', mock.Mock())
+class WarmUpTests(TestCase):
+    def test_failing_step_is_skipped_and_every_step_is_timed(self):
+        with mock.patch.object(warmup, 'warm_imports'), \
+                mock.patch.object(warmup, '_connect_openai', side_effect=ConnectionError('offline')), \
+                mock.patch.object(warmup, '_connect_evolution') as evolution, \
+                mock.patch.object(warmup, '_load_indexes'), \
+                mock.patch('knowledge.tokens.count_tokens'), \
+                self.assertLogs(warmup.logger, 'WARNING') as logs:
+            timings = warmup.warm_up()
+        self.assertEqual(list(timings), ['imports', 'tokenizer', 'openai', 'evolution', 'indexes'])
+        self.assertIn("Step 'openai' failed: offline", logs.output[0])
+        evolution.assert_called_once_with()
+        warmup.connection.close.assert_called_once_with()
+
+    def test_indexes_of_recently_active_agents_are_loaded(self):
+        active = OpenAISettings.objects.create(agent_name='Active')
+        idle = OpenAISettings.objects.create(agent_name='Idle')
+        client_row = Client.objects.create(jid='966500000001@s.whatsapp.net', name='Sara')
+        Message.objects.create(client=client_row, agent=active)
+        Message.objects.create(client=client_row, agent=active)
+        old = Message.objects.create(client=client_row, agent=idle)
+        Message.objects.filter(pk=old.pk).update(timestamp=timezone.now() - timedelta(days=warmup.WARMUP_ACTIVE_DAYS + 1))
+
+        with mock.patch('knowledge.index.index_manager') as manager:
+            self.assertEqual(warmup._load_indexes(), 1)
+        manager.get.assert_called_once_with(active)
+
+    @mock.patch.object(warmup, 'WARMUP_CONNECT', True)
+    def test_recent_evolution_servers_are_contacted(self):
+        OutboxMessage.objects.create(jid='a', text='hi', instance_id='inst', server_url='https://evo-1')
+        OutboxMessage.objects.create(jid='b', text='hi', instance_id='inst', server_url='https://evo-1')
+        OutboxMessage.objects.create(jid='c', text='hi', instance_id='inst', server_url='https://evo-2')
+        with mock.patch.object(outbox, 'get_session') as get_session:
+            self.assertEqual(warmup._connect_evolution(), 2)
+        self.assertEqual(
+            sorted(call.args[0] for call in get_session.return_value.head.call_args_list), ['https://evo-1', 'https://evo-2']
+        )
+
+    @mock.patch.object(warmup, '_started', False)
+    def test_background_warm_up_starts_once_per_process(self):
+        with mock.patch.object(warmup.threading, 'Thread') as thread:
+            warmup.start_warm_up()
+            warmup.start_warm_up()
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once_with()
+
+    @mock.patch.object(warmup, '_started', False)
+    @mock.patch.object(warmup, 'WARMUP_ENABLED', False)
+    def test_disabled_warm_up_does_nothing(self):
+        with mock.patch.object(warmup.threading, 'Thread') as thread:
+            warmup.start_warm_up()
+        thread.assert_not_called()
+
+
+def _voice_note(*parts):
+    """16 kHz mono audio from (kind, seconds) parts, kind being 'speech' (a tone) or 'pause'."""
+    from pydub import AudioSegment
+    from pydub.generators import Sine
+
+    audio = AudioSegment.silent(duration=0, frame_rate=16000)
+    for kind, seconds in parts:
+        if kind == 'speech':
+            audio += Sine(440, sample_rate=16000).to_audio_segment(duration=seconds * 1000, volume=-10).set_channels(1)
+        else:
+            audio += AudioSegment.silent(duration=seconds * 1000, frame_rate=16000)
+    return audio
+
+
+class _FakeWhisper:
+    """OpenAI client stand-in whose transcript of an upload is its length in seconds; uploads up to `fail_up_to_seconds` fail."""
+
+    def __init__(self, fail_up_to_seconds=None):
+        self.fail_up_to_seconds = fail_up_to_seconds
+        self.durations = []
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._create))
+        self.lock = threading.Lock()
+
+    def _create(self, model, file, language):
+        from pydub import AudioSegment
+
+        seconds = round(len(AudioSegment.from_wav(io.BytesIO(file[1]))) / 1000)
+        with self.lock:
+            self.durations.append(seconds)
+        if self.fail_up_to_seconds is not None and seconds <= self.fail_up_to_seconds:
+            raise ConnectionError('segment upload failed')
+        return SimpleNamespace(text=f" {seconds}s ")
+
+
+class TranscriptionTests(SimpleTestCase):
+    def test_cuts_land_in_the_pause_nearest_the_target(self):
+        audio = _voice_note(('speech', 20), ('pause', 1), ('speech', 20), ('pause', 1), ('speech', 15))
+        [(start, first_end), (second_start, end)] = transcription.segment_bounds(audio, 30000)
+        self.assertEqual((start, end), (0, 57000))
+        self.assertEqual(first_end, second_start)
+        self.assertTrue(20000 <= first_end <= 21000)
+
+    def test_audio_without_pauses_is_cut_at_the_target(self):
+        audio = _voice_note(('speech', 70))
+        self.assertEqual(transcription.segment_bounds(audio, 30000), [(0, 30000), (30000, 70000)])
+
+    def test_short_clip_is_one_request(self):
+        client = _FakeWhisper()
+        self.assertEqual(transcription.transcribe_audio(_voice_note(('speech', 10)), client, export_format='wav'), '10s')
+        self.assertEqual(client.durations, [10])
+
+    def test_long_clip_segments_are_joined_in_order(self):
+        client = _FakeWhisper()
+        audio = _voice_note(('speech', 20), ('pause', 1), ('speech', 20), ('pause', 1), ('speech', 15))
+        self.assertEqual(transcription.transcribe_audio(audio, client, export_format='wav'), '20s 36s')
+        self.assertEqual(sorted(client.durations), [20, 36])
+
+    def test_failed_segment_falls_back_to_one_request(self):
+        client = _FakeWhisper(fail_up_to_seconds=40)
+        with self.assertLogs(transcription.logger, 'WARNING'):
+            text = transcription.transcribe_audio(_voice_note(('speech', 70)), client, export_format='wav')
+        self.assertEqual(text, '70s')
+
+
+@mock.patch.object(routing, 'ROUTING_MIN_SAMPLES', 4)
+class RoutingTests(SimpleTestCase):
+    def setUp(self):
+        for module, name in ((deadlines, '_calls'), (routing, '_degraded_until')):
+            patcher = mock.patch.object(module, name, {})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.agent = SimpleNamespace(model_name='gpt-4o', fast_model_name='gpt-4o-mini', fallback_model_name='gpt-4.1')
+        self.long_question = 'could you explain how the refund policy works for orders shipped abroad'
+
+    def test_simple_and_confident_turns_go_to_the_fast_model(self):
+        self.assertEqual(routing.choose_model(self.agent, 'thanks!'), ('gpt-4o-mini', 'fast_simple'))
+        self.assertEqual(routing.choose_model(self.agent, self.long_question, 0.85), ('gpt-4o-mini', 'fast_confident'))
+        self.assertEqual(routing.choose_model(self.agent, self.long_question, 0.5), ('gpt-4o', 'primary'))
+        self.assertEqual(routing.choose_model(self.agent, 'first line\nsecond line'), ('gpt-4o', 'primary'))
+
+    def _record(self, seconds, ok, times):
+        for _ in range(times):
+            deadlines.record_call('chat:gpt-4o', seconds, ok=ok)
+
+    def test_degraded_model_is_replaced_by_the_fallback(self):
+        self._record(1.0, False, 3)
+        routing.check_health('gpt-4o')
+        self.assertFalse(routing.is_degraded('gpt-4o'))
+        self._record(1.0, False, 1)
+        with self.assertLogs(routing.logger, 'WARNING'):
+            routing.check_health('gpt-4o')
+        self.assertTrue(routing.is_degraded('gpt-4o'))
+        self.assertEqual(routing.choose_model(self.agent, self.long_question), ('gpt-4.1', 'fallback_degraded'))
+        self.assertEqual(routing.model_health()['gpt-4o']['calls'], 0)
+
+    def test_slow_model_is_degraded(self):
+        self._record(routing.ROUTING_LATENCY_THRESHOLD + 1, True, 4)
+        with self.assertLogs(routing.logger, 'WARNING'):
+            routing.check_health('gpt-4o')
+        self.assertTrue(routing.is_degraded('gpt-4o'))
+
+    def test_healthy_model_stays_in_use(self):
+        self._record(0.5, True, 10)
+        routing.check_health('gpt-4o')
+        self.assertEqual(routing.model_health()['gpt-4o'],
+                         {'calls': 10, 'p90_seconds': 0.5, 'error_rate': 0.0, 'degraded': False})
+
+    def test_routing_judges_the_calls_deadlines_recorded(self):
+        def complete(question, context, history, agent, model, deadline=None, share=1.0):
+            return deadlines.call_with_deadline(f"chat:{model}", mock.Mock(side_effect=TimeoutError('slow')), hedge=False)
+
+        with mock.patch.object(routing, 'complete_answer', complete), self.assertLogs(routing.logger, 'WARNING'):
+            for _ in range(4):
+                routing.generate_routed_answer(self.long_question, [], [], self.agent, 0.5)
+        # The failed attempts call_with_deadline recorded degrade both models (ROUTING_MIN_SAMPLES is 4)
+        self.assertEqual(routing.model_health(), {
+            model: {'calls': 0, 'p90_seconds': None, 'error_rate': 0.0, 'degraded': True} for model in ('gpt-4o', 'gpt-4.1')
+        })
+
+    def test_answer_passes_the_deadline_share_to_the_completion(self):
+        deadline = mock.Mock()
+        with mock.patch.object(routing, 'complete_answer', return_value='Refunds take 5 days.') as complete:
+            text, route = routing.generate_routed_answer(self.long_question, ['ctx'], [], self.agent, 0.5, deadline)
+        self.assertEqual((text, route['model'], route['route']), ('Refunds take 5 days.', 'gpt-4o', 'primary'))
+        complete.assert_called_once_with(
+            self.long_question, ['ctx'], [], self.agent, 'gpt-4o', deadline=deadline, share=routing.PRIMARY_DEADLINE_SHARE
+        )
+
+    def test_failed_call_is_retried_on_the_fallback(self):
+        deadline = mock.Mock(**{'expired.return_value': False})
+        with mock.patch.object(routing, 'complete_answer', side_effect=[TimeoutError('slow'), 'From the fallback.']) as complete, \
+                self.assertLogs(routing.logger, 'WARNING'):
+            text, route = routing.generate_routed_answer(self.long_question, [], [], self.agent, None, deadline)
+        self.assertEqual((text, route['model'], route['route']), ('From the fallback.', 'gpt-4.1', 'fallback_error'))
+        self.assertEqual(complete.call_args.kwargs, {'deadline': deadline, 'share': 1.0})
+
+    def test_no_retry_once_the_deadline_passed(self):
+        deadline = mock.Mock(**{'expired.return_value': True})
+        with mock.patch.object(routing, 'complete_answer', side_effect=TimeoutError('slow')) as complete, \
+                self.assertLogs(routing.logger, 'ERROR'):
+            text, route = routing.generate_routed_answer(self.long_question, [], [], self.agent, None, deadline)
+        self.assertEqual((text, route['route']), (routing.ERROR_REPLY, 'error'))
+        complete.assert_called_once()
+
+
+class DeadlineTests(SimpleTestCase):
+    @mock.patch.object(deadlines, 'OPENAI_MIN_TIMEOUT', 3)
+    def test_timeout_is_a_share_of_the_remaining_budget(self):
+        deadline = deadlines.Deadline(60)
+        self.assertAlmostEqual(deadline.timeout(0.5), 30, delta=0.5)
+        late = deadlines.Deadline(10, started=deadline.expires - 70)
+        self.assertTrue(late.expired())
+        self.assertEqual(late.timeout(), 3)
+
+
+@mock.patch.object(deadlines, 'OPENAI_HEDGE_MIN_SAMPLES', 5)
+@mock.patch.object(deadlines, 'OPENAI_MIN_TIMEOUT', 0.05)
+class HedgedCallTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(deadlines, '_calls', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _history(self, seconds=0.02):
+        for _ in range(5):
+            deadlines.record_call('chat:gpt-4o', seconds)
+
+    def _calls(self, *outcomes):
+        """
+        A call whose attempts behave as `outcomes` in order: 'hang' (until released), 'fail'
+        (releases the hanging ones, then raises) or a result.
+        """
+        outcomes = list(outcomes)
+        lock = threading.Lock()
+
+        def call(timeout):
+            with lock:
+                outcome = outcomes.pop(0)
+            if outcome == 'hang':
+                self.release.wait(5)
+                return 'late'
+            if outcome == 'fail':
+                self.release.set()
+                raise ConnectionError('reset')
+            return outcome
+        return mock.Mock(side_effect=call)
+
+    def test_without_history_the_call_runs_once_with_its_timeout(self):
+        call = self._calls('answer')
+        self.assertIsNone(deadlines.observed_p95('chat:gpt-4o'))
+        self.assertEqual(deadlines.call_with_deadline('chat:gpt-4o', call, deadlines.Deadline(10), share=0.5, hedge=True), 'answer')
+        self.assertAlmostEqual(call.call_args.args[0], 5, delta=0.5)
+        self.assertEqual(deadlines.call_stats('chat:gpt-4o')['calls'], 1)
+
+    def test_slow_attempt_gets_a_duplicate_and_the_first_answer_wins(self):
+        self._history()
+        call = self._calls('hang', 'answer')
+        self.assertEqual(deadlines.call_with_deadline('chat:gpt-4o', call, deadlines.Deadline(5), hedge=True), 'answer')
+        self.assertEqual(call.call_count, 2)
+
+    def test_failed_attempt_is_covered_by_the_other(self):
+        self._history()
+        call = self._calls('hang', 'fail')
+        self.assertEqual(deadlines.call_with_deadline('chat:gpt-4o', call, deadlines.Deadline(5), hedge=True), 'late')
+
+    def test_error_is_raised_when_every_attempt_fails(self):
+        self._history(seconds=0.0)
+        call = mock.Mock(side_effect=ConnectionError('reset'))
+        with self.assertRaises(ConnectionError):
+            deadlines.call_with_deadline('chat:gpt-4o', call, deadlines.Deadline(5), hedge=True)
+
+    def test_saturated_pool_times_out_instead_of_waiting_forever(self):
+        self._history()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        call = self._calls('hang', 'answer')
+        with mock.patch.object(deadlines, '_executor', executor), self.assertRaises(TimeoutError):
+            deadlines.call_with_deadline('chat:gpt-4o', call, deadlines.Deadline(0.3), hedge=True)
+        self.assertEqual(call.call_count, 1)
+        self.release.set()
+
+
+def _slow_stage():
+    time.sleep(0.1)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(profiling._stop_tracemalloc)
+
+    def test_mode_toggle(self):
+        self.assertIsNone(profiling.get_profiling_mode())
+        profiling.set_profiling_mode('stacks')
+        self.assertEqual(profiling.get_profiling_mode(), 'stacks')
+        profiling.set_profiling_mode(None)
+        self.assertIsNone(profiling.get_profiling_mode())
+        with self.assertRaises(ValueError):
+            profiling.set_profiling_mode('cprofile')
+
+    def test_nothing_is_profiled_when_off(self):
+        with self.assertNumQueries(0), profiling.profile_message('process', label='jid'):
+            pass
+        self.assertFalse(MessageProfile.objects.exists())
+
+    def test_sampled_stacks_are_stored_folded(self):
+        profiling.set_profiling_mode('stacks')
+        with profiling.profile_message('process', label='jid:inst:1'):
+            _slow_stage()
+        profile = MessageProfile.objects.get()
+        self.assertEqual((profile.kind, profile.mode, profile.label), ('process', 'stacks', 'jid:inst:1'))
+        self.assertGreater(profile.samples, 0)
+        self.assertGreaterEqual(profile.duration_ms, 100)
+        stack, count = profile.data.splitlines()[0].rsplit(' ', 1)
+        self.assertIn('_slow_stage (webhook/tests.py:', stack.split(';')[-1])
+        self.assertGreater(int(count), 0)
+
+    def test_tracemalloc_report_includes_gauges_and_stops_with_the_mode(self):
+        profiling.set_profiling_mode('tracemalloc')
+        with profiling.profile_message('process', label='jid', gauges=lambda: {'user_buffers': 3}):
+            blocks = [bytearray(1024) for _ in range(100)]
+        report = MessageProfile.objects.get().data
+        self.assertIn('user_buffers: 3', report)
+        self.assertIn('top allocation growth during this message:', report)
+        self.assertTrue(tracemalloc.is_tracing())
+        del blocks
+
+        profiling.set_profiling_mode(None)
+        with profiling.profile_message('process', label='jid'):
+            pass
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @mock.patch.object(profiling, 'PROFILE_MAX_STORED', 2)
+    def test_only_the_latest_profiles_are_kept(self):
+        profiling.set_profiling_mode('stacks')
+        for label in ('first', 'second', 'third'):
+            with profiling.profile_message('webhook', label=label):
+                pass
+        self.assertEqual(list(MessageProfile.objects.order_by('id').values_list('label', flat=True)), ['second', 'third'])
+
+    def test_staff_toggle_and_download(self):
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        url = reverse('webhook:profiling')
+        self.assertEqual(self.client.post(url, {'mode': 'flame'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'mode': 'stacks', 'ttl': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'mode': 'stacks', 'ttl': '60'}).json()['mode'], 'stacks')
+
+        with profiling.profile_message('process', label='jid'):
+            _slow_stage()
+        [listed] = self.client.get(url).json()['profiles']
+        response = self.client.get(listed['download'])
+        self.assertIn('.folded', response['Content-Disposition'])
+        self.assertIn('_slow_stage', response.content.decode())
+
+        self.assertIsNone(self.client.post(url, {'mode': 'off'}).json()['mode'])
+        self.assertEqual(self.client.get(reverse('webhook:download_profile', args=[999])).status_code, 404)
@@ -0,0 +1,107 @@
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Clips up to this many seconds go to Whisper as one request
+TRANSCRIBE_CHUNK_THRESHOLD = getattr(settings, 'TRANSCRIBE_CHUNK_THRESHOLD', 45)
+# Longer clips are cut near every TRANSCRIBE_SEGMENT_SECONDS, at a pause when there is one
+TRANSCRIBE_SEGMENT_SECONDS = getattr(settings, 'TRANSCRIBE_SEGMENT_SECONDS', 30)
+# Segments transcribed at once for one voice note
+TRANSCRIBE_CONCURRENCY = getattr(settings, 'TRANSCRIBE_CONCURRENCY', 4)
+TRANSCRIBE_MODEL = 'whisper-1'
+TRANSCRIBE_LANGUAGE = 'ar'
+
+# A pause must last this long to be a cut candidate; detection steps through the audio this coarsely
+MIN_SILENCE_MS = 400
+SILENCE_SEEK_MS = 20
+# Pauses are this much quieter than the clip's average loudness
+SILENCE_BELOW_AVERAGE_DB = 16
+# Whisper works on 16 kHz mono; sending that keeps uploads small
+WHISPER_FRAME_RATE = 16000
+
+
+def prepare_audio(audio):
+    """Downmixes and resamples a pydub AudioSegment to what Whisper uses internally."""
+    return audio.set_channels(1).set_frame_rate(WHISPER_FRAME_RATE)
+
+
+def segment_bounds(audio, segment_ms: int) -> list:
+    """
+    Splits `audio` into [(start_ms, end_ms)] of about `segment_ms` each.
+
+    Each cut is placed in the middle of the pause closest to the target length,
+    looking between half and one and a half times `segment_ms`, so words are not cut
+    in two. Without a pause in that window the audio is cut at the target length.
+    """
+    from pydub.silence import detect_silence
+
+    duration = len(audio)
+    pauses = [
+        (start + end) // 2
+        for start, end in detect_silence(
+            audio,
+            min_silence_len=MIN_SILENCE_MS,
+            silence_thresh=audio.dBFS - SILENCE_BELOW_AVERAGE_DB,
+            seek_step=SILENCE_SEEK_MS,
+        )
+    ]
+    bounds = []
+    start = 0
+    while duration - start > segment_ms * 1.5:
+        target = start + segment_ms
+        window = [cut for cut in pauses if start + segment_ms // 2 <= cut <= start + segment_ms * 3 // 2]
+        end = min(window, key=lambda cut: abs(cut - target)) if window else target
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, duration))
+    return bounds
+
+
+def _transcribe_request(client, audio, export_format: str, language: str) -> str:
+    buffer = io.BytesIO()
+    audio.export(buffer, format=export_format)
+    transcription = client.audio.transcriptions.create(
+        model=TRANSCRIBE_MODEL,
+        file=(f"audio.{export_format}", buffer.getvalue()),
+        language=language,
+    )
+    return transcription.text.strip()
+
+
+def transcribe_audio(audio, client, export_format: str = 'mp3', language: str = TRANSCRIBE_LANGUAGE,
+                     threshold: float = TRANSCRIBE_CHUNK_THRESHOLD,
+                     segment_seconds: float = TRANSCRIBE_SEGMENT_SECONDS,
+                     concurrency: int = TRANSCRIBE_CONCURRENCY) -> str:
+    """
+    Transcribes a pydub AudioSegment with Whisper.
+
+    Clips longer than `threshold` seconds are split at pauses into segments of about
+    `segment_seconds`, which are transcribed concurrently and joined in order, so the
+    latency of a long voice note is close to that of one segment instead of growing with
+    its duration. If the split path fails, the whole clip is sent as one request.
+    """
+    audio = prepare_audio(audio)
+    if len(audio) <= threshold * 1000:
+        return _transcribe_request(client, audio, export_format, language)
+
+    started = time.perf_counter()
+    try:
+        bounds = segment_bounds(audio, int(segment_seconds * 1000))
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(bounds))) as executor:
+            texts = list(executor.map(
+                lambda bound: _transcribe_request(client, audio[bound[0]:bound[1]], export_format, language),
+                bounds,
+            ))
+    except Exception as e:
+        logger.warning(f"⚠️ TRANSCRIBE: Segmented transcription failed ({e}); sending the clip as one request.")
+        return _transcribe_request(client, audio, export_format, language)
+
+    logger.info(
+        f"🎙️ TRANSCRIBE: {len(audio) / 1000:.0f}s voice note in {len(bounds)} segments, "
+        f"{(time.perf_counter() - started) * 1000:.0f}ms."
+    )
+    return ' '.join(text for text in texts if text)
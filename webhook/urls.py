@@ -4,6 +4,9 @@ from . import views
 app_name = "webhook"
 urlpatterns = [
     path('<int:agent_id>/', views.webhook, name='agent_webhook'),
+    path('export/', views.export_conversations, name='export_conversations'),
+    path('profiling/', views.profiling, name='profiling'),
+    path('profiling/<int:pk>/', views.download_profile, name='download_profile'),
     #path("", views.webhook, name="index"),
    
 ]
\ No newline at end of file
@@ -1,10 +1,74 @@
+import logging
+import threading
+import time
+from django.conf import settings
 from core.models import OpenAISettings
 from django.core.exceptions import ObjectDoesNotExist
 
+logger = logging.getLogger(__name__)
+
+# In-process agent settings cache, keyed by agent id.
+# Each entry holds the agent row, its version (updated_at), the derived prompt prefix
+# and the monotonic time it was last validated against the database.
+AGENT_CACHE_TTL = getattr(settings, 'AGENT_CACHE_TTL', 30)
+_agent_cache = {}
+_agent_cache_lock = threading.Lock()
+
+
+def _build_prompt_prefix(agent_settings: OpenAISettings) -> str:
+    """Builds the static part of the system prompt that precedes the RAG context."""
+    return f"{agent_settings.system_context}\n\n[Knowledge Base Context Start]\n"
+
+
+def _cache_agent(agent_settings: OpenAISettings, checked_at: float):
+    with _agent_cache_lock:
+        _agent_cache[agent_settings.id] = {
+            'agent': agent_settings,
+            'version': agent_settings.updated_at,
+            'prompt_prefix': _build_prompt_prefix(agent_settings),
+            'checked_at': checked_at,
+        }
+
+
+def invalidate_agent_settings(agent_id: int):
+    """Drops a cached agent so the next lookup reloads it from the database."""
+    with _agent_cache_lock:
+        _agent_cache.pop(agent_id, None)
+
+
 def get_agent_settings_by_id(agent_id: int):
-    """Retrieves a specific agent's settings by its ID, raising an error if not found."""
+    """
+    Retrieves a specific agent's settings by its ID, raising an error if not found.
+
+    Agents are served from the in-process cache. Once an entry is older than
+    AGENT_CACHE_TTL seconds, only its `updated_at` column is re-read so changes
+    saved through another worker are picked up without reloading the full row.
+    """
+    now = time.monotonic()
+    entry = _agent_cache.get(agent_id)
+    if entry and now - entry['checked_at'] < AGENT_CACHE_TTL:
+        return entry['agent']
+
     try:
-        return OpenAISettings.objects.get(id=agent_id) 
+        if entry:
+            version = OpenAISettings.objects.filter(id=agent_id).values_list('updated_at', flat=True).first()
+            if version is not None and version == entry['version']:
+                entry['checked_at'] = now
+                return entry['agent']
+            invalidate_agent_settings(agent_id)
+
+        agent_settings = OpenAISettings.objects.get(id=agent_id)
     except ObjectDoesNotExist:
         logger.error(f"Agent ID {agent_id} not found in OpenAISettings.")
-        raise ObjectDoesNotExist(f"No Agent with ID {agent_id} found.")
\ No newline at end of file
+        raise ObjectDoesNotExist(f"No Agent with ID {agent_id} found.")
+
+    _cache_agent(agent_settings, now)
+    return agent_settings
+
+
+def get_agent_prompt_prefix(agent_settings: OpenAISettings) -> str:
+    """Returns the cached system prompt prefix for an agent, rebuilding it if stale."""
+    entry = _agent_cache.get(agent_settings.id)
+    if entry and entry['version'] == agent_settings.updated_at:
+        return entry['prompt_prefix']
+    return _build_prompt_prefix(agent_settings)
@@ -1,61 +1,51 @@
 import json
 import logging
-import requests
 import threading
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse
-from .models import Client, Message, Response
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.dateparse import parse_date
+from .models import Client, Message, Response, MessageProfile
 from core.models import OpenAISettings
 from .rag_utilities import (
     get_embeddings,
     find_most_similar_question,
-    generate_answer,
-    transcribe_audio_from_base64,
-    analyze_image_from_base64,
+    transcribe_audio_from_file,
+    analyze_image_from_file,
 )
+from .ingest import parse_webhook_stream, WebhookBodyTooLarge, MAX_BODY_SIZE
+from .persistence import upsert_client, get_client_id, conversation_writer, get_recent_history
 from .utils import get_agent_settings_by_id
+from .background import background_executor
+from .idempotency import claim_webhook, release_webhook
+from .packing import pack_context, CONTEXT_CANDIDATES
+from .pipeline import Pipeline
+from .routing import generate_routed_answer
+from .deadlines import Deadline
+from knowledge.canonical import find_direct_answer
+from .export import export_stream, EXPORT_FORMATS
+from .profiling import profile_message, profiled, set_profiling_mode, get_profiling_mode, PROFILE_MODES
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import transaction
 # Removed duplicated imports
 
 logger = logging.getLogger(__name__)
 
 # Debounce settings
 DEBOUNCE_TIME = 5 
+# Evolution messageType -> Message.message_type
+MESSAGE_TYPES = {
+    'conversation': 'text',
+    'extendedTextMessage': 'text',
+    'imageMessage': 'image',
+    'audioMessage': 'voice',
+}
 _user_buffers = {} 
 
 
-def send_message_to_client(jid: str, text: str, instance_id: str, evolution_key: str, server_url: str):
-    """Sends the final text reply to the Evolution API."""
-    try:
-        url = f"{server_url}/message/sendText/{instance_id}"
-        headers = {
-            "apikey": evolution_key,
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "number": jid.split('@')[0],
-            "text": text,
-            "delay": 7000,
-            "linkPreview": True,
-        }
-        
-        # Added timeout for safety
-        response = requests.post(url, json=payload, headers=headers, timeout=(5, 15))
-        response.raise_for_status()
-        
-        logger.info(f"✅ API SUCCESS: Message sent to {jid}. Status: {response.status_code}.")
-        return response.json()
-        
-    except requests.exceptions.RequestException as e:
-        # Added detailed error logging for API failure
-        error_details = f"URL: {url}, Error: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-             error_details += f", API Response: {e.response.text}"
-        
-        logger.error(f"❌ API FAILURE: Error sending message to {jid}: {error_details}", exc_info=True)
-        return None
+def _buffer_gauges():
+    # Reported with tracemalloc profiles, to tell buffer growth from other leaks
+    return {'user_buffers': len(_user_buffers)}
 
 
 def _process_buffered_message_logic(jid: str, instance_id: str, evolution_key: str, server_url: str, user_data: dict, agent_settings: OpenAISettings, buffer_key: str):
@@ -73,6 +63,8 @@ def _process_buffered_message_logic(jid: str, instance_id: str, evolution_key: s
     user_message_content = user_data['content']
     message_type = user_data['message_type']
     image_url = user_data['image_url']
+    # The SLA clock started when the webhook arrived, so the debounce wait counts against it
+    deadline = user_data.get('deadline') or Deadline()
     
     # 💥 CRITICAL: Clear the buffer IMMEDIATELY after reading the data.
     del _user_buffers[buffer_key] 
@@ -81,66 +73,111 @@ def _process_buffered_message_logic(jid: str, instance_id: str, evolution_key: s
     logger.info(f"➡️ AI START: Processing content for {jid}: '{user_message_content[:50]}...'")
 
 
+    def queue_message():
+        # Queue Message Record (written behind by conversation_writer)
+        client_id = get_client_id(jid)
+        return conversation_writer.add_message(
+            client_id=client_id,
+            message_type=MESSAGE_TYPES.get(message_type, 'text'),
+            content=user_message_content,
+            image_url=image_url,
+            agent_id=agent_settings.id,
+        )
+
+    def build_history(message):
+        # Conversation History (includes rows that are not flushed yet)
+        conversation_history = []
+        for msg, response_content in get_recent_history(message.client_id, limit=10):
+            if msg.content:
+                conversation_history.append({"role": "user", "content": msg.content})
+                if response_content is not None:
+                    conversation_history.append({"role": "assistant", "content": response_content})
+                elif msg is not message:
+                    # Log a warning instead of passing silently
+                    logger.warning(f"Message ID {msg.id} has no corresponding response in history.")
+        return conversation_history
+
+    def embed():
+        # Network only: runs on the pipeline pool while the DB stages run here
+        return get_embeddings(
+            user_message_content,
+            model=agent_settings.embedding_model,
+            dimensions=agent_settings.embedding_dimensions,
+            deadline=deadline,
+        )
+
+    def retrieve(embedding, index):
+        if embedding is None:
+            # The embedding call failed: answer without knowledge base context rather than not at all
+            logger.warning(f"⚠️ RAG: No embedding for {jid}; answering without context.")
+            return [], None, None
+        similar_questions_info = find_most_similar_question(embedding, index, top_n=CONTEXT_CANDIDATES)
+        context = pack_context(
+            similar_questions_info,
+            similarity_floor=agent_settings.context_similarity_floor,
+            token_budget=agent_settings.context_token_budget,
+        )
+        # The best match's similarity feeds model routing
+        top_similarity = similar_questions_info[0][0] if similar_questions_info else None
+        return context, top_similarity, find_direct_answer(agent_settings, similar_questions_info)
+
+    def answer(message, history, context):
+        # `context` is the retrieve stage's result (Pipeline passes dependencies by stage name)
+        packed_context, top_similarity, direct_answer = context
+        if direct_answer:
+            # Confident FAQ hit: the entry's canonical answer is sent without a completion
+            logger.info(f"📌 DIRECT ANSWER: Top similarity {top_similarity:.3f} for {jid}.")
+            return direct_answer, {'model': '', 'route': 'direct', 'generation_ms': 0}
+        return generate_routed_answer(message.content, packed_context, history, agent_settings, top_similarity, deadline)
+
     try:
-        with transaction.atomic():
-            # 2. Create Message Record
-            client, _ = Client.objects.get_or_create(jid=jid)
-            user_message = Message.objects.create(
-                client=client,
-                message_type=message_type,
-                content=user_message_content,
-                image_url=image_url,
-            )
-
-            # 3. Build Conversation History
-            conversation_history = []
-            messages = Message.objects.filter(client=client).select_related('client', 'response').order_by('-timestamp')[:10]
-            
-            for msg in reversed(messages):
-                if msg.content:
-                    conversation_history.append({"role": "user", "content": msg.content})
-                    try:
-                        ai_response = msg.response
-                        conversation_history.append({"role": "assistant", "content": ai_response.content})
-                    except Response.DoesNotExist: 
-                        # Log a warning instead of passing silently
-                        logger.warning(f"Message ID {msg.id} has no corresponding response in history.")
-                        pass
-
-            # 4. Retrieve Context (RAG/Embeddings)
-            logger.info("➡️ RAG START: Retrieving context chunks.")
-            knowledge_base_chunks = list(agent_settings.knowledge_chunks.all())
-            
-            # CRITICAL: Ensure content is not empty before embedding (though already checked in webhook)
-            if not user_message_content:
-                reply_text = "I apologize, but I could not process your message content."
-            else:
-                user_embedding = get_embeddings(user_message.content)
-                similar_questions_info = find_most_similar_question(user_embedding, knowledge_base_chunks)
-                context_questions = [item[1].question for item in similar_questions_info]
-                
-                # 5. Generate Answer
-                reply_text = generate_answer(
-                    user_message.content,
-                    context_questions,
-                    conversation_history,
-                    agent_settings
-                )
+        # No transaction is held across the LLM round trip: the inbound message is queued
+        # first and written behind in its own short transaction, everything else is computed
+        # outside any transaction, and the reply is committed together with its outbox entry.
+        # 2-5. Message, history, index and embedding are independent; the embedding
+        # API call overlaps the DB stages, then retrieval and generation follow.
+        pipeline = Pipeline(label=jid)
+        pipeline.add('message', queue_message, inline=True)
+        pipeline.add('history', build_history, deps=['message'], inline=True)
+        # Imported on use (numpy); the URLconf loads this module in every process
+        from knowledge.index import get_agent_index
+        pipeline.add('index', lambda: get_agent_index(agent_settings), inline=True)
+        if user_message_content:
+            pipeline.add('embedding', embed)
+            pipeline.add('context', retrieve, deps=['embedding', 'index'], inline=True)
+            pipeline.add('reply', answer, deps=['message', 'history', 'context'], inline=True)
+        logger.info("➡️ RAG START: Running message pipeline.")
+        results = pipeline.run()
+        user_message = results['message']
+        # CRITICAL: Ensure content is not empty before embedding (though already checked in webhook)
+        reply_text, route = results.get('reply') or (None, {})
+        reply_text = reply_text or "I apologize, but I could not process your message content."
+        logger.info(f"✅ AI FINISHED: Reply text generated (Length: {len(reply_text)}).")
 
-            # 6. Save Response
-            Response.objects.create(message=user_message, content=reply_text)
-            logger.info(f"✅ AI FINISHED: Reply text generated (Length: {len(reply_text)}).")
+        # 6. Queue Response + outbox entry; 7. the outbox relay sends it to Evolution (with retries)
+        conversation_writer.add_reply(user_message, reply_text, jid, instance_id, server_url, evolution_key, **route)
+
+        logger.info(f"✅ PROCESS COMPLETE: Reply to {jid} queued for delivery.")
 
-        # 7. Send Reply (outside the transaction)
-        send_message_to_client(jid, reply_text, instance_id, evolution_key, server_url)
-        
-        logger.info(f"✅ PROCESS COMPLETE: Successfully processed and replied to {jid}.")
-        
     except Exception as e:
         # 🔴 CORE LOGIC FAIL: This is the critical log to check for RAG/OpenAI errors
         logger.error(f"🔴 CORE LOGIC FAIL: An error occurred while processing logic for {jid} (Message Type: {message_type}): {e}", exc_info=True)
 
 
+def _submit_buffered_message(buffer_key: str, agent_id: int):
+    """
+    Debounce timer callback. The timer thread never touches the database; the work is
+    handed to the bounded background executor, which owns the DB connections.
+    """
+    background_executor.submit(_process_buffered_message_threaded, buffer_key, agent_id)
+
+
+def _prefetch_agent_index(agent_id: int):
+    """Loads the agent's retrieval index so the debounced reply doesn't pay for the build."""
+    from knowledge.index import index_manager
+    index_manager.prefetch(get_agent_settings_by_id(agent_id))
+
+
 def _process_buffered_message_threaded(buffer_key: str, agent_id: int):
     """
     The thread-safe intermediary function. Extracts data from the buffer 
@@ -165,8 +202,9 @@ def _process_buffered_message_threaded(buffer_key: str, agent_id: int):
         # Look up the Agent inside the Thread
         agent_settings = get_agent_settings_by_id(agent_id)
         
-        # Call core logic
-        _process_buffered_message_logic(jid, instance_id, evolution_key, server_url, user_data, agent_settings, buffer_key)
+        # Call core logic (profiled when profiling is on or this message is sampled)
+        with profile_message('process', label=buffer_key, agent_id=agent_id, gauges=_buffer_gauges):
+            _process_buffered_message_logic(jid, instance_id, evolution_key, server_url, user_data, agent_settings, buffer_key)
         
     except ObjectDoesNotExist:
         logger.critical(f"❌ AGENT FAIL: Agent ID {agent_id} could not be loaded for processing.")
@@ -174,6 +212,7 @@ def _process_buffered_message_threaded(buffer_key: str, agent_id: int):
         logger.error(f"🔴 THREAD FAIL: Threaded processing failed for Agent {agent_id}: {e}", exc_info=True)
 
 @csrf_exempt
+@profiled('webhook', label=lambda request, agent_id: f"agent {agent_id}", gauges=_buffer_gauges)
 def webhook(request, agent_id: int):
     """
     The main entry point for all Webhook messages.
@@ -181,8 +220,18 @@ def webhook(request, agent_id: int):
     if request.method != 'POST':
         return HttpResponse(status=405)
 
+    # The streamed body bypasses DATA_UPLOAD_MAX_MEMORY_SIZE; oversized ones are refused before reading
+    content_length = request.META.get('CONTENT_LENGTH')
+    if content_length and content_length.isdigit() and int(content_length) > MAX_BODY_SIZE:
+        logger.warning(f"⚠️ WEBHOOK: Refusing a {content_length}-byte body for Agent {agent_id}.")
+        return JsonResponse({'status': 'error', 'message': 'Payload too large'}, status=413)
+
+    deadline = Deadline()
+    media_file = None
+    claimed_key = None
     try:
-        request_body = json.loads(request.body.decode('utf-8'))
+        # Parse the body incrementally; any base64 media is decoded straight into a spooled file
+        request_body, media_file = parse_webhook_stream(request)
         
         # ... (Extract connection data) ...
         instance_id = request_body.get('instance')
@@ -209,14 +258,15 @@ def webhook(request, agent_id: int):
             logger.error("JID or Message ID not found in webhook data.")
             return JsonResponse({'status': 'error', 'message': 'JID or Message ID not found'}, status=400)
 
-        # Update/Create Client data
-        client, created = Client.objects.get_or_create(
-            jid=jid,
-            defaults={'name': push_name}
-        )
-        if not created and client.name != push_name:
-            client.name = push_name
-            client.save()
+        # 1. Idempotency: Evolution retries (on this or any other worker, before or after
+        # processing) are rejected before any transcription, vision or LLM work
+        if not claim_webhook(instance_id, message_key_id):
+            logger.warning(f"⚠️ DEDUPLICATION: Ignoring repeated webhook for message ID: {message_key_id}.")
+            return JsonResponse({'status': 'ignored', 'message': 'Message ID already received.'}, status=200)
+        claimed_key = (instance_id, message_key_id)
+
+        # Update/Create Client data (single upsert, skipped when the cached name is unchanged)
+        upsert_client(jid, push_name)
 
         user_message_content = None
         image_url = None
@@ -229,15 +279,14 @@ def webhook(request, agent_id: int):
             image_message_data = message_body.get('imageMessage', {})
             # Extract the caption (the text question)
             user_message_content = message_body.get('imageMessage', {}).get('caption')
-            # Extract the Base64 data 
-            base64_data = request_body.get('data', {}).get('message', {}).get('base64') 
 
-            if base64_data:
-                logger.info(f"🖼️ Received Base64 image with length: {len(base64_data)}")
+            if media_file is not None:
+                logger.info("🖼️ Received Base64 image, analyzing spooled media.")
                 # 3. Analyze the image and replace the content with the analysis text
-                user_message_content = analyze_image_from_base64(
-                    base64_image=base64_data,
-                    user_question=user_message_content
+                user_message_content = analyze_image_from_file(
+                    image_file=media_file,
+                    user_question=user_message_content,
+                    deadline=deadline,
                 )
             else:
                 # Handle case where no Base64 data is found
@@ -249,13 +298,12 @@ def webhook(request, agent_id: int):
         
         elif message_type == 'audioMessage':
             audio_message_data = message_body.get('audioMessage', {})
-            base64_data = request_body.get('data', {}).get('message', {}).get('base64')
             mimetype = audio_message_data.get('mimetype', 'audio/ogg')
             voice_note_url = audio_message_data.get('url')
             
-            if base64_data:
+            if media_file is not None:
                 print("✅ Found Base64 audio, starting transcription...")
-                user_message_content = transcribe_audio_from_base64(base64_data, mimetype)
+                user_message_content = transcribe_audio_from_file(media_file, mimetype, deadline=deadline)
             else:
                 logger.warning("❌ No Base64 audio found in the payload.")
                 user_message_content = "[Audio message, but no Base64 found]"
@@ -270,20 +318,9 @@ def webhook(request, agent_id: int):
             return JsonResponse({'status': 'unsupported', 'message': 'Cannot process messages without text content.'}, status=200)
             
 
-        # 2. Setup the Debounce Buffer and Handle Deduplication
+        # 2. Setup the Debounce Buffer (duplicates were already rejected by claim_webhook)
         buffer_key = f"{jid}:{instance_id}:{message_key_id}"
 
-        # 2a. Duplicate Message Check (Deduplication)
-        if buffer_key in _user_buffers:
-            if _user_buffers[buffer_key].get('timer') and _user_buffers[buffer_key]['timer'].is_alive():
-                _user_buffers[buffer_key]['timer'].cancel()
-                logger.warning(f"⚠️ DEDUPLICATION: Ignoring DUPLICATE webhook POST for message ID: {message_key_id}. Timer cancelled.")
-                return JsonResponse({'status': 'ignored', 'message': 'Duplicate message ID received, cancelling previous timer.'}, status=200)
-            # If the key exists but the timer is NOT alive, it means the message was processed successfully (or failed fully).
-            # We ignore it to prevent reprocessing, as the message ID is the key.
-            logger.warning(f"⚠️ DEDUPLICATION: Message ID {message_key_id} already exists in buffer (processed/failed). Ignoring.")
-            return JsonResponse({'status': 'ignored', 'message': 'Message ID already processed.'}, status=200)
-            
         # 2b. Debounce/New Message Logic
         _user_buffers[buffer_key] = {
             'content': user_message_content,
@@ -291,17 +328,23 @@ def webhook(request, agent_id: int):
             'image_url': image_url,
             'instance_id': instance_id,
             'evolution_key': evolution_key,
-            'server_url': server_url
+            'server_url': server_url,
+            'deadline': deadline,
         }
 
         # 3. Restart the Debounce Timer
         new_timer = threading.Timer(
             DEBOUNCE_TIME, 
-            _process_buffered_message_threaded, 
+            _submit_buffered_message, 
             args=[buffer_key, agent_id] 
         )
         new_timer.start()
         _user_buffers[buffer_key]['timer'] = new_timer
+
+        # Warm a cold (or evicted) agent's index while the debounce timer runs
+        from knowledge.index import index_manager
+        if not index_manager.is_loaded(agent_id):
+            background_executor.submit(_prefetch_agent_index, agent_id)
         
         logger.info(f"✅ WEBHOOK: Message {message_key_id} received. Debounce timer set to {DEBOUNCE_TIME}s.")
 
@@ -313,11 +356,104 @@ def webhook(request, agent_id: int):
         })
     
     except ObjectDoesNotExist:
+        if claimed_key:
+            release_webhook(*claimed_key)
         logger.error(f"Attempted to access unknown Agent ID: {agent_id}")
         return JsonResponse({'status': 'error', 'message': f'Agent ID {agent_id} not found.'}, status=404)
+    except WebhookBodyTooLarge as e:
+        logger.warning(f"⚠️ WEBHOOK: {e} (Agent {agent_id})")
+        return JsonResponse({'status': 'error', 'message': 'Payload too large'}, status=413)
     except json.JSONDecodeError as e:
         logger.error(f"Invalid JSON received: {e}")
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
     except Exception as e:
+        # Let Evolution's retry of this message through
+        if claimed_key:
+            release_webhook(*claimed_key)
         logger.error(f"🔴 UNEXPECTED FAIL: An unexpected error occurred in webhook for Agent {agent_id}: {e}", exc_info=True)
-        return JsonResponse({'status': 'error', 'message': 'Internal Server Error'}, status=500)
\ No newline at end of file
+        return JsonResponse({'status': 'error', 'message': 'Internal Server Error'}, status=500)
+    finally:
+        if media_file is not None:
+            media_file.close()
+
+
+@staff_member_required
+def export_conversations(request):
+    """
+    Streams conversation logs for QA as CSV or JSONL, optionally gzipped.
+    Query parameters: agent (id), client (jid), since / until (YYYY-MM-DD), format (csv|jsonl), gzip (1),
+    archive (1: include archived history).
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'status': 'error', 'message': f'Unknown format {fmt}.'}, status=400)
+    filters = {}
+    if request.GET.get('agent'):
+        if not request.GET['agent'].isdigit():
+            return JsonResponse({'status': 'error', 'message': 'agent must be an id.'}, status=400)
+        filters['agent_id'] = int(request.GET['agent'])
+    if request.GET.get('client'):
+        client_id = Client.objects.filter(jid=request.GET['client']).values_list('pk', flat=True).first()
+        if client_id is None:
+            return JsonResponse({'status': 'error', 'message': 'Unknown client.'}, status=404)
+        filters['client_id'] = client_id
+    for name in ('since', 'until'):
+        if request.GET.get(name):
+            day = parse_date(request.GET[name])
+            if day is None:
+                return JsonResponse({'status': 'error', 'message': f'{name} must be YYYY-MM-DD.'}, status=400)
+            filters[name] = day
+    filters['include_archive'] = request.GET.get('archive') == '1'
+    compress = request.GET.get('gzip') == '1'
+
+    _, content_type = EXPORT_FORMATS[fmt]
+    filename = f"conversations.{fmt}" + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        export_stream(fmt, compress, **filters),
+        content_type='application/gzip' if compress else f'{content_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@staff_member_required
+def profiling(request):
+    """
+    GET: the current profiling mode and the latest stored profiles.
+    POST mode=stacks|tracemalloc|off (and optionally ttl, in seconds) profiles every
+    message from now on, or stops; sampled profiling (PROFILE_SAMPLE_RATE) is unaffected.
+    """
+    if request.method == 'POST':
+        mode = request.POST.get('mode')
+        if mode not in PROFILE_MODES + ('off',):
+            return JsonResponse({'status': 'error', 'message': f'mode must be one of {", ".join(PROFILE_MODES)} or off.'}, status=400)
+        ttl = request.POST.get('ttl', '')
+        if ttl and not ttl.isdigit():
+            return JsonResponse({'status': 'error', 'message': 'ttl must be a number of seconds.'}, status=400)
+        if mode == 'off':
+            set_profiling_mode(None)
+        elif ttl:
+            set_profiling_mode(mode, int(ttl))
+        else:
+            set_profiling_mode(mode)
+        logger.info(f"🔬 PROFILE: Mode set to {mode} by {request.user}.")
+
+    profiles = [
+        dict(profile, download=f"{request.path.rstrip('/')}/{profile['id']}/")
+        for profile in MessageProfile.objects.order_by('-id').values(
+            'id', 'kind', 'mode', 'label', 'agent_id', 'duration_ms', 'samples', 'created_at'
+        )[:50]
+    ]
+    return JsonResponse({'mode': get_profiling_mode(), 'profiles': profiles})
+
+
+@staff_member_required
+def download_profile(request, pk: int):
+    """A stored profile: folded stacks (flamegraph.pl, speedscope) or a tracemalloc report."""
+    profile = MessageProfile.objects.filter(pk=pk).first()
+    if profile is None:
+        return JsonResponse({'status': 'error', 'message': 'Profile not found.'}, status=404)
+    extension = 'folded' if profile.mode == 'stacks' else 'txt'
+    response = HttpResponse(profile.data, content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}-{profile.kind}.{extension}"'
+    return response
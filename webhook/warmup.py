@@ -0,0 +1,119 @@
+import importlib
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = getattr(settings, 'WARMUP_ENABLED', True)
+# Open TLS connections to OpenAI and recent Evolution servers during warm-up
+WARMUP_CONNECT = getattr(settings, 'WARMUP_CONNECT', True)
+# Agents that received messages within this many days get their retrieval index preloaded
+WARMUP_ACTIVE_DAYS = getattr(settings, 'WARMUP_ACTIVE_DAYS', 7)
+WARMUP_MAX_AGENTS = getattr(settings, 'WARMUP_MAX_AGENTS', 20)
+WARMUP_CONNECT_TIMEOUT = 5
+
+# Imported lazily by the request path; loading them before fork lets workers share the pages
+HEAVY_MODULES = ('numpy', 'openai', 'pydub', 'requests', 'knowledge.index')
+
+_started = False
+_started_lock = threading.Lock()
+
+
+def warm_imports() -> dict:
+    """
+    Imports the heavy dependencies. Safe before fork (no threads, sockets or DB
+    connections), so it runs from the WSGI module, i.e. in the gunicorn master with --preload.
+    Returns milliseconds per module.
+    """
+    timings = {}
+    for name in HEAVY_MODULES:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        timings[name] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def _connect_openai():
+    from .rag_utilities import get_openai_client
+    client = get_openai_client()
+    if WARMUP_CONNECT:
+        # Any cheap authenticated call leaves a warm connection in the client's pool
+        client.with_options(timeout=WARMUP_CONNECT_TIMEOUT, max_retries=0).models.list()
+
+
+def _connect_evolution():
+    from .models import OutboxMessage
+    from .outbox import get_session
+    session = get_session()
+    if not WARMUP_CONNECT:
+        return 0
+    servers = set(OutboxMessage.objects.order_by('-id').values_list('server_url', flat=True)[:200])
+    for server_url in servers:
+        try:
+            session.head(server_url, timeout=WARMUP_CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"⚠️ WARMUP: Could not reach Evolution server {server_url}: {e}")
+    return len(servers)
+
+
+def _load_indexes():
+    from core.models import OpenAISettings
+    from knowledge.index import index_manager
+    since = timezone.now() - timedelta(days=WARMUP_ACTIVE_DAYS)
+    agents = (
+        OpenAISettings.objects.filter(messages__timestamp__gte=since)
+        .distinct()
+        .order_by('id')[:WARMUP_MAX_AGENTS]
+    )
+    loaded = 0
+    for agent in agents:
+        # Respects the memory budget; a message arriving meanwhile waits for the same build
+        index_manager.get(agent)
+        loaded += 1
+    return loaded
+
+
+def warm_up() -> dict:
+    """
+    Prepares a worker for its first message: heavy imports, the tiktoken encoding,
+    the OpenAI and Evolution connection pools, and the retrieval indexes of recently
+    active agents. Each step is independent; a failing one is logged and skipped.
+    Returns milliseconds per step.
+    """
+    from knowledge.tokens import count_tokens
+
+    steps = (
+        ('imports', warm_imports),
+        ('tokenizer', lambda: count_tokens('warm up')),
+        ('openai', _connect_openai),
+        ('evolution', _connect_evolution),
+        ('indexes', _load_indexes),
+    )
+    timings = {}
+    try:
+        for name, step in steps:
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning(f"⚠️ WARMUP: Step '{name}' failed: {e}")
+            timings[name] = (time.perf_counter() - started) * 1000
+    finally:
+        connection.close()
+    logger.info("🔥 WARMUP: " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in timings.items()))
+    return timings
+
+
+def start_warm_up():
+    """Runs warm_up() once per process on a background thread, so the worker starts serving right away."""
+    global _started
+    with _started_lock:
+        if _started or not WARMUP_ENABLED:
+            return
+        _started = True
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()